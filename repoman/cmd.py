@@ -145,8 +145,8 @@ def parse_args():
         '-t', '--temp-dir', action='store', default=None,
         help=(
             'Temporary directory to use, will generate it if not passed. '
-            'Valid values are: "generate" (default), "generate-in-repo", or '
-            'a path '
+            'Valid values are: "auto" (default), "generate", '
+            '"generate-in-repo", "staging", or a path '
         ),
     )
     parser.add_argument(
@@ -316,8 +316,9 @@ def get_latest_repo(args, config, base_repo):
     )
 
 
-def do_createrepo(repo):
+def do_createrepo(config, repo):
     LOGGER.info('Regenerating repository metadata for %s', repo.path)
+    config.set('incremental_createrepo', 'false')
     repo.save()
     return 0
 
@@ -463,7 +464,7 @@ def main():
     elif args.repoaction == 'remove-old':
         exit_code = do_remove_old(args, config, repo)
     elif args.repoaction == 'createrepo':
-        exit_code = do_createrepo(repo)
+        exit_code = do_createrepo(config, repo)
     elif args.repoaction in ['sign-rpms', 'sign-artifacts']:
         exit_code = do_sign_artifacts(repo)
 
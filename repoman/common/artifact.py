@@ -37,9 +37,10 @@ For clarification, here's a dictionary like diagram::
 
 **NOTE**:You have to implement at least the Artifact class
 """
-import hashlib
+import bisect
 import logging
 import os
+import string
 
 
 from abc import ABCMeta
@@ -48,17 +49,47 @@ from abc import abstractproperty
 import six
 from six import itervalues
 
-from functools import cmp_to_key
-
-from .utils import cmpfullver
 from .utils import download
+from .utils import get_file_digests
+from .utils import get_fullver_key
 from .utils import sign_detached
 
 logger = logging.getLogger(__name__)
+# Marks the metadata that was not read yet
+NOT_LOADED = object()
+
+
+class FormatVars(dict):
+    """
+    Attributes and properties of an artifact, as format variables, that are
+    got only when used, so the lazily loaded ones are not loaded if not
+    needed. As it has no keys until used, use it with
+    :meth:`string.Formatter.vformat`, not unpacking it with ``**``
+    """
+    def __init__(self, artifact):
+        super(FormatVars, self).__init__()
+        self.artifact = artifact
+
+    def __missing__(self, key):
+        if key.startswith('__'):
+            raise KeyError(key)
+        try:
+            value = getattr(self.artifact, key)
+            if value is NOT_LOADED:
+                # not loaded yet private attribute, use it's property
+                value = getattr(self.artifact, key.lstrip('_'))
+        except AttributeError:
+            raise KeyError(key)
+        self[key] = value
+        return value
 
 
 @six.add_metaclass(ABCMeta)
 class Artifact(object):
+    __slots__ = ('path', '_digests')
+    # if True, the digests will be cached in the file extended attributes
+    digests_xattr = False
+
     def __init__(self, path, temp_dir='/tmp', verify_ssl=True):
         """
         :param path: Path or url to the artifact
@@ -77,7 +108,15 @@ class Artifact(object):
             path = fpath
         self.path = path
         # will be calculated if needed
-        self._md5 = None
+        self._digests = None
+
+    @property
+    def origin(self):
+        """
+        Path or url to add this artifact from to another store, it's path if
+        the artifact is complete locally
+        """
+        return self.path
 
     @abstractproperty
     def version(self):
@@ -107,15 +146,47 @@ class Artifact(object):
     def type(self):
         return 'artifact'
 
+    @property
+    def digests(self):
+        """
+        Lazy calculation of the digests of the artifact file (md5, sha256 and
+        sha512), all of them with a single read of the file
+        """
+        if self._digests is None:
+            self._digests = get_file_digests(
+                self.path,
+                use_xattr=self.digests_xattr,
+            )
+        return self._digests
+
     @property
     def md5(self):
+        return self.digests['md5']
+
+    @property
+    def sha256(self):
+        return self.digests['sha256']
+
+    @property
+    def sha512(self):
+        return self.digests['sha512']
+
+    @property
+    def format_vars(self):
         """
-        Lazy md5 calculation.
+        Attributes and properties of the artifact, as format variables (for
+        example, for the store path), see :class:`FormatVars`
         """
-        if self._md5 is None:
-            with open(self.path, 'rb') as fdno:
-                self._md5 = hashlib.md5(fdno.read()).hexdigest()
-        return self._md5
+        return FormatVars(self)
+
+    def format_path(self, path_template):
+        """
+        Returns the given path template, formatted with the attributes and
+        properties of the artifact, like '{name}/{version}'
+        """
+        return string.Formatter().vformat(
+            path_template, (), self.format_vars,
+        )
 
     def generate_path(self):
         """
@@ -153,6 +224,8 @@ class ArtifactInode(list, object):
     """
     Simple list, abstracts a set of rpm instances
     """
+    __slots__ = ('inode',)
+
     def __init__(self, inode):
         self.inode = inode
         super(ArtifactInode, self).__init__(self)
@@ -183,22 +256,53 @@ class ArtifactInode(list, object):
 
 
 class ArtifactVersion(dict, object):
-    """Abstracts a set of artifacts inodes for a version"""
+    """
+    Abstracts a set of artifacts inodes for a version
+
+    It keeps track of whether it has any binary artifacts (the ones that have
+    no is_source attribute or it's false), as the source only versions are
+    not taken into account by some stores when getting the latest ones.
+    """
+    __slots__ = ('version', 'inode_class', 'has_binary')
+
     def __init__(self, version, inode_class=ArtifactInode):
         self.version = version
         super(ArtifactVersion, self).__init__(self)
         self.inode_class = inode_class
+        self.has_binary = False
 
     def add_artifact(self, artifact):
         if artifact.inode not in self:
             self[artifact.inode] = self.inode_class(artifact.inode)
         self[artifact.inode].append(artifact)
+        if not getattr(artifact, 'is_source', False):
+            self.has_binary = True
         return True
 
+    def update_inode(self, artifact, old_inode):
+        """
+        Moves the given artifact, that was added when it's file had the
+        given inode, to the entry of it's current inode, after the file was
+        replaced
+        """
+        old_arts = self.get(old_inode, [])
+        for pos, old_art in enumerate(old_arts):
+            if old_art is artifact:
+                old_arts.pop(pos)
+                break
+        if not old_arts:
+            self.pop(old_inode, None)
+        self.add_artifact(artifact)
+
     def delete_inode(self, inode, noop=False):
         if inode in self:
             self[inode].delete(noop)
             self.pop(inode)
+            self.has_binary = any(
+                not getattr(artifact, 'is_source', False)
+                for inode_arts in itervalues(self)
+                for artifact in inode_arts
+            )
 
     def get_artifacts(self, regmatch=None, fmatch=None):
         arts = []
@@ -222,28 +326,69 @@ class ArtifactVersion(dict, object):
 
 
 class ArtifactName(dict, object):
-    """Dict of available versions for an artifact name"""
+    """
+    Dict of available versions for an artifact name
+
+    It keeps also an index of the versions sorted from oldest to newest, with
+    their precomputed sort keys, so checking and getting the newest ones does
+    not require comparing all the versions each time.
+    """
+    __slots__ = ('name', 'version_class', '_sorted_keys', '_sorted_versions')
+
     def __init__(self, name, version_class=ArtifactVersion):
         self.name = name
+        self._sorted_keys = []
+        self._sorted_versions = []
         super(ArtifactName, self).__init__(self)
         self.version_class = version_class
 
+    def __setitem__(self, version, artifact_version):
+        if version not in self:
+            key = get_fullver_key(version)
+            pos = bisect.bisect_right(self._sorted_keys, key)
+            self._sorted_keys.insert(pos, key)
+            self._sorted_versions.insert(pos, version)
+        super(ArtifactName, self).__setitem__(version, artifact_version)
+
+    def __delitem__(self, version):
+        super(ArtifactName, self).__delitem__(version)
+        self._remove_sorted(version)
+
+    def pop(self, version, *default):
+        if version in self:
+            self._remove_sorted(version)
+        return super(ArtifactName, self).pop(version, *default)
+
+    def _remove_sorted(self, version):
+        key = get_fullver_key(version)
+        pos = bisect.bisect_left(self._sorted_keys, key)
+        while self._sorted_versions[pos] != version:
+            pos += 1
+        del self._sorted_keys[pos]
+        del self._sorted_versions[pos]
+
+    def is_newer(self, version):
+        """
+        Checks if the given version is newer than all the versions there
+        """
+        return (
+            not self._sorted_keys or
+            get_fullver_key(version) > self._sorted_keys[-1]
+        )
+
     def add_artifact(self, artifact, onlyifnewer):
-        if onlyifnewer and (
-            artifact.ver_rel in self or
-            next(
-                (
-                    ver for ver in self
-                    if cmpfullver(ver, artifact.version) >= 0
-                ),
-                None,
-            )
-        ):
+        if onlyifnewer and not self.is_newer(artifact.version):
             return False
         elif artifact.version not in self:
             self[artifact.version] = self.version_class(artifact.version)
         return self[artifact.version].add_artifact(artifact)
 
+    def iter_newest(self):
+        """
+        Iterates over the versions from newest to oldest
+        """
+        return reversed(self._sorted_versions)
+
     def get_latest(self, num=1):
         """
         Returns the list of available inodes for the latest version
@@ -251,17 +396,20 @@ class ArtifactName(dict, object):
         """
         if not self:
             return None
-        if not num:
-            num = len(self)
-        sorted_list = list(self)
-        sorted_list.sort(key=cmp_to_key(cmpfullver))
         latest = {}
-        if num > len(sorted_list):
-            num = len(sorted_list)
-        for pos in six.moves.xrange(num):
-            latest[sorted_list[pos]] = self.get(sorted_list[pos])
+        for version in self.iter_newest():
+            if num and len(latest) >= num:
+                break
+            latest[version] = self[version]
         return latest
 
+    def is_latest(self, version):
+        """
+        Checks if the given version is the latest one
+        """
+        latest = self.get_latest()
+        return not latest or version in latest
+
     def delete_version(self, version, noop=False):
         if version in self:
             for inode in list(self[version]):
@@ -299,6 +447,8 @@ class ArtifactList(dict, object):
     """
     Dict of artifacts, by name
     """
+    __slots__ = ('name', 'name_class')
+
     def __init__(self, name, name_class=ArtifactName):
         self.name = name
         super(ArtifactList, self).__init__(self)
@@ -15,8 +15,11 @@ DEFAULT_CONFIG = """
 # Comma separated list of paths where repositories can be found and/or created
 allowed_repo_paths =
 
-# Valid values are 'generate', or a path
-temp_dir = generate
+# Where to download the artifacts to, valid values are 'generate' (under
+# /tmp), 'generate-in-repo', 'staging' (under the .repoman dir of the repo, so
+# they are hardlinked into place instead of copied), 'auto' (staging if the
+# repo is not in the same filesystem as /tmp, generate otherwise) or a path
+temp_dir = auto
 
 # Path to the signing key, if empty it will not sign
 # If the passphrase is 'ask', it will interactively prompt for it (unless
@@ -36,6 +39,29 @@ verify_ssl = true
 # What to do whet a source to be added has no artifacts valid values are
 # fail|warn|ignore
 on_empty_source = fail
+
+# Number of processes to use to read the artifacts metadata when loading a
+# repo, 0 to use one per cpu. Repos with just a few artifacts to read are
+# always loaded with a single process
+load_workers = 0
+
+# Comma separated list of ways to place the added artifacts into the stores,
+# tried in order until one works for the given files: link (hardlink),
+# reflink (clone the file blocks, on btrfs or xfs), copy_range (copy inside
+# the kernel) and copy (copy through user space)
+copy_strategies = link,reflink,copy_range,copy
+
+# Number of artifacts to download at the same time when adding a source, and
+# maximum of them to download at the same time from the same server
+download_workers = 4
+download_host_limit = 4
+
+# Directory to keep the downloaded artifacts in, to reuse them between runs
+# and repos (for example ~/.cache/repoman/downloads), empty to not keep them,
+# and the maximum size of it (in bytes or with a K, M, G or T suffix),
+# removing the least recently used files when it's exceeded
+download_cache_dir =
+download_cache_size = 10G
 """
 
 logger = logging.getLogger(__name__)
@@ -0,0 +1,447 @@
+"""
+This module holds the helpers to download many artifacts at the same time,
+reusing the connections to the servers they come from, and to keep them in a
+persistent cache shared between runs and repos::
+
+    download_cache_dir
+    ├── index.json            <- url to validators, digest and last use
+    ├── index.lock
+    ├── locks
+    │   └── $url_sha256[:3]   <- held while getting those urls
+    ├── objects
+    │   └── $sha[:2]
+    │       └── $sha256       <- the downloaded files, by content
+    └── partial
+        └── $tmpdir           <- downloads in progress, one dir each
+"""
+import contextlib
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+from six.moves.urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows
+    fcntl = None
+
+from .utils import (
+    copy,
+    download,
+    get_file_digests,
+    thread_map,
+)
+
+
+logger = logging.getLogger(__name__)
+# Urls whose downloads share a lock file, by the start of their hash, so
+# there's a fixed number of lock files
+LOCK_HASH_CHARS = 3
+# The files taken from the cache might be modified later (signed, for
+# example), so they are never hardlinked to the cached ones
+CACHE_COPY_STRATEGIES = ('reflink', 'copy_range', 'copy')
+
+
+def is_url(path):
+    return path.startswith('http:') or path.startswith('https:')
+
+
+@contextlib.contextmanager
+def file_lock(lock_path):
+    """
+    Holds an exclusive lock on the given file, shared with the other
+    processes (and threads) that lock it, creating it if needed
+    """
+    with open(lock_path, 'a') as lock_fd:
+        if fcntl is not None:
+            fcntl.flock(lock_fd.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_fd.fileno(), fcntl.LOCK_UN)
+
+
+class DownloadCache(object):
+    """
+    Persistent cache of downloaded files, keyed by url and the ETag and
+    Last-Modified headers the server returned for it, and stored by content
+    digest, so the same file from different urls is stored once. The cached
+    files are copied into place, cloning them when possible.
+
+    Urls without any of those headers are never cached, as there's no way to
+    tell if they changed.
+
+    The cache can be used by several processes at the same time, each url is
+    downloaded by only one of them at a time (the others wait and then use
+    the cached file) into a dir of it's own, and the index is always updated
+    by reading it again, so the changes of the others are not lost.
+    """
+    VERSION = 1
+    # Partial downloads not touched for this long are from dead processes
+    PARTIAL_MAX_AGE = 24 * 3600
+
+    def __init__(self, cache_dir, max_size):
+        """
+        :param cache_dir: Directory to keep the cache in
+        :param max_size: Maximum size of the cached files, in bytes, the least
+            recently used ones are removed when it's exceeded
+        """
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+        self.index_path = os.path.join(self.cache_dir, 'index.json')
+        self.lock = threading.Lock()
+        self.entries = {}
+        # last use of the cached urls not yet written to the index
+        self.used = {}
+        for dirname in ('objects', 'partial', 'locks'):
+            dirpath = os.path.join(self.cache_dir, dirname)
+            if not os.path.exists(dirpath):
+                os.makedirs(dirpath)
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path) as index_fd:
+                index = json.load(index_fd)
+        except (IOError, OSError, ValueError):
+            return
+        if index.get('version') == self.VERSION:
+            self.entries = index.get('entries', {})
+
+    def save(self):
+        """
+        Writes the index to disk, atomically replacing the old one
+        """
+        try:
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(tmp_fd, 'w') as index_fd:
+                json.dump(
+                    {'version': self.VERSION, 'entries': self.entries},
+                    index_fd,
+                )
+            os.rename(tmp_path, self.index_path)
+        except (IOError, OSError) as exc:
+            logger.warn('Failed to save the download cache index: %s', exc)
+
+    @contextlib.contextmanager
+    def locked_index(self):
+        """
+        Holds the lock of the index, with the current entries loaded from
+        disk, saving them back on exit
+        """
+        with self.lock:
+            with file_lock(os.path.join(self.cache_dir, 'index.lock')):
+                self.load()
+                for url, last_used in self.used.items():
+                    if url in self.entries:
+                        self.entries[url]['last_used'] = max(
+                            self.entries[url]['last_used'], last_used,
+                        )
+                yield self.entries
+                self.save()
+                self.used = {}
+
+    def get_object_path(self, digest):
+        return os.path.join(self.cache_dir, 'objects', digest[:2], digest)
+
+    def lookup(self, url):
+        """
+        Returns the cache entry for the given url, if the file is there
+        """
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        try:
+            if os.path.getsize(
+                self.get_object_path(entry['sha256'])
+            ) != entry['size']:
+                return None
+        except OSError:
+            return None
+        return entry
+
+    @staticmethod
+    def is_modified(url, entry, session, verify=True):
+        """
+        Checks with a conditional request if the given url changed since the
+        cached entry was downloaded
+        """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        response = session.get(
+            url, stream=True, verify=verify, headers=headers,
+        )
+        try:
+            return response.status_code != 304
+        finally:
+            response.close()
+
+    def link(self, url, entry, dest_path):
+        """
+        Places the cached file of the given entry in dest_path
+
+        :returns: True if it was placed, False if the file is not there
+            anymore (removed by another process)
+        """
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        try:
+            copy(
+                self.get_object_path(entry['sha256']),
+                dest_path,
+                strategies=CACHE_COPY_STRATEGIES,
+            )
+        except OSError as oerror:
+            if oerror.errno != errno.ENOENT:
+                raise
+            return False
+        with self.lock:
+            self.used[url] = time.time()
+        return True
+
+    def fetch(self, url, dest_path, session=None, verify=True,
+              show_progress=True):
+        """
+        Gets the given url into dest_path, from the cache if it's there and
+        did not change in the server, downloading it into the cache otherwise
+        """
+        session = session if session is not None else requests
+        url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        lock_path = os.path.join(
+            self.cache_dir, 'locks', url_hash[:LOCK_HASH_CHARS],
+        )
+        with file_lock(lock_path):
+            # another process might have just downloaded it, the index is
+            # replaced atomically, so it can be read without locking it
+            with self.lock:
+                self.load()
+                entry = self.lookup(url)
+            if (
+                entry is not None and
+                not self.is_modified(url, entry, session, verify=verify) and
+                self.link(url, entry, dest_path)
+            ):
+                logger.info('Using the cached download of %s', url)
+                return
+
+            partial_dir = tempfile.mkdtemp(
+                dir=os.path.join(self.cache_dir, 'partial'),
+            )
+            try:
+                partial_path = os.path.join(partial_dir, url_hash)
+                validators = download(
+                    url, partial_path,
+                    verify=verify, session=session,
+                    show_progress=show_progress,
+                )
+                if os.path.exists(dest_path):
+                    os.remove(dest_path)
+                copy(
+                    partial_path, dest_path, strategies=CACHE_COPY_STRATEGIES,
+                )
+                if (
+                    validators.get('etag') or
+                    validators.get('last_modified')
+                ):
+                    self.add(url, partial_path, validators)
+                else:
+                    logger.debug('Not caching %s, it has no validators', url)
+            finally:
+                shutil.rmtree(partial_dir, ignore_errors=True)
+
+    def add(self, url, partial_path, validators):
+        """
+        Moves the given downloaded file into the cache, as the content of the
+        given url
+
+        :returns: the new cache entry
+        """
+        digest = get_file_digests(partial_path, algorithms=('sha256',))
+        object_path = self.get_object_path(digest['sha256'])
+        if not os.path.exists(os.path.dirname(object_path)):
+            try:
+                os.makedirs(os.path.dirname(object_path))
+            except OSError as oerror:
+                if oerror.errno != errno.EEXIST:
+                    raise
+        # replaces the same content from another url, if any
+        os.rename(partial_path, object_path)
+        entry = {
+            'etag': validators.get('etag'),
+            'last_modified': validators.get('last_modified'),
+            'sha256': digest['sha256'],
+            'size': os.path.getsize(object_path),
+            'last_used': time.time(),
+        }
+        with self.locked_index() as entries:
+            entries[url] = entry
+        return entry
+
+    def evict(self, entries):
+        """
+        Removes the least recently used files from the given entries until
+        the cache is under it's maximum size
+        """
+        objects = {}
+        for entry in entries.values():
+            last_used, _ = objects.get(entry['sha256'], (0, 0))
+            objects[entry['sha256']] = (
+                max(last_used, entry['last_used']), entry['size'],
+            )
+        total_size = sum(size for _, size in objects.values())
+        if total_size <= self.max_size:
+            return
+
+        evicted = set()
+        for digest, (_, size) in sorted(
+            objects.items(), key=lambda item: item[1][0],
+        ):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(self.get_object_path(digest))
+            except OSError:
+                pass
+            total_size -= size
+            evicted.add(digest)
+        logger.info('Evicted %d files from the download cache', len(evicted))
+        for url, entry in list(entries.items()):
+            if entry['sha256'] in evicted:
+                del entries[url]
+
+    def remove_stale_partials(self):
+        partial_dir = os.path.join(self.cache_dir, 'partial')
+        min_mtime = time.time() - self.PARTIAL_MAX_AGE
+        for dirname in os.listdir(partial_dir):
+            dirpath = os.path.join(partial_dir, dirname)
+            try:
+                mtimes = [os.path.getmtime(dirpath)] + [
+                    os.path.getmtime(os.path.join(dirpath, fname))
+                    for fname in os.listdir(dirpath)
+                ]
+            except OSError:
+                continue
+            if max(mtimes) < min_mtime:
+                shutil.rmtree(dirpath, ignore_errors=True)
+
+    def close(self):
+        with self.locked_index() as entries:
+            self.evict(entries)
+            self.remove_stale_partials()
+
+
+class Downloader(object):
+    """
+    Downloads urls concurrently, with a pool of threads sharing a requests
+    session, so the connections to each server are kept open and reused.
+    """
+    def __init__(self, workers=4, host_limit=4, verify=True, cache=None):
+        """
+        :param workers: Maximum number of downloads to run at the same time
+        :param host_limit: Maximum number of downloads to run at the same time
+            from the same server
+        :param verify: If False, will not verify the ssl certificates
+        :param cache: :class:`DownloadCache` to get the files from, if any
+        """
+        self.workers = max(1, workers)
+        self.cache = cache
+        self.host_limit = max(1, host_limit)
+        self.verify = verify
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.workers,
+            pool_maxsize=self.workers,
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.host_slots = {}
+        self.host_slots_lock = threading.Lock()
+
+    def get_host_slots(self, url):
+        """
+        Returns the semaphore that limits the downloads from the server of
+        the given url
+        """
+        host = urlsplit(url).netloc
+        with self.host_slots_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(
+                    self.host_limit
+                )
+            return self.host_slots[host]
+
+    @staticmethod
+    def get_dest_paths(urls, dest_dir):
+        """
+        Returns the path to download each of the given urls to, keeping their
+        file names, as the stores rely on them
+
+        :returns: list of (url, path) tuples
+        """
+        dest_paths = []
+        used_paths = set()
+        for url in urls:
+            name = url.rstrip('/').rsplit('/', 1)[-1]
+            dest_path = os.path.join(dest_dir, name)
+            # different urls might have the same file name
+            idx = 0
+            while dest_path in used_paths:
+                idx += 1
+                dest_path = os.path.join(dest_dir, str(idx), name)
+            used_paths.add(dest_path)
+            dest_paths.append((url, dest_path))
+        return dest_paths
+
+    def download_one(self, job):
+        url, dest_path = job
+        if not os.path.exists(os.path.dirname(dest_path)):
+            os.makedirs(os.path.dirname(dest_path))
+        fetch = self.cache.fetch if self.cache is not None else download
+        with self.get_host_slots(url):
+            fetch(
+                url,
+                dest_path,
+                verify=self.verify,
+                session=self.session,
+                show_progress=self.workers == 1,
+            )
+        return dest_path
+
+    def download_all(self, urls, dest_dir):
+        """
+        Downloads all the given urls into the given dir
+
+        :param urls: Urls to download
+        :param dest_dir: Directory to download them into
+        :returns: dict with the local path of each url
+        """
+        unique_urls = []
+        seen = set()
+        for url in urls:
+            if url not in seen:
+                seen.add(url)
+                unique_urls.append(url)
+        jobs = self.get_dest_paths(unique_urls, dest_dir)
+        logger.info(
+            'Downloading %d artifacts, %d at a time',
+            len(jobs), min(self.workers, len(jobs)),
+        )
+        try:
+            thread_map(self.download_one, jobs, workers=self.workers)
+        finally:
+            if self.cache is not None:
+                self.cache.close()
+        return dict(jobs)
@@ -36,11 +36,12 @@ class LatestFilter(ArtifactFilter):
                     store.add_artifact(artifact)
                     # only add it to the first matching store
                     break
-        # gather the latest artifacts from each store
+        # gather the latest artifacts from each store, by their origin, as
+        # the temporary stores might have downloaded only part of them
         filtered_arts = set()
         for store in stores:
             filtered_arts = filtered_arts.union(
-                art.path for art in store.get_latest(num=int(latest))
+                art.origin for art in store.get_latest(num=int(latest))
             )
         for artifact in filtered_arts:
             logger.debug("Passed the filter: %s", artifact)
@@ -67,7 +67,9 @@ class OnlyMissingFilter(ArtifactFilter):
                         artifact
                     )
                 else:
-                    filtered_art_paths.add(artifact.path)
+                    # the temporary stores might have downloaded only
+                    # part of it, pass where it came from
+                    filtered_art_paths.add(artifact.origin)
                     filtered_art_names.add(artifact.full_name)
                     logger.debug("Passed the filter: %s", artifact)
         return (filters_str, filtered_art_paths)
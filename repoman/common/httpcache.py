@@ -0,0 +1,216 @@
+"""
+This module holds the helpers to extract the links of the html index pages
+the sources resolve the artifacts from, and to keep them in a persistent
+cache, so the pages that did not change are not downloaded and parsed again
+on every run.
+
+For each page url, the cache stores the links found in it and the ETag and
+Last-Modified headers the server returned for it. The pages checked less than
+ttl seconds ago are not requested at all, the older ones are requested with
+If-None-Match/If-Modified-Since, and the stored links are reused if the
+server replies that they did not change (304).
+"""
+import atexit
+import codecs
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from six.moves.html_parser import HTMLParser
+
+
+logger = logging.getLogger(__name__)
+
+
+class LinkExtractor(HTMLParser):
+    """
+    Collects the targets of the links of an html page, it can be fed the page
+    in chunks as it's downloaded
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'a':
+            return
+        for name, value in attrs:
+            if name == 'href' and value:
+                self.links.append(value)
+
+
+def parse_links(response):
+    """
+    Returns the targets of all the links of the page in the given streamed
+    response, as they appear on it, parsing it as it's downloaded
+    """
+    decoder = codecs.getincrementaldecoder(
+        response.encoding or 'utf-8'
+    )(errors='replace')
+    extractor = LinkExtractor()
+    for chunk in response.iter_content(chunk_size=65536):
+        extractor.feed(decoder.decode(chunk))
+    extractor.feed(decoder.decode(b'', final=True))
+    extractor.close()
+    return extractor.links
+
+
+def fetch_links(page_url, session=None, headers=None):
+    """
+    Requests the given page and returns the response status and headers and
+    the links in it
+
+    :param page_url: Url of the page to parse
+    :param session: requests session to get it with, to reuse connections
+    :param headers: Extra headers to send in the request
+    :returns: tuple with the status code, the response headers and the list
+        of links (empty if the request was not successful)
+    """
+    session = session if session is not None else requests
+    response = session.get(page_url, stream=True, headers=headers or {})
+    try:
+        if response.status_code == 304:
+            return response.status_code, response.headers, []
+        if not response.ok:
+            logger.warn(
+                'Failed to get %s: %s %s',
+                page_url, response.status_code, response.reason,
+            )
+            return response.status_code, response.headers, []
+        return response.status_code, response.headers, parse_links(response)
+    finally:
+        response.close()
+
+
+class PageCache(object):
+    """
+    Persistent cache of the links of the index pages, by page url, stored as
+    a json file
+    """
+    VERSION = 1
+    # Pages not checked for this long are dropped from the cache
+    MAX_AGE = 30 * 24 * 3600
+
+    def __init__(self, path, ttl=0):
+        """
+        :param path: Path to the file to keep the cache in
+        :param ttl: Seconds to reuse the cached links without checking if the
+            page changed
+        """
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as cache_fd:
+                cache = json.load(cache_fd)
+        except (IOError, OSError, ValueError):
+            return
+        if cache.get('version') == self.VERSION:
+            self.entries = cache.get('entries', {})
+
+    def save(self):
+        """
+        Writes the cache to disk if anything changed, atomically replacing
+        the old one, dropping the pages that were not checked for a long time
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            min_checked = time.time() - max(self.MAX_AGE, self.ttl)
+            entries = dict(
+                (url, entry) for url, entry in self.entries.items()
+                if entry['checked'] >= min_checked
+            )
+            cache_dir = os.path.dirname(self.path)
+            try:
+                if not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir)
+                tmp_fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+                with os.fdopen(tmp_fd, 'w') as cache_fd:
+                    json.dump(
+                        {'version': self.VERSION, 'entries': entries},
+                        cache_fd,
+                    )
+                os.rename(tmp_path, self.path)
+            except (IOError, OSError) as exc:
+                logger.warn('Failed to save the page cache: %s', exc)
+                return
+            self.entries = entries
+            self.dirty = False
+
+    def get_links(self, page_url, session=None):
+        """
+        Returns the links of the given page, from the cache if it was checked
+        recently or did not change since, fetching and parsing it otherwise
+
+        :param page_url: Url of the page to parse
+        :param session: requests session to get it with, to reuse connections
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(page_url)
+        if entry is not None and now - entry['checked'] < self.ttl:
+            logger.debug('Using the cached links of %s', page_url)
+            return list(entry['links'])
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        status_code, resp_headers, links = fetch_links(
+            page_url, session=session, headers=headers,
+        )
+
+        if status_code == 304 and entry is not None:
+            logger.debug('%s did not change, using the cached links', page_url)
+            with self.lock:
+                entry['checked'] = now
+                self.dirty = True
+            return list(entry['links'])
+
+        if status_code != 200:
+            return links
+
+        entry = {
+            'etag': resp_headers.get('etag'),
+            'last_modified': resp_headers.get('last-modified'),
+            'links': links,
+            'checked': now,
+        }
+        if entry['etag'] or entry['last_modified'] or self.ttl > 0:
+            with self.lock:
+                self.entries[page_url] = entry
+                self.dirty = True
+        return links
+
+
+_PAGE_CACHES = {}
+_PAGE_CACHES_LOCK = threading.Lock()
+
+
+def get_page_cache(path, ttl=0):
+    """
+    Returns the :class:`PageCache` stored in the given path, loading it only
+    the first time it's requested in this process, it will be saved when the
+    process exits
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    with _PAGE_CACHES_LOCK:
+        page_cache = _PAGE_CACHES.get(path)
+        if page_cache is None:
+            page_cache = PageCache(path)
+            _PAGE_CACHES[path] = page_cache
+            atexit.register(page_cache.save)
+        page_cache.ttl = ttl
+    return page_cache
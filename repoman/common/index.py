@@ -0,0 +1,181 @@
+"""
+This module holds the helpers to keep persistent per-file metadata indexes.
+
+An index is a json file that maps file paths to some data extracted from them
+(for example, the relevant fields of an rpm header), along with the stat info
+of the file when that data was extracted. As long as the file was not changed
+(same inode, size and mtime) the stored data can be reused instead of having
+to open and parse the file again.
+
+The indexes are stored under a hidden directory in the root of the
+repository::
+
+    repository_dir
+    ├── .repoman
+    │   └── $index_name.json
+    └── ...
+"""
+import json
+import logging
+import os
+import tempfile
+
+
+logger = logging.getLogger(__name__)
+INDEX_DIR = '.repoman'
+
+
+def get_index_path(repo_path, name):
+    """
+    Returns the path to the index with the given name for the given repo
+
+    Args:
+        repo_path (str): Root path of the repository
+        name (str): Name of the index
+
+    Returns:
+        str: path to the index file
+    """
+    return os.path.join(repo_path, INDEX_DIR, name + '.json')
+
+
+def get_stat_key(path, stat=None):
+    """
+    Returns the values that identify the current state of a file
+
+    Args:
+        path (str): Path to the file
+        stat (os.stat_result): stat info of the file, if already available
+
+    Returns:
+        list: inode, size and mtime of the file
+    """
+    stat = stat if stat is not None else os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime]
+
+
+class FileIndex(object):
+    """
+    Persistent map of file path to data extracted from that file, the data
+    for a file is considered valid only if the file has not changed since it
+    was stored.
+    """
+    VERSION = 1
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path to the index file, will be loaded if it exists
+        """
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path) as index_fd:
+                index = json.load(index_fd)
+        except (IOError, OSError, ValueError) as exc:
+            logger.warn('Ignoring unreadable index %s: %s', self.path, exc)
+            return
+
+        if index.get('version') != self.VERSION:
+            logger.info('Ignoring outdated index %s', self.path)
+            return
+
+        self.entries = index.get('entries', {})
+        logger.debug(
+            'Loaded %d entries from index %s', len(self.entries), self.path,
+        )
+
+    def get(self, path, stat=None):
+        """
+        Returns the stored data for the given file, if the file did not change
+        since it was stored
+
+        Args:
+            path (str): Path to the file
+            stat (os.stat_result): stat info of the file, if already available
+
+        Returns:
+            dict or None: The stored data, or None if there's no valid entry
+        """
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+
+        try:
+            stat_key = get_stat_key(path, stat)
+        except OSError:
+            return None
+
+        if entry['stat'] != stat_key:
+            return None
+
+        return entry['data']
+
+    def set(self, path, data, stat=None):
+        """
+        Stores the given data for the given file
+
+        Args:
+            path (str): Path to the file
+            data (dict): json serializable data to store
+            stat (os.stat_result): stat info of the file, if already available
+
+        Returns:
+            None
+        """
+        entry = {'stat': get_stat_key(path, stat), 'data': data}
+        if self.entries.get(path) != entry:
+            self.entries[path] = entry
+            self.dirty = True
+
+    def prune(self, keep_paths):
+        """
+        Removes all the entries for files that no longer exist, skipping the
+        check for the given paths
+
+        Args:
+            keep_paths (set of str): Paths known to exist
+
+        Returns:
+            None
+        """
+        for path in list(self.entries):
+            if path not in keep_paths and not os.path.exists(path):
+                self.entries.pop(path)
+                self.dirty = True
+
+    def save(self):
+        """
+        Writes the index to disk if anything changed, atomically replacing
+        the old one. Failing to write the index is not fatal, it will just be
+        regenerated the next time.
+        """
+        if not self.dirty:
+            return
+
+        index_dir = os.path.dirname(self.path)
+        try:
+            if not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=index_dir)
+            with os.fdopen(tmp_fd, 'w') as index_fd:
+                json.dump(
+                    {'version': self.VERSION, 'entries': self.entries},
+                    index_fd,
+                )
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as exc:
+            logger.warn('Failed to save index %s: %s', self.path, exc)
+            return
+
+        self.dirty = False
+        logger.debug(
+            'Saved %d entries to index %s', len(self.entries), self.path,
+        )
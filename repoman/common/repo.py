@@ -22,6 +22,12 @@ import atexit
 from six import itervalues, iteritems
 
 from . import utils
+from .download import (
+    DownloadCache,
+    Downloader,
+    is_url,
+)
+from .index import INDEX_DIR
 from .parser import Parser
 from .stores import STORES
 
@@ -55,6 +61,29 @@ class Repo(object):
 
     * allowed_repo_paths
         Comma separated list of paths where repositories can be found/created
+
+    * download_cache_dir
+        Directory to keep the downloaded artifacts in, to reuse them in the
+        next runs and other repos, empty (the default) to not keep them
+
+    * download_cache_size
+        Maximum size of the download cache, in bytes or with a K, M, G or T
+        suffix, the least recently used files are removed when exceeded
+
+    * download_host_limit
+        Maximum number of artifacts to download at the same time from the
+        same server
+
+    * download_workers
+        Number of artifacts to download at the same time when adding a source
+
+    * temp_dir
+        Where to download the artifacts to before adding them, 'generate' for
+        a new dir under /tmp, 'generate-in-repo' for one under the .lago_tmp
+        dir of the repo, 'staging' for one under the .repoman/staging dir of
+        the repo (so adding the artifacts is just a hardlink), 'auto' to use
+        staging only when the repo is not in the same filesystem as /tmp, or
+        a path
     """
     def __init__(self, path, config):
         """
@@ -68,6 +97,7 @@ class Repo(object):
         self.added_artifacts = []
         self.loaded = False
         self.parser = None
+        self.downloader = None
         logger.debug(config)
         for allowed_path in self.config.getarray('allowed_repo_paths'):
             if self.path.startswith(allowed_path):
@@ -78,12 +108,22 @@ class Repo(object):
                                 % self.path)
         self.stores = config.getarray('stores')
         temp_dir = self.config.get('temp_dir')
+        if temp_dir == 'auto':
+            # avoid writing the downloads twice when the repo is not in the
+            # same filesystem as /tmp (that is usually a tmpfs)
+            if utils.is_same_filesystem(self.path, tempfile.gettempdir()):
+                temp_dir = 'generate'
+            else:
+                temp_dir = 'staging'
+
         if temp_dir == 'generate':
             temp_dir = tempfile.mkdtemp()
 
         else:
             if temp_dir == 'generate-in-repo':
                 temp_dir = os.path.join(self.path, '.lago_tmp')
+            elif temp_dir == 'staging':
+                temp_dir = os.path.join(self.path, INDEX_DIR, 'staging')
 
             if not os.path.exists(temp_dir):
                 os.makedirs(temp_dir)
@@ -172,13 +212,62 @@ class Repo(object):
 
         self.load()
         logger.info('Resolving artifact source %s', artifact_source)
-        artifact_paths = self.parser.parse(artifact_source)
+        artifact_paths = self.download_artifacts(
+            self.parser.parse(artifact_source)
+        )
         for artifact_path in artifact_paths:
             for store in itervalues(self.stores):
                 if store.handles_artifact(artifact_path):
                     store.add_artifact(artifact_path)
                     self.added_artifacts.append(artifact_path)
 
+    def get_downloader(self):
+        if self.downloader is None:
+            cache = None
+            if self.config.get('download_cache_dir'):
+                cache = DownloadCache(
+                    cache_dir=self.config.get('download_cache_dir'),
+                    max_size=utils.from_human_size(
+                        self.config.get('download_cache_size')
+                    ),
+                )
+            self.downloader = Downloader(
+                workers=self.config.getint('download_workers'),
+                host_limit=self.config.getint('download_host_limit'),
+                verify=self.config.getboolean('verify_ssl'),
+                cache=cache,
+            )
+        return self.downloader
+
+    def download_artifacts(self, artifact_paths):
+        """
+        Downloads at the same time all the given artifacts that are urls and
+        that the stores need to have locally to add them
+
+        :param artifact_paths: paths or urls to the artifacts
+        :returns: list with the same artifacts, with the urls downloaded
+            replaced by their local paths
+        """
+        urls = [
+            artifact_path for artifact_path in artifact_paths
+            if is_url(artifact_path) and any(
+                store.handles_artifact(artifact_path) and
+                store.needs_download(artifact_path)
+                for store in itervalues(self.stores)
+            )
+        ]
+        if not urls:
+            return artifact_paths
+
+        local_paths = self.get_downloader().download_all(
+            urls,
+            dest_dir=self.config.get('temp_dir'),
+        )
+        return [
+            local_paths.get(artifact_path, artifact_path)
+            for artifact_path in artifact_paths
+        ]
+
     def parse_source_stream(self, source_stream):
         """
         Given a iterable of sources, add all that apply, skipping comments and
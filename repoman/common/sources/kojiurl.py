@@ -58,7 +58,9 @@ class KojiURLSource(ArtifactSource):
             logger.info('    Got 2nd level URL: %s', url)
             art_list.extend(
                 URLSource(
-                    config=self.config,
+                    config=self.config.get_section(
+                        'source.' + URLSource.CONFIG_SECTION,
+                    ),
                     stores=self.stores
                 ).expand_page(url)
             )
@@ -5,29 +5,74 @@ Usage::
 
     URL -> Will parse the url and get all the packages in that page
     rec:URL -> Will parse the urls recursively
+
+Configuration options:
+
+* crawl_workers
+    Number of pages to fetch at the same time when parsing an url
+    recursively
+
+* max_depth
+    Maximum number of directory levels to descend from the given url when
+    parsing it recursively, 0 for no limit
+
+* page_cache
+    File to keep the links found in the parsed pages in, to reuse them in the
+    next runs if the pages did not change, empty to not keep them
+
+* page_cache_ttl
+    Seconds to reuse the cached links of a page without checking if it
+    changed, 0 (the default) to always check it with a conditional request.
+    Any artifacts published in a page during that time will be missed
 """
 import logging
 import re
+import threading
 
 
 import requests
 from six.moves.urllib.parse import (
     urljoin,
-    urlsplit
+    urlsplit,
+    urlunsplit,
 )
 
 
 from . import ArtifactSource
+from ..httpcache import (
+    fetch_links,
+    get_page_cache,
+)
 from ..stores import has_store
+from ..utils import thread_map
 
 
 logger = logging.getLogger(__name__)
 
 
+def get_page_links(page_url, session=None, cache=None):
+    """
+    Downloads the given page and returns the targets of all it's links, as
+    they appear on it
+
+    :param page_url: Url of the page to parse
+    :param session: requests session to get it with, to reuse connections
+    :param cache: :class:`PageCache` to get the links from, if any
+    """
+    if cache is not None:
+        return cache.get_links(page_url, session=session)
+    return fetch_links(page_url, session=session)[2]
+
+
 class URLSource(ArtifactSource):
     __doc__ = __doc__
 
-    DEFAULT_CONFIG = {}
+    DEFAULT_CONFIG = {
+        'crawl_workers': '8',
+        'max_depth': '10',
+        'page_cache': '~/.cache/repoman/pages.json',
+        'page_cache_ttl': '0',
+    }
     CONFIG_SECTION = 'URLSource'
 
     @classmethod
@@ -55,18 +100,29 @@ class URLSource(ArtifactSource):
             urls = urls.union(self.expand_page(source['url']))
         return source['filters'], urls
 
-    def expand_page(self, page_url):
+    def get_page_cache(self):
+        if not self.config.get('page_cache'):
+            return None
+        return get_page_cache(
+            self.config.get('page_cache'),
+            ttl=self.config.getint('page_cache_ttl'),
+        )
+
+    def expand_page(self, page_url, links=None):
+        """
+        Returns the artifacts linked from the given page
+
+        :param page_url: Url of the page
+        :param links: Targets of the links of the page, if already fetched
+        """
         logger.info('Parsing URL: %s', page_url)
-        data = requests.get(page_url).text
-        link_reg = re.compile(r'(?<=href=["\'])[^"\']+')
-        art_list = set()
-        for line in data.splitlines():
-            links = link_reg.findall(line)
-            art_list = art_list.union(set([
-                self.get_link(page_url, link)
-                for link in links
-                if has_store(link, self.stores)
-            ]))
+        if links is None:
+            links = get_page_links(page_url, cache=self.get_page_cache())
+        art_list = set(
+            self.get_link(page_url, link)
+            for link in links
+            if has_store(link, self.stores)
+        )
         for art_url in art_list:
             logger.info('    Got artifact URL: %s', art_url)
         return art_list
@@ -74,6 +130,7 @@ class URLSource(ArtifactSource):
     @staticmethod
     def strip_qs(url):
         split_url = urlsplit(url)
+        split_url = split_url._replace(path=split_url.path.rstrip('/'))
         if split_url.scheme:
             return "{0}://{1}{2}/".format(*split_url)
         else:
@@ -92,25 +149,82 @@ class URLSource(ArtifactSource):
             else:
                 return link_url
 
-    def expand_recursive(self, page_url, level=0):
-        if level > 0:
-            logger.debug('Recursively fetching URL (level %d): %s',
-                         level, page_url)
-        else:
-            logger.info('Recursively fetching URL (level %d): %s', level,
-                        page_url)
-        pkg_list = []
-        data = requests.get(page_url).text
-        url_reg = re.compile(
-            r'(?<=href=")(/|%s|(?![^:]+?://))[^"]+/(?=")' % page_url)
-        next_urls = (
-            self.get_link(page_url, match.group(), internal=True)
-            for match in url_reg.finditer(data)
-            if match.group() != page_url
-        )
-        for next_url in next_urls:
-            if not next_url:
+    @staticmethod
+    def get_dir_url(url):
+        """
+        Returns the given url without query or fragment and ending with a
+        slash, so it can be used to resolve and compare the links of a
+        directory listing
+        """
+        split_url = urlsplit(url)
+        path = split_url.path
+        if not path.endswith('/'):
+            path += '/'
+        return urlunsplit((split_url.scheme, split_url.netloc, path, '', ''))
+
+    def get_subdirs(self, page_url, links):
+        """
+        Returns the urls of the directories under the given page that it
+        links to
+        """
+        dir_url = self.get_dir_url(page_url)
+        subdirs = set()
+        for link in links:
+            if not link.endswith('/'):
                 continue
-            pkg_list.extend(self.expand_recursive(next_url, level + 1))
-        pkg_list.extend(self.expand_page(page_url))
+            sub_url = self.get_dir_url(urljoin(dir_url, link))
+            if sub_url != dir_url and sub_url.startswith(dir_url):
+                subdirs.add(sub_url)
+        return subdirs
+
+    def expand_recursive(self, page_url):
+        """
+        Returns the artifacts linked from the given page and all the
+        directories under it, crawling them breadth first, a few pages at a
+        time and fetching each of them only once
+
+        :param page_url: Url to start crawling from
+        """
+        logger.info('Recursively fetching URL: %s', page_url)
+        workers = max(1, self.config.getint('crawl_workers'))
+        max_depth = self.config.getint('max_depth')
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=workers,
+            pool_maxsize=workers,
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        page_cache = self.get_page_cache()
+        pkg_list = []
+        pkg_list_lock = threading.Lock()
+
+        def crawl(url):
+            links = get_page_links(url, session=session, cache=page_cache)
+            pkgs = self.expand_page(url, links=links)
+            with pkg_list_lock:
+                pkg_list.extend(pkgs)
+            return self.get_subdirs(url, links)
+
+        visited = set([self.get_dir_url(page_url)])
+        level_urls = [page_url]
+        level = 0
+        while level_urls:
+            logger.debug(
+                'Fetching %d URLs (level %d)', len(level_urls), level,
+            )
+            next_urls = []
+            for subdirs in thread_map(crawl, level_urls, workers=workers):
+                for subdir in sorted(subdirs):
+                    if subdir not in visited:
+                        visited.add(subdir)
+                        next_urls.append(subdir)
+            level += 1
+            if max_depth > 0 and level > max_depth and next_urls:
+                logger.warn(
+                    'Not fetching %d URLs under %s, deeper than max_depth '
+                    '(%d)', len(next_urls), page_url, max_depth,
+                )
+                break
+            level_urls = next_urls
         return pkg_list
@@ -45,30 +45,455 @@ For clarification, here's a dictionary like diagram::
 import logging
 import os
 import re
+import struct
 import subprocess
 
-from functools import cmp_to_key
-
-import six
-
 import pexpect
 import rpm
 
 from ...artifact import Artifact
 from ...artifact import ArtifactList
 from ...artifact import ArtifactName
-from ...artifact import ArtifactVersion
-from ...utils import cmpfullver
+from ...artifact import NOT_LOADED
+from ...utils import chunk_args
 from ...utils import download
-from ...utils import gpg_get_keyhex
-from ...utils import gpg_unlock
+from ...utils import download_range
+from ...utils import get_gpg_key
+from ...utils import intern_str
+from ...utils import pgp_signature_key_id
+from ...utils import thread_map
+from ...utils import to_human_size
+
+
+# Metadata fields that can only be read from the rpm header
+HEADER_FIELDS = ('sourcerpm', 'signed', 'key_hex')
+# Fields that can be guessed from the file name and must match the header
+FILENAME_FIELDS = ('name', 'version', 'release', 'arch', 'is_source')
+RPM_FILENAME_REG = re.compile(
+    r'^(?P<name>.+)-(?P<version>[^-]+)-(?P<release>[^-]+)'
+    r'\.(?P<arch>[a-zA-Z0-9_]+)\.rpm$'
+)
+
+
+# Size of the lead, the obsolete fixed size header at the start of the rpm
+RPM_LEAD_SIZE = 96
+# Size of the intro of the signature and main header structures (magic,
+# reserved bytes, number of index entries and size of the data)
+HEADER_INTRO_SIZE = 16
+HEADER_MAGIC = b'\x8e\xad\xe8'
+# Bytes to request the first time when downloading only the headers of a
+# remote rpm, enough for most of them
+HEADERS_FETCH_SIZE = 64 * 1024
+# Seconds to wait for a single rpmsign call to finish, plus per rpm signed
+RPMSIGN_BASE_TIMEOUT = 1200
+RPMSIGN_PKG_TIMEOUT = 120
 
 
 class WrongDistroException(Exception):
     pass
 
 
+class FilenameMismatchError(Exception):
+    pass
+
+
+def read_header(path):
+    """
+    Reads the header of the given rpm file
+
+    :param path: Path to the rpm file
+    :returns: tuple with the header and the inode of the file
+    """
+    trans = rpm.TransactionSet()
+    # Do not fail for unsigned rpms
+    trans.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
+    with open(path) as fdno:
+        try:
+            hdr = trans.hdrFromFdno(fdno)
+        except Exception:
+            logging.error("Failed to parse header for %s", path)
+            raise
+        inode = os.fstat(fdno.fileno()).st_ino
+    return hdr, inode
+
+
+# Header tags that can hold the rpm signature, in the same order that rpm -qi
+# looks for them
+SIGNATURE_TAGS = (
+    'RPMTAG_DSAHEADER',
+    'RPMTAG_RSAHEADER',
+    'RPMTAG_SIGGPG',
+    'RPMTAG_SIGPGP',
+)
+
+
+def get_signatures(hdr):
+    """
+    Yields the non empty signatures of the given header, from the tags in
+    :data:`SIGNATURE_TAGS` that this rpm version knows about
+
+    :param hdr: Header of the rpm
+    """
+    for tag_name in SIGNATURE_TAGS:
+        tag = getattr(rpm, tag_name, None)
+        if tag is None:
+            continue
+        signature = hdr[tag]
+        if signature:
+            yield signature
+
+
+def get_key_hex(path, hdr):
+    """
+    Returns the id of the key the given rpm was signed with, or None if it's
+    not signed. It's extracted directly from the signature tags of the already
+    read header.
+
+    :param path: Path to the rpm file, for logging purposes
+    :param hdr: Header of the rpm
+    """
+    for signature in get_signatures(hdr):
+        key_hex = pgp_signature_key_id(signature)
+        if key_hex:
+            logging.debug(
+                '{} signed with key with ID: {}'.format(path, key_hex)
+            )
+            return key_hex
+    logging.debug('{} is unsigned'.format(path))
+    return None
+
+
+def get_signature_metadata(path, hdr):
+    """
+    Extracts from the given header the signature related metadata, as
+    returned by :func:`get_metadata`, both from the same signature tags, so an
+    rpm signed only with a header signature is also seen as signed
+    """
+    return {
+        'signed': any(True for _ in get_signatures(hdr)),
+        'key_hex': get_key_hex(path, hdr),
+    }
+
+
+def get_metadata(path, hdr, inode):
+    """
+    Extracts from the given header the metadata that the RPM class needs, as a
+    dict of basic types so it can be stored and reused without having to parse
+    the rpm header again.
+
+    :param path: Path to the rpm file
+    :param hdr: Header of the rpm
+    :param inode: Inode of the rpm file
+    """
+    metadata = {
+        'name': hdr[rpm.RPMTAG_NAME],
+        'version': hdr[rpm.RPMTAG_VERSION],
+        'release': hdr[rpm.RPMTAG_RELEASE],
+        'arch': hdr[rpm.RPMTAG_ARCH] or 'none',
+        'is_source': hdr[rpm.RPMTAG_SOURCEPACKAGE] and True or False,
+        'sourcerpm': hdr[rpm.RPMTAG_SOURCERPM],
+        'inode': inode,
+    }
+    metadata.update(get_signature_metadata(path, hdr))
+    return metadata
+
+
+def get_header_end(data, offset):
+    """
+    Returns the offset where the header structure starting at the given
+    offset ends, or where it's intro ends if the data does not include it
+    """
+    intro = data[offset:offset + HEADER_INTRO_SIZE]
+    if len(intro) < HEADER_INTRO_SIZE:
+        return offset + HEADER_INTRO_SIZE
+    if intro[:3] != HEADER_MAGIC:
+        raise Exception('Bad rpm header magic at offset %d' % offset)
+    nindex, hsize = struct.unpack('>II', intro[8:])
+    return offset + HEADER_INTRO_SIZE + nindex * 16 + hsize
+
+
+def get_headers_size(data):
+    """
+    Returns the size of the lead, signature and header of the rpm starting
+    with the given data, that is, what's needed to read it's header. If the
+    data is too short to know it, returns the minimum size to continue.
+    """
+    if len(data) < RPM_LEAD_SIZE + HEADER_INTRO_SIZE:
+        return RPM_LEAD_SIZE + HEADER_INTRO_SIZE
+    sig_end = get_header_end(data, RPM_LEAD_SIZE)
+    # the signature is padded to 8 bytes
+    sig_end += (8 - sig_end % 8) % 8
+    return get_header_end(data, sig_end)
+
+
+def read_header_range(path):
+    """
+    Returns the offsets where the main header of the given rpm file starts
+    and ends, as listed in the yum metadata
+
+    :returns: tuple with the start and end offsets
+    """
+    data = b''
+    size = get_headers_size(data)
+    with open(path, 'rb') as rpm_fd:
+        while size > len(data):
+            more_data = rpm_fd.read(size - len(data))
+            if not more_data:
+                raise Exception('Truncated rpm headers at %s' % path)
+            data += more_data
+            size = get_headers_size(data)
+    sig_end = get_header_end(data, RPM_LEAD_SIZE)
+    return sig_end + (8 - sig_end % 8) % 8, size
+
+
+def download_headers(url, dest_path, verify=True):
+    """
+    Downloads only the lead, signature and header of the rpm at the given
+    url, using http range requests, so it can be read without downloading the
+    payload.
+
+    :param url: Url of the rpm
+    :param dest_path: Path to write the truncated rpm to
+    """
+    data = download_range(url, 0, HEADERS_FETCH_SIZE - 1, verify=verify)
+    size = get_headers_size(data)
+    while size > len(data):
+        more_data = download_range(url, len(data), size - 1, verify=verify)
+        if not more_data:
+            raise Exception('Truncated rpm headers at %s' % url)
+        data += more_data
+        size = get_headers_size(data)
+    with open(dest_path, 'wb') as rpm_fd:
+        rpm_fd.write(data[:size])
+    logging.info(
+        'Downloaded headers of %s, length %s', url, to_human_size(size),
+    )
+
+
+def get_filename_metadata(path):
+    """
+    Guesses the metadata of the given rpm from it's file name, that must be in
+    the form $name-$version-$release.$arch.rpm, without opening it. The header
+    only fields and the inode are not included.
+
+    Source rpms are never guessed, as the arch of their header is the arch
+    they were built on, that is used to group them with their binaries.
+
+    :param path: Path or url to the rpm
+    :returns: metadata dict or None if it could not be guessed
+    """
+    match = RPM_FILENAME_REG.match(path.rsplit('/', 1)[-1])
+    if not match or match.group('arch') in ('src', 'nosrc'):
+        return None
+    return {
+        'name': match.group('name'),
+        'version': match.group('version'),
+        'release': match.group('release'),
+        'arch': match.group('arch'),
+        'is_source': False,
+    }
+
+
+def read_metadata(path):
+    """
+    Reads the header of the given rpm file and returns it's metadata, as
+    returned by :func:`get_metadata`
+    """
+    hdr, inode = read_header(path)
+    return get_metadata(path, hdr, inode)
+
+
+def delete_signatures(paths):
+    """
+    Removes any existing signature from the given rpms, running rpm --delsign
+    on as many of them at once as possible.
+
+    This is needed because if a signature already exists, even with our
+    signature, when installing it yum raises an error like:
+    The GPG keys listed for the "oVirt 4.2 Pre-Release" repository are
+    already installed but they are not correct for this package.
+
+    :param paths: Paths to the rpms
+    :returns: list of the paths that failed
+    """
+    failed = []
+    with open(os.devnull, 'w') as devnull:
+        for chunk in chunk_args(paths):
+            logging.debug('\nrpm --delsign %s\n', ' '.join(chunk))
+            if subprocess.call(['rpm', '--delsign'] + chunk,
+                               stdout=devnull) == 0:
+                continue
+            # find out which ones failed, removing the signature again is
+            # harmless
+            for path in chunk:
+                res = subprocess.call(['rpm', '--delsign', path],
+                                      stdout=devnull)
+                if res != 0:
+                    logging.error(
+                        'rpm --delsign failed on %s with rc %d', path, res,
+                    )
+                    failed.append(path)
+    return failed
+
+
+def run_rpmsign(paths, keyuid, passwd):
+    """
+    Signs the given rpms with a single rpmsign call, that asks for the
+    passphrase only once
+
+    :param paths: Paths to the rpms to sign
+    :param keyuid: Name of the key to sign them with
+    :param passwd: Passphrase of the key
+    :returns: exit status of rpmsign
+    """
+    rpmsign_args = [
+        '--resign',
+        '-D', '_signature gpg',
+        '-D', '_gpg_name %s' % keyuid,
+        # with gpg2 rpmsign can't pass it the passphrase (it fails with
+        # invalid ioctl when gpg asks for it), it works because the callers
+        # unlock the key in the gpg agent first (see GPGKey.unlock)
+        '-D', '__gpg /usr/bin/gpg',
+    ] + list(paths)
+    logging.debug('\nrpmsign /\n' + ' /\n\t'.join(rpmsign_args))
+    prompts = [
+        'pass phrase: ',
+        'passphrase: ',
+        'Passphrase: ',
+    ]
+    # rpmsign may take a lot of time, more the more rpms it signs
+    max_wait = RPMSIGN_BASE_TIMEOUT + RPMSIGN_PKG_TIMEOUT * len(paths)
+    child = pexpect.spawn(
+        'rpmsign',
+        rpmsign_args,
+        timeout=max_wait,
+        env={"LC_ALL": "C"},
+    )
+    try:
+        match = child.expect(
+            ['exists. Overwrite'] + prompts + [pexpect.EOF],
+            timeout=300,
+        )
+        if match == 0:
+            logging.info('Performing cleanup from the last unclean run...')
+            child.sendline('y')
+            child.expect(prompts + [pexpect.EOF], timeout=300)
+        else:
+            logging.info('System waits for password...')
+    except Exception as exc:
+        logging.error('Failed to sign')
+        logging.debug(child)
+        # overriding as the default exception includes too much
+        # info, as passwords passed
+        exc.value = exc.value.replace(passwd, '*****')
+        raise exc
+    # For some reason, on fedora>21 rpmsign needs some tries until it
+    # properly signs, so send the passphrase again if it's asked again, and
+    # give it time to sign all the rpms otherwise
+    waited = 0
+    tries = 1
+    child.sendline(passwd)
+    while True:
+        try:
+            match = child.expect(prompts + [pexpect.EOF], timeout=10)
+        except pexpect.TIMEOUT as exc:
+            waited += 10
+            if waited >= max_wait:
+                logging.error('Failed to sign, rpmsign timed out')
+                logging.debug(child)
+                exc.value = exc.value.replace(passwd, '*****')
+                raise exc
+            continue
+        if match == len(prompts):
+            break
+        tries += 1
+        logging.debug('Sent pass to rpmsign, try number %d', tries)
+        child.sendline(passwd)
+    child.close()
+    if child.exitstatus != 0:
+        logging.debug(child)
+    return child.exitstatus
+
+
+def get_sign_chunks(paths, workers=1):
+    """
+    Splits the given rpms in chunks to sign with separate rpmsign calls, at
+    least one per worker and with similar sizes, so they finish at about the
+    same time
+
+    :param paths: Paths to the rpms
+    :param workers: Number of rpmsign calls that will run at the same time
+    :returns: list of lists of paths
+    """
+    paths = sorted(paths, key=os.path.getsize, reverse=True)
+    chunks = []
+    for idx in range(workers):
+        chunks.extend(chunk_args(paths[idx::workers]))
+    return chunks
+
+
+def sign_pkgs(pkgs, key_hex, passwd, workers=1):
+    """
+    Signs the given rpms, removing their old signatures first, with as few
+    rpm and rpmsign calls as possible. The key should be already unlocked.
+
+    :param pkgs: RPM instances to sign
+    :param key_hex: Hex id of the key to sign them with
+    :param passwd: Passphrase of the key
+    :param workers: Number of rpmsign calls to run at the same time, each
+        on a different set of packages
+    :returns: list of the RPM instances that failed to be signed
+    """
+    failed = []
+    unsigned_paths = set(delete_signatures([pkg.path for pkg in pkgs]))
+    to_sign = []
+    for pkg in pkgs:
+        if pkg.path in unsigned_paths:
+            failed.append(pkg)
+        else:
+            to_sign.append(pkg)
+
+    def sign_chunk(chunk):
+        logging.info('Signing %d packages', len(chunk))
+        return run_rpmsign(chunk, keyuid=key_hex, passwd=passwd)
+
+    pkgs_by_path = dict((pkg.path, pkg) for pkg in to_sign)
+    chunks = get_sign_chunks(list(pkgs_by_path), workers=workers)
+    results = thread_map(sign_chunk, chunks, workers=workers)
+    for chunk, res in zip(chunks, results):
+        if res != 0:
+            logging.error('rpmsign exited with rc %s', res)
+        # rpmsign goes on with the rest of the packages when one fails, so
+        # check which ones got really signed
+        for path in chunk:
+            pkg = pkgs_by_path[path]
+            pkg.reload_signature()
+            if pkg.key_hex != key_hex:
+                logging.error('Failed to sign %s', path)
+                failed.append(pkg)
+    return failed
+
+
 class RPM(Artifact):
+    # there can be hundreds of thousands of instances, so avoid having a dict
+    # for each of them
+    __slots__ = (
+        'url',
+        'inode',
+        'is_source',
+        '_sourcerpm',
+        '_name',
+        '_version',
+        'major_version',
+        'release',
+        '_signature',
+        '_key_hex',
+        'checksum',
+        'distro',
+        'arch',
+        'ver_rel',
+    )
+
     def __init__(
         self,
         path,
@@ -76,6 +501,8 @@ class RPM(Artifact):
         distro_reg=r'\.(fc|el)\d+',
         to_all_distros=(),
         verify_ssl=True,
+        metadata=None,
+        headers_only=False,
     ):
         """
         :param path: Path or url to the rpm
@@ -86,10 +513,16 @@ class RPM(Artifact):
            the release string of the rpm.
         :param to_all_distros: Special rpm names that must go to all the
             distributions ignoring their release strings
+        :param metadata: Already extracted metadata for the rpm, as returned
+            by :func:`get_metadata`, if passed the rpm header will not be read.
+            If it has no header only fields (signature, sourcerpm) or inode,
+            as the metadata returned by :func:`get_filename_metadata`, they
+            will be read from the header (or stat) when first needed.
+        :param headers_only: If an url is passed, download only the headers
+            of the rpm, the whole of it will be downloaded by
+            :func:`download_payload` when needed
         """
-        trans = rpm.TransactionSet()
-        # Do not fail for unsigned rpms
-        trans.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
+        self.url = None
         if path.startswith('http:') or path.startswith('https:'):
             name = path.rsplit('/', 1)[-1]
             if not name:
@@ -97,26 +530,32 @@ class RPM(Artifact):
                                 'unable to guess package name'
                                 % path)
             fpath = temp_dir + '/' + name
-            download(path, fpath, verify=verify_ssl)
+            if headers_only:
+                download_headers(path, fpath, verify=verify_ssl)
+                self.url = path
+            else:
+                download(path, fpath, verify=verify_ssl)
             path = fpath
         self.path = path
-        with open(path) as fdno:
-            try:
-                hdr = trans.hdrFromFdno(fdno)
-            except Exception:
-                logging.error("Failed to parse header for %s", path)
-                raise
-            self.inode = os.fstat(fdno.fileno()).st_ino
-        self.is_source = hdr[rpm.RPMTAG_SOURCEPACKAGE] and True or False
-        self.sourcerpm = hdr[rpm.RPMTAG_SOURCERPM]
-        self._name = hdr[rpm.RPMTAG_NAME]
-        self._version = hdr[rpm.RPMTAG_VERSION]
-        self.major_version = self._version.split('.', 1)[0]
-        self.release = hdr[rpm.RPMTAG_RELEASE]
-        self.signature = hdr[rpm.RPMTAG_SIGPGP]
-        self._raw_hdr = hdr
+        if metadata is None:
+            metadata = read_metadata(path)
+        if 'inode' in metadata:
+            self.inode = metadata['inode']
+        else:
+            self.inode = os.stat(path).st_ino
+        self.is_source = metadata['is_source']
+        self._sourcerpm = metadata.get('sourcerpm', NOT_LOADED)
+        # interning the strings that are repeated among rpms saves a lot of
+        # memory on big repos
+        self._name = intern_str(metadata['name'])
+        self._version = intern_str(metadata['version'])
+        self.major_version = intern_str(self._version.split('.', 1)[0])
+        self.release = intern_str(metadata['release'])
+        self._signature = metadata.get('signed', NOT_LOADED)
+        self._key_hex = intern_str(metadata.get('key_hex', NOT_LOADED))
+        self.checksum = metadata.get('checksum')
         # will be calculated if needed
-        self._md5 = None
+        self._digests = None
         # Check if this package has to go to all distros
         if any((
             self._name
@@ -126,7 +565,9 @@ class RPM(Artifact):
             self.distro = 'all'
         else:
             try:
-                self.distro = self.get_distro(self.release, distro_reg)
+                self.distro = intern_str(
+                    self.get_distro(self.release, distro_reg)
+                )
             except WrongDistroException as e:
                 logging.error(
                     'Wrong distribution for package: %s-%s',
@@ -134,7 +575,7 @@ class RPM(Artifact):
                     self._version
                 )
                 raise e
-        self.arch = hdr[rpm.RPMTAG_ARCH] or 'none'
+        self.arch = intern_str(metadata['arch'])
         # remove the distro from the release for the version string
         if self.distro:
             release = re.sub(
@@ -145,22 +586,123 @@ class RPM(Artifact):
             )
         else:
             release = self.release
-        self.ver_rel = '%s-%s' % (self._version, release)
-        with open(os.devnull, 'w') as devnull:
-            output = subprocess.Popen(
-                ["rpm", "-qip", path],
-                stdout=subprocess.PIPE,
-                stderr=devnull,
-            ).communicate()[0].decode('utf-8')
-        match = re.search(r"Key ID (?P<key_id>\w+)\\n", output)
-        self.key_hex = None
-        if match:
-            self.key_hex = match.groupdict()['key_id'].upper()
-            logging.debug(
-                '{} signed with key with ID: {}'.format(path, self.key_hex)
+        self.ver_rel = intern_str('%s-%s' % (self._version, release))
+
+    @property
+    def origin(self):
+        """
+        Url of the rpm if only it's headers were downloaded, so it's
+        downloaded whole when added to another store, it's path otherwise
+        """
+        if self.url is not None:
+            return self.url
+        return self.path
+
+    def download_payload(self, verify_ssl=True):
+        """
+        Downloads the whole rpm if only it's headers were downloaded,
+        replacing the headers file, so it's inode changes, the stores must
+        update it's entry in their artifact lists
+
+        :returns: the inode of the headers file if it was replaced, None
+            otherwise
+        """
+        if self.url is None:
+            return None
+        download(self.url, self.path, verify=verify_ssl)
+        self.url = None
+        self._digests = None
+        old_inode = self.inode
+        self.inode = os.stat(self.path).st_ino
+        return old_inode
+
+    def load_header_fields(self):
+        """
+        Reads the header only fields (signature and sourcerpm) from the rpm
+        header
+        """
+        hdr, _ = read_header(self.path)
+        self._sourcerpm = hdr[rpm.RPMTAG_SOURCERPM]
+        metadata = get_signature_metadata(self.path, hdr)
+        self._signature = metadata['signed']
+        self._key_hex = intern_str(metadata['key_hex'])
+
+    def verify_header(self):
+        """
+        Checks that the metadata the rpm was created with (for example guessed
+        from the file name) matches the one in it's header, loading also the
+        header only fields.
+
+        :raises FilenameMismatchError: if they don't match
+        """
+        hdr, inode = read_header(self.path)
+        real_metadata = get_metadata(self.path, hdr, inode)
+        cur_metadata = {
+            'name': self._name,
+            'version': self._version,
+            'release': self.release,
+            'arch': self.arch,
+            'is_source': self.is_source,
+        }
+        mismatches = [
+            '%s (%s != %s)'
+            % (field, cur_metadata[field], real_metadata[field])
+            for field in FILENAME_FIELDS
+            if cur_metadata[field] != real_metadata[field]
+        ]
+        if mismatches:
+            raise FilenameMismatchError(
+                'The file name of %s does not match the header: %s'
+                % (self.path, ', '.join(mismatches))
             )
-        else:
-            logging.debug('{} is unsigned'.format(path))
+        self._sourcerpm = real_metadata['sourcerpm']
+        self._signature = real_metadata['signed']
+        self._key_hex = intern_str(real_metadata['key_hex'])
+
+    @property
+    def _raw_hdr(self):
+        """
+        The header is not kept in memory, as it's big, it's read again from
+        the rpm when needed
+        """
+        return read_header(self.path)[0]
+
+    @property
+    def sourcerpm(self):
+        if self._sourcerpm is NOT_LOADED:
+            self.load_header_fields()
+        return self._sourcerpm
+
+    @property
+    def signature(self):
+        if self._signature is NOT_LOADED:
+            self.load_header_fields()
+        return self._signature
+
+    @property
+    def key_hex(self):
+        if self._key_hex is NOT_LOADED:
+            self.load_header_fields()
+        return self._key_hex
+
+    @property
+    def metadata(self):
+        """
+        Metadata of this rpm, in the same format as returned by
+        :func:`get_metadata`
+        """
+        return {
+            'name': self._name,
+            'version': self._version,
+            'release': self.release,
+            'arch': self.arch,
+            'is_source': self.is_source,
+            'sourcerpm': self.sourcerpm,
+            'signed': self.signature and True or False,
+            'key_hex': self.key_hex,
+            'inode': self.inode,
+            'checksum': self.checksum,
+        }
 
     @property
     def name(self):
@@ -230,102 +772,27 @@ class RPM(Artifact):
 
     def sign(self, key_path, passwd):
         logging.info("SIGNING: %s", self.path)
-        gpg = gpg_unlock(key_path, passphrase=passwd)
-        keyuid = gpg_get_keyhex(key_path, gpg=gpg)
-        # Remove any existing signature from the rpm before signing it.
-        # This is needed because is a signature already exist, even whith our
-        # signature, when installing it yum raise an error like:
-        # The GPG keys listed for the "oVirt 4.2 Pre-Release" repository are
-        # already installed but they are not correct for this package.
-        logging.debug('\nrpm --delsign %s\n' % (self.path,))
-        with open(os.devnull, 'w') as devnull:
-            res = subprocess.call(
-                ['rpm', '--delsign', self.path],
-                stdout=devnull,
-            )
-            if res != 0:
-                raise Exception(
-                    "rpm --delsign failed on %s with rc %d" % (self.path, res)
-                )
-        # Signing the rpm with out key
-        rpmsign_args = [
-            '--resign',
-            '-D', '_signature gpg',
-            '-D', '_gpg_name %s' % keyuid,
-            # TODO: make this work with gpg2 too, fc>21 throws invalid ioctl
-            '-D', '__gpg /usr/bin/gpg',
-            self.path,
-        ]
-        logging.debug('\nrpmsign /\n' + ' /\n\t'.join(rpmsign_args))
-        child = pexpect.spawn(
-            'rpmsign',
-            rpmsign_args,
-            timeout=1200,  # rpmsign may take a lot of time...
-            env={"LC_ALL": "C"},
-        )
-        try:
-            match = child.expect(
-                [
-                    'exists. Overwrite',
-                    'pass phrase: ',
-                    'passphrase: ',
-                    'Passphrase: ',
-                    pexpect.EOF
-                ],
-                timeout=300,
-            )
-            if match == 0:
-                logging.info('Performing cleanup from the last unclean run...')
-                child.sendline('y')
-                child.expect(
-                    [
-                        'pass phrase: ',
-                        'passphrase: ',
-                        'Passphrase: ',
-                        pexpect.EOF
-                    ],
-                    timeout=300,
-                )
-            else:
-                logging.info('System waits for password...')
-
-        except Exception as exc:
-            logging.error('Failed to sign')
-            logging.debug(child)
-            # overriding as the default exception includes too much
-            # info, as passwords passed
-            exc.value = exc.value.replace(passwd, '*****')
-            raise exc
-        # For some reason, on fedora>21 rpmsign needs some tries until it
-        # properly signs
-        done = False
-        tries = 1
-        while not done:
-            child.sendline(passwd)
-            logging.debug('Sent pass to rpmsign, try number %d', tries)
-            try:
-                child.expect(pexpect.EOF, timeout=10)
-                done = True
-            except pexpect.TIMEOUT as exc:
-                tries += 1
-                # signing big rpms might take it's time
-                if tries >= 900:
-                    logging.error('Failed to sign')
-                    logging.debug(child)
-                    exc.value = exc.value.replace(passwd, '*****')
-                    raise exc
-        child.close()
-        if child.exitstatus != 0:
-            logging.debug(child)
-            raise Exception("Failed to sign package.")
-        self.__init__(self.path)
-        if not self.signature:
+        gpg_key = get_gpg_key(key_path, use_agent=True)
+        gpg_key.unlock(passphrase=passwd)
+        failed = sign_pkgs([self], key_hex=gpg_key.keyid, passwd=passwd)
+        if failed:
             logging.error('Failed to sign')
             raise Exception(
                 "Failed to sign rpm %s with key '%s'"
-                % (self.path, keyuid)
+                % (self.path, gpg_key.keyid)
             )
-        del(gpg)
+
+    def reload_signature(self):
+        """
+        Reads again the signature of the rpm from it's header, after the file
+        was changed (for example, signed), resetting the file related fields
+        """
+        hdr, self.inode = read_header(self.path)
+        metadata = get_signature_metadata(self.path, hdr)
+        self._signature = metadata['signed']
+        self._key_hex = intern_str(metadata['key_hex'])
+        self.checksum = None
+        self._digests = None
 
     def __str__(self):
         """
@@ -333,7 +800,8 @@ class RPM(Artifact):
         string representation, the must point to the same file or a copy of
         it, if not, you wrongly generated two rpms with the same
         version/release and different content, or you signed them with
-        different keys
+        different keys. For the rpms loaded lazily, this reads the header to
+        get the signature.
         """
         return 'rpm(%s %s %s %s %s %s)' % (
             self.name, self._version,
@@ -348,41 +816,21 @@ class RPM(Artifact):
 
 class RPMName(ArtifactName):
     """List of available versions for a package name"""
-    def add_pkg(self, pkg, onlyifnewer):
-        is_there_newer = next(
-            (
-                ver for ver in self.keys()
-                if cmpfullver(ver, pkg.ver_rel) >= 0
-            ),
-            False,
-        )
-        if onlyifnewer and (is_there_newer or pkg.ver_rel in self):
-            return False
-        elif pkg.ver_rel not in self:
-            self[pkg.ver_rel] = ArtifactVersion(pkg.ver_rel)
-        return self[pkg.ver_rel].add_pkg(pkg)
+    __slots__ = ()
 
     def get_latest(self, num=1):
         """
-        Returns the list of available inodes for the latest version
-        if any
+        Returns the list of available inodes for the latest versions that
+        have binary rpms, if any
         """
         if not self:
             return None
-        if not num:
-            num = len(self)
-        sorted_list = [
-            ver_name for ver_name, version in self.items()
-            if version.get_artifacts(
-                fmatch=lambda art: not art.is_source
-            )
-        ]
-        sorted_list.sort(key=cmp_to_key(cmpfullver))
         latest = {}
-        if num > len(sorted_list):
-            num = len(sorted_list)
-        for pos in six.moves.xrange(num):
-            latest[sorted_list[pos]] = self.get(sorted_list[pos])
+        for version in self.iter_newest():
+            if num and len(latest) >= num:
+                break
+            if self[version].has_binary:
+                latest[version] = self[version]
         return latest
 
 
@@ -390,6 +838,8 @@ class RPMList(ArtifactList):
     """
     List of rpms, separated by name
     """
+    __slots__ = ()
+
     def __init__(self, name_class=RPMName):
         super(RPMList, self).__init__(self)
         self.name_class = name_class
@@ -36,35 +36,95 @@ src files, in the following structure::
 import os
 import logging
 import subprocess
-import multiprocessing as mp
+import time
 from six import itervalues, iteritems
 from .. import ArtifactStore
+from ...index import (
+    INDEX_DIR,
+    FileIndex,
+    get_index_path,
+)
 from .RPM import (
     RPMList,
     RPMName,
     RPM,
     WrongDistroException,
+    get_filename_metadata,
+    read_metadata,
+    sign_pkgs,
 )
+from .repodata import RepodataLoader
+from .repodata_writer import write_repodata
 from ...utils import (
+    get_workers,
     list_files,
+    log_copy_strategies,
+    parallel_map,
     save_file,
     extract_sources,
-    sign_detached,
+    list_files_to_sign,
+    sign_detached_files,
     create_symlink,
-    gpg_unlock,
-    gpg_get_keyhex,
-    gpg_get_keyuid,
+    get_gpg_key,
 )
 
 logger = logging.getLogger(__name__)
+# Minimum number of rpm headers to read to use more than one process
+MIN_PARALLEL_LOAD = 200
 
 
-class CreaterepoError(Exception):
+class CreatereposError(Exception):
     pass
 
 
-class CreatereposError(Exception):
-    pass
+def get_createrepo_cmd():
+    """
+    Returns the createrepo command to use, createrepo_c if it's available
+    """
+    with open(os.devnull, 'w') as devnull:
+        if subprocess.call(
+            ['which', 'createrepo_c'],
+            stdout=devnull,
+            stderr=devnull,
+        ) == 0:
+            return 'createrepo_c'
+    return 'createrepo'
+
+
+def get_dir_size(path, exclude_dirs=()):
+    """
+    Returns the total size of the rpms under the given dir, skipping the
+    given subdirs
+    """
+    size = 0
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [
+            dirname for dirname in dirs
+            if os.path.join(root, dirname) not in exclude_dirs
+        ]
+        for fname in files:
+            if fname.endswith('.rpm'):
+                try:
+                    size += os.path.getsize(os.path.join(root, fname))
+                except OSError:
+                    pass
+    return size
+
+
+def run_createrepo(job):
+    """
+    Runs the given createrepo job, it's module level so it can be run by a
+    pool of processes
+
+    :param job: tuple with the repository dir and the createrepo command
+    :returns: tuple with the repository dir, the return code and the
+        duration in seconds
+    """
+    repo_dir, cmd = job
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        res = subprocess.call(cmd, stdout=devnull)
+    return repo_dir, res, time.time() - start
 
 
 class RPMStore(ArtifactStore):
@@ -83,12 +143,22 @@ class RPMStore(ArtifactStore):
 
     Configuration options:
 
+    * createrepo_workers
+        Maximum number of createrepo jobs to run at the same time, 0 to run
+        one per cpu. The binary and the SRPMS metadata of each distro are
+        generated by separate jobs, starting with the biggest ones
+
     * distro_reg
         Regular expression to extract the distribution from the release string
 
     * extra_symlinks
         Comma separated list of orig:symlink pairs to create links, the paths
 
+    * header_index
+        If true, will keep an index with the metadata of the rpms in the repo
+        so it does not have to read the headers of the unchanged rpms when
+        loading it again
+
     * on_wrong_distro
         Action to execute when a package has an incorrect distro (it's release
         string does not match the distro_reg regular expression). Possible
@@ -102,6 +172,39 @@ class RPMStore(ArtifactStore):
         Prefixes of this store inside the globl artifact repository, separated
         by commas
 
+    * incremental_createrepo
+        If true, will regenerate the metadata only of the distros that had
+        rpms added, removed or signed (or that have no metadata yet), updating
+        it instead of generating it from scratch and keeping a cache of the
+        rpms checksums in the .repoman dir of the store
+
+    * lazy_headers
+        If true, will guess the name, version, release and arch of the binary
+        rpms from their file names, reading their headers only when the
+        signature or the source rpm is needed
+
+    * load_from_repodata
+        If true, when loading the repo, will get the metadata of the binary
+        rpms from the existing repodata of each distro, reading only the
+        headers of the rpms that are not there or changed since it was
+        generated
+
+    * repodata_compression
+        Compression to use for the metadata files generated with the native
+        repodata writer, gz or zst (needs the zstandard module)
+
+    * repodata_writer
+        How to generate the metadata of the repositories, 'createrepo' to
+        run createrepo_c (or createrepo) on them, or 'native' to generate it
+        in-process, reusing the checksums of the rpms the store already knows
+        and, with header_index, the info of the rpms that did not change
+
+    * remote_headers_only
+        If true, will download only the headers of the rpms passed as urls
+        (with http range requests), downloading the whole rpms only when
+        saving them into the store, so the ones that are filtered out are
+        never downloaded
+
     * rpm_dir
         name of the directory that will contain the rpms (rpm by default), if
         empty, it will not create a subdirectory for the rpms and will be put
@@ -114,10 +217,19 @@ class RPMStore(ArtifactStore):
     * signing_passphrase
         Passphrase for the above key
 
+    * signing_workers
+        Number of rpmsign processes to run at the same time when signing the
+        rpms, each on a different set of them, and of gpg processes when
+        signing the sources, 0 to run one per cpu
+
     * temp_dir
         Temporary dir to store any transient downloads (like rpms from
         urls). The caller should make sure it exists and clean it up if needed.
 
+    * verify_lazy_headers
+        If true, when saving, will check that the file names of the new rpms
+        loaded with lazy_headers match their headers, failing if not
+
     * with_sources
         If true, will extract the sources form the scrrpms
 
@@ -128,14 +240,24 @@ class RPMStore(ArtifactStore):
 
     CONFIG_SECTION = 'RPMStore'
     DEFAULT_CONFIG = {
+        'createrepo_workers': '0',
         'distro_reg': r'\.(fc|el)\d+(?=\w*)',
         'extra_symlinks': '',
+        'header_index': 'true',
+        'incremental_createrepo': 'true',
+        'lazy_headers': 'false',
+        'load_from_repodata': 'true',
         'on_wrong_distro': 'fail',
         'path_prefix': 'rpm,src',
+        'remote_headers_only': 'false',
+        'repodata_compression': 'gz',
+        'repodata_writer': 'createrepo',
         'rpm_dir': 'rpm',
         'signing_key': '',
         'signing_passphrase': 'ask',
+        'signing_workers': '1',
         'temp_dir': 'generate',
+        'verify_lazy_headers': 'true',
         'with_sources': 'false',
         'with_srcrpms': 'true',
     }
@@ -161,23 +283,97 @@ class RPMStore(ArtifactStore):
         self.sign_key = config.get('signing_key')
         self.sign_passphrase = config.get('signing_passphrase')
         self.on_wrong_distro = config.get('on_wrong_distro')
+        self.header_index = None
+        # rpms whose metadata is not up to date in the header index
+        self.to_index = []
+        # new rpms guessed from their file names, to verify when saving
+        self.to_verify = []
+        # (store path, distro) pairs that changed and need new metadata
+        self.dirty_repos = set()
+        self.lazy_headers = config.getboolean('lazy_headers')
         # init first, add existing repo after
         if repo_path:
             logger.info('Loading repo %s', repo_path)
-            for pkg in list_files(repo_path, '.rpm'):
+            if config.getboolean('header_index'):
+                self.header_index = FileIndex(
+                    get_index_path(repo_path, 'rpm_headers')
+                )
+            pkg_paths = list_files(repo_path, '.rpm')
+            metadatas = self.load_metadata(pkg_paths)
+            for pkg_path, metadata in zip(pkg_paths, metadatas):
                 self.add_artifact(
-                    pkg,
+                    pkg_path,
                     to_copy=False,
                     hidelog=True,
+                    metadata=metadata,
                 )
             logger.info('Repo %s loaded', repo_path)
 
+    def load_metadata(self, pkg_paths):
+        """
+        Gets the metadata for the given rpms, from the header index or the
+        existing repodata if possible, guessing it from their file names if
+        lazy_headers is set, or reading their headers otherwise. The
+        headers are read by a pool of processes if there are many of them.
+
+        :param pkg_paths: List of paths to the rpms
+        :returns: List with the metadata for each of the given rpms, in the
+            same order
+        """
+        metadatas = [None] * len(pkg_paths)
+        if self.header_index is not None:
+            metadatas = [
+                self.header_index.get(pkg_path) for pkg_path in pkg_paths
+            ]
+
+        if self.config.getboolean('load_from_repodata'):
+            repodata = RepodataLoader(self.path)
+            metadatas = [
+                repodata.get(pkg_path) if metadata is None else metadata
+                for pkg_path, metadata in zip(pkg_paths, metadatas)
+            ]
+
+        if self.lazy_headers:
+            metadatas = [
+                get_filename_metadata(pkg_path) if metadata is None
+                else metadata
+                for pkg_path, metadata in zip(pkg_paths, metadatas)
+            ]
+
+        to_read = [
+            pkg_path
+            for pkg_path, metadata in zip(pkg_paths, metadatas)
+            if metadata is None
+        ]
+        if not to_read:
+            return metadatas
+
+        workers = 1
+        if len(to_read) >= MIN_PARALLEL_LOAD:
+            workers = get_workers(self.config.getint('load_workers'))
+        logger.info(
+            'Reading %d rpm headers (%d already known) with %d processes',
+            len(to_read),
+            len(pkg_paths) - len(to_read),
+            workers,
+        )
+        read_metadatas = dict(zip(
+            to_read,
+            parallel_map(read_metadata, to_read, workers=workers),
+        ))
+        for pos, pkg_path in enumerate(pkg_paths):
+            if metadatas[pos] is None:
+                metadatas[pos] = read_metadatas[pkg_path]
+                if self.header_index is not None:
+                    self.header_index.set(pkg_path, metadatas[pos])
+        return metadatas
+
     @property
     def path_prefix(self):
         return self._path_prefix
 
     def get_store_path(self, pkg):
-        store_path = self.path.format(**pkg.__dict__)
+        store_path = pkg.format_path(self.path)
         self.realized_paths.add(store_path)
         return store_path
 
@@ -190,10 +386,15 @@ class RPMStore(ArtifactStore):
         else:
             return artifact.endswith('.rpm')
 
+    def needs_download(self, artifact_str):
+        # only the headers will be downloaded when adding it
+        return not self.config.getboolean('remote_headers_only')
+
     def add_artifact(self, pkg, **args):
         self.add_rpm(pkg, **args)
 
-    def add_rpm(self, pkg, onlyifnewer=False, to_copy=True, hidelog=False):
+    def add_rpm(self, pkg, onlyifnewer=False, to_copy=True, hidelog=False,
+                metadata=None):
         """
         Generic functon to add an rpm package to the repo.
 
@@ -206,13 +407,21 @@ class RPMStore(ArtifactStore):
             adding new packages to the repo.
         :param hidelog: If set to True will not show the extra information
             (used when loading a repository to avoid verbose output)
+        :param metadata: Already extracted metadata of the rpm, if any
         """
+        if metadata is None and self.lazy_headers:
+            metadata = get_filename_metadata(pkg)
+            lazy = metadata is not None
+        else:
+            lazy = False
         try:
             pkg = RPM(
                 pkg,
                 temp_dir=self.config.get('temp_dir'),
                 distro_reg=self.config.get('distro_reg'),
                 verify_ssl=self.config.getboolean('verify_ssl'),
+                metadata=metadata,
+                headers_only=self.config.getboolean('remote_headers_only'),
             )
         except WrongDistroException:
             if self.on_wrong_distro == 'copy_to_all':
@@ -225,6 +434,10 @@ class RPMStore(ArtifactStore):
                     temp_dir=self.config.get('temp_dir'),
                     distro_reg=self.config.get('distro_reg'),
                     to_all_distros=('.*',),
+                    metadata=metadata,
+                    headers_only=self.config.getboolean(
+                        'remote_headers_only'
+                    ),
                 )
             elif self.on_wrong_distro == 'fail':
                 raise
@@ -242,8 +455,10 @@ class RPMStore(ArtifactStore):
         if self.artifacts.add_pkg(pkg, onlyifnewer):
             if to_copy:
                 self.to_copy.append(pkg)
+                if lazy:
+                    self.to_verify.append(pkg)
             else:
-                store_path = self.path.format(**pkg.__dict__)
+                store_path = pkg.format_path(self.path)
                 self.realized_paths.add(store_path)
             if not hidelog:
                 logger.info(
@@ -254,7 +469,7 @@ class RPMStore(ArtifactStore):
                 logger.info(
                     "Not adding %s, there's already an equal or newer "
                     "version",
-                    pkg,
+                    pkg.path,
                 )
         if pkg.distro != 'all':
             self.distros.add(pkg.distro)
@@ -269,6 +484,12 @@ class RPMStore(ArtifactStore):
         :param onlylatest: Only copy the latest version of the added rpms.
         """
         logger.info('Saving new added rpms into %s', self.path)
+        if self.config.getboolean('verify_lazy_headers'):
+            for pkg in self.to_verify:
+                pkg.verify_header()
+        self.to_verify = []
+        copy_strategies = self.config.getarray('copy_strategies')
+        used_strategies = []
         for pkg in self.to_copy:
             if onlylatest and not self.is_latest_version(pkg):
                 logger.info(
@@ -285,6 +506,13 @@ class RPMStore(ArtifactStore):
                 dst_distros = self.distros
             else:
                 dst_distros = [pkg.distro]
+            old_inode = pkg.download_payload(
+                verify_ssl=self.config.getboolean('verify_ssl'),
+            )
+            if old_inode is not None:
+                self.artifacts[pkg.name][pkg.version].update_inode(
+                    pkg, old_inode,
+                )
             for distro in dst_distros:
                 pkg_path = pkg.generate_path(self.rpmdir)
                 if pkg.distro == 'all':
@@ -299,8 +527,13 @@ class RPMStore(ArtifactStore):
                         self.get_store_path(pkg),
                         pkg_path,
                     )
-                save_file(pkg.path, dst_path)
+                used_strategies.append(save_file(
+                    pkg.path, dst_path, copy_strategies=copy_strategies,
+                ))
                 pkg.path = dst_path
+                self.mark_dirty(pkg, distro=distro)
+            self.to_index.append(pkg)
+        log_copy_strategies(used_strategies)
         if self.sign_key:
             self.sign_rpms()
         if self.config.getboolean('with_sources'):
@@ -311,6 +544,7 @@ class RPMStore(ArtifactStore):
             )
         self.createrepos()
         self.create_symlinks()
+        self.update_header_index()
         logger.info('')
         logger.info('Saved %s\n', self.path)
         self.to_copy = []
@@ -320,25 +554,22 @@ class RPMStore(ArtifactStore):
         Check if the given package is the latest version in the repo
         :pram pkg: RPM instance of the package to compare
         """
-        verlist = self.artifacts.get(pkg.full_name, {})
-        if not verlist or pkg.full_version in verlist.get_latest():
-            return True
-        return False
+        verlist = self.artifacts.get(pkg.name)
+        return not verlist or verlist.is_latest(pkg.version)
 
-    def _generate_sources_for_added_only(self, with_patches=False, key=None,
-                                         passphrase=None):
+    def _generate_sources_for_added_only(self, with_patches=False):
+        src_dirs = []
         for pkg in self.to_copy:
             if not pkg.is_source:
                 continue
             logger.info("Parsing srpm %s", pkg)
             dst_dir = '%s/src/%s' % (self.get_store_path(pkg), pkg._name)
             extract_sources(pkg.path, dst_dir, with_patches)
-            if key:
-                sign_detached(dst_dir, key, passphrase)
-        logger.info('src dir generated')
+            src_dirs.append(dst_dir)
+        return src_dirs
 
-    def _generate_sources_for_all(self, with_patches=False, key=None,
-                                  passphrase=None):
+    def _generate_sources_for_all(self, with_patches=False):
+        src_dirs = []
         for versions in itervalues(self.artifacts):
             for version in itervalues(versions):
                 for inode in itervalues(version):
@@ -350,8 +581,8 @@ class RPMStore(ArtifactStore):
                 logger.info("Parsing srpm %s", pkg)
                 dst_dir = '%s/src/%s' % (self.get_store_path(pkg), pkg._name)
                 extract_sources(pkg.path, dst_dir, with_patches)
-                if key:
-                    sign_detached(dst_dir, key, passphrase)
+                src_dirs.append(dst_dir)
+        return src_dirs
 
     def generate_sources(self, with_patches=False, key=None, passphrase=None):
         """
@@ -371,45 +602,188 @@ class RPMStore(ArtifactStore):
         else:
             generate_function = self._generate_sources_for_all
 
-        generate_function(
-            with_patches=with_patches,
-            key=key,
-            passphrase=passphrase,
-        )
+        src_dirs = generate_function(with_patches=with_patches)
+        if key:
+            # sign all the sources at once, so they can be signed in parallel
+            fnames = set()
+            for src_dir in src_dirs:
+                fnames.update(list_files_to_sign(src_dir))
+            sign_detached_files(
+                sorted(fnames),
+                key=key,
+                passphrase=passphrase,
+                workers=get_workers(self.config.getint('signing_workers')),
+            )
         logger.info('src dir generated')
 
+    def mark_dirty(self, pkg, distro=None):
+        """
+        Marks the repository (distro) of the given package as changed, so it's
+        metadata is regenerated when saving
+
+        :param pkg: RPM instance that was added, removed or changed
+        :param distro: Distro to mark, if not the package one
+        """
+        distro = distro or pkg.distro
+        if distro == 'all':
+            distros = self.distros
+        else:
+            distros = [distro]
+        store_path = self.get_store_path(pkg)
+        for distro in distros:
+            self.dirty_repos.add((store_path, distro))
+
+    def delete_version(self, art_name, art_version):
+        versions = self.artifacts.get(art_name, {})
+        if art_version in versions:
+            for pkg in versions[art_version].get_artifacts():
+                self.mark_dirty(pkg)
+        ArtifactStore.delete_version(self, art_name, art_version)
+
     @staticmethod
-    def createrepo(dst_dir):
-        createrepo_cmd = 'createrepo'
-        with open(os.devnull, 'w') as devnull:
-            if subprocess.call(
-                ['which', 'createrepo_c'],
-                stdout=devnull,
-            ) == 0:
-                createrepo_cmd = 'createrepo_c'
-            srpms_dir = os.path.join(dst_dir, 'SRPMS')
-            res = subprocess.call(
-                [createrepo_cmd, '--excludes=*.src.rpm', dst_dir],
-                stdout=devnull,
-            )
-            if os.path.exists(srpms_dir):
-                res += subprocess.call(
-                    [createrepo_cmd, srpms_dir],
-                    stdout=devnull,
+    def get_createrepo_jobs(createrepo_cmd, dst_dir, cache_dir=None):
+        """
+        Returns the jobs to generate the metadata for the given repository
+        dir and it's SRPMS subdir, so they can run independently
+
+        :param createrepo_cmd: Createrepo command to use
+        :param dst_dir: Path to the repository (distro dir)
+        :param cache_dir: If passed, will update the existing metadata
+            instead of generating it from scratch, and keep the checksums of
+            the rpms in that dir to avoid calculating them again
+        :returns: list of (size of the rpms, job) tuples, with the job as
+            expected by :func:`run_createrepo`
+        """
+        def get_extra_args(subdir):
+            if not cache_dir:
+                return []
+            return ['--update', '--cachedir', os.path.join(cache_dir, subdir)]
+
+        srpms_dir = os.path.join(dst_dir, 'SRPMS')
+        jobs = [(
+            get_dir_size(dst_dir, exclude_dirs=(srpms_dir,)),
+            (
+                dst_dir,
+                [createrepo_cmd, '--excludes=*.src.rpm'] +
+                get_extra_args('rpms') + [dst_dir],
+            ),
+        )]
+        if os.path.exists(srpms_dir):
+            jobs.append((
+                get_dir_size(srpms_dir),
+                (
+                    srpms_dir,
+                    [createrepo_cmd] + get_extra_args('SRPMS') + [srpms_dir],
+                ),
+            ))
+        return jobs
+
+    @staticmethod
+    def get_repodata_writer_jobs(dst_dir):
+        """
+        Returns the jobs to generate the metadata with the native writer for
+        the given repository dir and it's SRPMS subdir
+
+        :param dst_dir: Path to the repository (distro dir)
+        :returns: list of (size of the rpms, job) tuples, with the job being
+            a (repository dir, rpm paths) tuple
+        """
+        srpms_dir = os.path.join(dst_dir, 'SRPMS')
+        repos = [(
+            dst_dir,
+            [
+                path for path in list_files(dst_dir, '.rpm')
+                if not path.endswith('.src.rpm') and
+                not path.startswith(srpms_dir + os.sep)
+            ],
+        )]
+        if os.path.exists(srpms_dir):
+            repos.append((srpms_dir, list_files(srpms_dir, '.rpm')))
+        return [
+            (sum(os.path.getsize(path) for path in paths), (repo_dir, paths))
+            for repo_dir, paths in repos
+        ]
+
+    def write_repodatas(self, jobs):
+        """
+        Generates the metadata of the given repositories in-process, reusing
+        the checksums the store already has for the rpms and keeping the ones
+        calculated so they end up in the header index. If the header index is
+        enabled, the info extracted from the headers of the rpms is kept in
+        another index next to it, so only the headers of the new or changed
+        rpms are read on the next runs
+
+        :param jobs: list of jobs as returned by
+            :func:`get_repodata_writer_jobs`
+        :returns: list of (repository dir, return code, duration) tuples
+        """
+        compression = self.config.get('repodata_compression')
+        pkg_index = None
+        if self.header_index is not None:
+            pkg_index = FileIndex(get_index_path(self.path, 'repodata_pkgs'))
+        pkgs = dict(
+            (os.path.abspath(pkg.path), pkg) for pkg in self.get_rpms()
+        )
+        checksums = dict(
+            (path, pkg.checksum)
+            for path, pkg in iteritems(pkgs)
+            if pkg.checksum
+        )
+        results = []
+        for repo_dir, pkg_paths in jobs:
+            start = time.time()
+            try:
+                write_repodata(
+                    repo_dir,
+                    [os.path.abspath(path) for path in pkg_paths],
+                    checksums=checksums,
+                    compression=compression,
+                    pkg_index=pkg_index,
                 )
+                res = 0
+            except Exception as exc:
+                logger.error(
+                    '  Failed to write the metadata of %s: %s', repo_dir, exc,
+                )
+                res = 1
+            results.append((repo_dir, res, time.time() - start))
+
+        if pkg_index is not None:
+            pkg_index.prune(set(pkgs))
+            pkg_index.save()
+        for path, checksum in iteritems(checksums):
+            pkg = pkgs.get(path)
+            if pkg is not None and pkg.checksum != checksum:
+                pkg.checksum = checksum
+                self.to_index.append(pkg)
+        return results
 
-        if res != 0:
-            raise CreaterepoError(
-                "Createrepo failed on %s with rc %d" % (dst_dir, res)
-            )
+    @staticmethod
+    def has_metadata(dst_dir):
+        """
+        Checks if the given repository dir, and it's SRPMS subdir if any, have
+        metadata already
+        """
+        repo_dirs = [dst_dir]
+        srpms_dir = os.path.join(dst_dir, 'SRPMS')
+        if os.path.exists(srpms_dir):
+            repo_dirs.append(srpms_dir)
+        return all(
+            os.path.exists(os.path.join(repo_dir, 'repodata', 'repomd.xml'))
+            for repo_dir in repo_dirs
+        )
 
     def createrepos(self):
         """
-        Generate the yum repositories metadata
+        Generate the yum repositories metadata, if incremental_createrepo is
+        set, only for the repositories that changed
         """
         logger.info('')
         logger.info('Updating metadata')
-        procs = []
+        incremental = self.config.getboolean('incremental_createrepo')
+        native = self.config.get('repodata_writer') == 'native'
+        createrepo_cmd = None
+        jobs = []
         for distro in self.distros:
             logger.info('  Creating metadata for %s', distro)
             for path in self.realized_paths:
@@ -418,17 +792,57 @@ class RPMStore(ArtifactStore):
                     logger.debug('Skipping non-existing path %s', dst_dir)
                     continue
 
-                new_proc = mp.Process(
-                    target=self.createrepo,
-                    args=(dst_dir,),
-                )
-                new_proc.start()
-                procs.append(new_proc)
+                cache_dir = None
+                if incremental:
+                    if (
+                        (path, distro) not in self.dirty_repos and
+                        self.has_metadata(dst_dir)
+                    ):
+                        logger.debug('Skipping unchanged repo %s', dst_dir)
+                        continue
+                    cache_dir = os.path.join(
+                        path, INDEX_DIR, 'createrepo_cache', distro,
+                    )
 
-        for proc in procs:
-            proc.join()
-            if proc.exitcode != 0:
-                raise CreatereposError("Failed to create some repos metadata")
+                if native:
+                    jobs.extend(self.get_repodata_writer_jobs(dst_dir))
+                    continue
+
+                if createrepo_cmd is None:
+                    createrepo_cmd = get_createrepo_cmd()
+                jobs.extend(self.get_createrepo_jobs(
+                    createrepo_cmd, dst_dir, cache_dir,
+                ))
+
+        # start with the biggest repos, so they don't end up running alone
+        jobs.sort(key=lambda job: job[0], reverse=True)
+        if native:
+            results = self.write_repodatas([job for _, job in jobs])
+        else:
+            workers = get_workers(self.config.getint('createrepo_workers'))
+            results = parallel_map(
+                run_createrepo,
+                [job for _, job in jobs],
+                workers=workers,
+                chunksize=1,
+            )
+        failed = []
+        for repo_dir, res, duration in results:
+            if res != 0:
+                logger.error(
+                    '  Createrepo failed on %s with rc %d', repo_dir, res,
+                )
+                failed.append(repo_dir)
+            else:
+                logger.info(
+                    '  Created metadata for %s in %.2fs', repo_dir, duration,
+                )
+        if failed:
+            raise CreatereposError(
+                "Failed to create some repos metadata: %s"
+                % ', '.join(failed)
+            )
+        self.dirty_repos = set()
 
     def delete_old(self, keep=1, noop=False):
         """
@@ -504,26 +918,56 @@ class RPMStore(ArtifactStore):
         """
         Sign all the unsigned rpms in the repo.
         """
-        gpg = gpg_unlock(
-            key_path=self.sign_key,
-            passphrase=self.sign_passphrase
-        )
-        keyuid = gpg_get_keyuid(self.sign_key, gpg=gpg)
-        key_hex = gpg_get_keyhex(self.sign_key, gpg=gpg)
-        del(gpg)
+        gpg_key = get_gpg_key(self.sign_key, use_agent=True)
+        gpg_key.unlock(passphrase=self.sign_passphrase)
+        keyuid = gpg_key.uid
+        key_hex = gpg_key.keyid
         logger.info('')
         logger.info('Signing packages with key: %s', self.sign_key)
         logger.info('Signing key uid: %s', keyuid)
         logger.info('Signing key hex: %s', key_hex)
-        for pkg in self.get_rpms():
-            logger.info('Got package %s', pkg)
-            logger.info('Signature: %s', pkg.key_hex)
-        for pkg in self.get_rpms(
-            fmatch=lambda pkg: pkg.key_hex != key_hex
-        ):
-            pkg.sign(key_path=self.sign_key, passwd=self.sign_passphrase)
+        rpms = self.get_rpms()
+        to_sign = [pkg for pkg in rpms if pkg.key_hex != key_hex]
+        for pkg in to_sign:
+            logger.debug('Got package %s, signature: %s', pkg, pkg.key_hex)
+        logger.info(
+            'Signing %d packages, %d already signed with the key',
+            len(to_sign), len(rpms) - len(to_sign),
+        )
+        failed = sign_pkgs(
+            to_sign,
+            key_hex=key_hex,
+            passwd=self.sign_passphrase,
+            workers=get_workers(self.config.getint('signing_workers')),
+        )
+        for pkg in to_sign:
+            # even the failed ones might have lost their old signature
+            self.to_index.append(pkg)
+            self.mark_dirty(pkg)
+        if failed:
+            raise Exception(
+                'Failed to sign the packages: %s'
+                % ', '.join(pkg.path for pkg in failed)
+            )
         logger.info("Done signing")
 
+    def update_header_index(self):
+        """
+        Updates the header index with the rpms that were added, changed or
+        removed, and writes it to disk if anything changed
+        """
+        if self.header_index is None:
+            return
+
+        for pkg in self.to_index:
+            if os.path.exists(pkg.path):
+                self.header_index.set(pkg.path, pkg.metadata)
+        self.to_index = []
+        self.header_index.prune(
+            set(pkg.path for pkg in self.get_rpms())
+        )
+        self.header_index.save()
+
     def create_symlinks(self):
         """Creates all the symlinks to the dirs passed on the config"""
         logger.info('')
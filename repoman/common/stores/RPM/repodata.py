@@ -0,0 +1,234 @@
+"""
+This module holds the helpers to read the yum metadata (repodata) of the
+repositories in an rpm store, so the packages can be loaded from it instead of
+reading each rpm header::
+
+    $dist
+    ├── repodata
+    │   ├── repomd.xml
+    │   ├── $checksum-primary.xml.gz
+    │   └── ...
+    ├── SRPMS
+    │   └── repodata
+    │       └── ...
+    └── $arch
+        └── ...
+"""
+import bz2
+import gzip
+import logging
+import os
+import xml.etree.ElementTree as ET
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+REPO_NS = '{http://linux.duke.edu/metadata/repo}'
+COMMON_NS = '{http://linux.duke.edu/metadata/common}'
+RPM_NS = '{http://linux.duke.edu/metadata/rpm}'
+SOURCE_ARCHES = ('src', 'nosrc')
+
+
+def open_compressed(path):
+    """
+    Opens the given metadata file for reading, decompressing it on the fly
+    depending on it's extension.
+
+    :returns: file object or None if the compression is not supported
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    elif path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'rb')
+    elif path.endswith('.xz'):
+        if lzma is None:
+            logger.debug('No lzma support to read %s', path)
+            return None
+        return lzma.open(path, 'rb')
+    elif path.endswith('.zst'):
+        if zstandard is None:
+            logger.debug('No zstandard module to read %s', path)
+            return None
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+    return open(path, 'rb')
+
+
+def get_primary_path(repo_dir):
+    """
+    Returns the path to the primary metadata file of the given repository, or
+    None if it has no metadata
+    """
+    repomd_path = os.path.join(repo_dir, 'repodata', 'repomd.xml')
+    if not os.path.exists(repomd_path):
+        return None
+
+    try:
+        repomd = ET.parse(repomd_path)
+    except ET.ParseError as exc:
+        logger.warn('Ignoring malformed %s: %s', repomd_path, exc)
+        return None
+
+    for data in repomd.getroot().iter(REPO_NS + 'data'):
+        if data.get('type') != 'primary':
+            continue
+        location = data.find(REPO_NS + 'location')
+        if location is not None:
+            return os.path.join(repo_dir, location.get('href'))
+    return None
+
+
+def iter_primary(repo_dir):
+    """
+    Streams the packages listed in the primary metadata of the given
+    repository
+
+    :param repo_dir: Path to the repository (the dir that has the repodata
+        dir)
+    :returns: iterator of (path, package info dict) pairs, the path being the
+        absolute path to the rpm
+    """
+    primary_path = get_primary_path(repo_dir)
+    if primary_path is None or not os.path.exists(primary_path):
+        return
+
+    primary_fd = open_compressed(primary_path)
+    if primary_fd is None:
+        return
+
+    with primary_fd:
+        for _, elem in ET.iterparse(primary_fd):
+            if elem.tag != COMMON_NS + 'package':
+                continue
+            if elem.get('type') == 'rpm':
+                yield get_package_info(repo_dir, elem)
+            elem.clear()
+
+
+def get_package_info(repo_dir, elem):
+    """
+    Extracts the package info from the given primary package element
+    """
+    version = elem.find(COMMON_NS + 'version')
+    checksum = elem.find(COMMON_NS + 'checksum')
+    sourcerpm = elem.find(COMMON_NS + 'format/' + RPM_NS + 'sourcerpm')
+    path = os.path.normpath(os.path.join(
+        repo_dir,
+        elem.find(COMMON_NS + 'location').get('href'),
+    ))
+    return path, {
+        'name': elem.findtext(COMMON_NS + 'name'),
+        'arch': elem.findtext(COMMON_NS + 'arch'),
+        'epoch': version.get('epoch'),
+        'version': version.get('ver'),
+        'release': version.get('rel'),
+        'checksum': [checksum.get('type'), checksum.text],
+        'sourcerpm': sourcerpm is not None and sourcerpm.text or '',
+        'size': int(elem.find(COMMON_NS + 'size').get('package')),
+        'mtime': int(elem.find(COMMON_NS + 'time').get('file')),
+    }
+
+
+def find_repo_dir(pkg_path, root_dir, cache):
+    """
+    Finds the repository (dir with repodata) the given rpm belongs to, looking
+    up the parent dirs up to the given root dir
+
+    :param pkg_path: Path to the rpm
+    :param root_dir: Top dir to look into
+    :param cache: Dict to cache the results per directory
+    """
+    pkg_dir = os.path.dirname(pkg_path)
+    checked = []
+    cur_dir = pkg_dir
+    repo_dir = None
+    while cur_dir.startswith(root_dir):
+        if cur_dir in cache:
+            repo_dir = cache[cur_dir]
+            break
+        checked.append(cur_dir)
+        if os.path.exists(os.path.join(cur_dir, 'repodata', 'repomd.xml')):
+            repo_dir = cur_dir
+            break
+        if cur_dir == root_dir:
+            break
+        cur_dir = os.path.dirname(cur_dir)
+    for checked_dir in checked:
+        cache[checked_dir] = repo_dir
+    return repo_dir
+
+
+class RepodataLoader(object):
+    """
+    Provides the metadata of the rpms of a store from the existing repodata of
+    the repositories in it, for the binary rpms that did not change since the
+    repodata was generated.
+
+    The repodata does not have the signature of the packages, so the metadata
+    returned does not include the signature fields. Source rpms are never
+    loaded from it, as the repodata does not have the build arch of the
+    package, that is used to group them with their binaries.
+    """
+    def __init__(self, root_dir):
+        """
+        :param root_dir: Root dir of the store
+        """
+        self.root_dir = os.path.abspath(root_dir)
+        self.packages = {}
+        self.repo_dirs = {}
+        self.loaded_repos = set()
+
+    def load_repo(self, repo_dir):
+        if repo_dir in self.loaded_repos:
+            return
+        self.loaded_repos.add(repo_dir)
+        logger.debug('Loading repodata for %s', repo_dir)
+        try:
+            for path, info in iter_primary(repo_dir):
+                if info['arch'] not in SOURCE_ARCHES:
+                    self.packages[path] = info
+        except (IOError, OSError, EOFError, ET.ParseError) as exc:
+            logger.warn('Failed to read repodata for %s: %s', repo_dir, exc)
+
+    def get(self, pkg_path):
+        """
+        Returns the metadata for the given rpm, in the same format as the
+        RPM class expects it but without the signature fields, or None if
+        it's not in the repodata or it changed since it was generated
+        """
+        pkg_path = os.path.abspath(pkg_path)
+        repo_dir = find_repo_dir(pkg_path, self.root_dir, self.repo_dirs)
+        if repo_dir is None:
+            return None
+
+        self.load_repo(repo_dir)
+        info = self.packages.get(pkg_path)
+        if info is None:
+            return None
+
+        try:
+            stat = os.stat(pkg_path)
+        except OSError:
+            return None
+
+        if stat.st_size != info['size'] or int(stat.st_mtime) != info['mtime']:
+            return None
+
+        return {
+            'name': info['name'],
+            'version': info['version'],
+            'release': info['release'],
+            'arch': info['arch'],
+            'is_source': False,
+            'sourcerpm': info['sourcerpm'],
+            'checksum': info['checksum'],
+            'inode': stat.st_ino,
+        }
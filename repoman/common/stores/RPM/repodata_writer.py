@@ -0,0 +1,629 @@
+"""
+This module holds a native writer for the yum metadata (repodata) of a
+repository, an alternative to running createrepo that generates the same
+primary, filelists and other files straight from the rpm headers, reusing the
+checksums of the rpms that are already known and, if an index is passed, the
+info extracted from the headers of the rpms that did not change::
+
+    $repo_dir
+    ├── repodata
+    │   ├── repomd.xml
+    │   ├── $checksum-primary.xml.gz
+    │   ├── $checksum-filelists.xml.gz
+    │   └── $checksum-other.xml.gz
+    └── $arch
+        └── ...
+"""
+import gzip
+import hashlib
+import logging
+import os
+import re
+import stat
+import tempfile
+import time
+from xml.sax.saxutils import escape, quoteattr
+
+import rpm
+import six
+
+from .RPM import read_header, read_header_range
+from .repodata import COMMON_NS, REPO_NS, RPM_NS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+CHECKSUM_TYPE = 'sha256'
+# Number of changelog entries to include for each package, as createrepo_c
+CHANGELOG_LIMIT = 10
+# Files that are included in the primary metadata too, as createrepo does
+PRIMARY_FILES_REG = re.compile(r'^(.*bin/.*|/etc/.*|/usr/lib/sendmail)$')
+# Characters that are not allowed in xml 1.0
+INVALID_XML_CHARS_REG = re.compile(
+    u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]'
+)
+# Metadata files generated by createrepo or by this module
+OLD_METADATA_REG = re.compile(
+    r'^[0-9a-f]+-(primary|filelists|other)\.(xml|sqlite)\.\w+$'
+)
+FILELISTS_NS = 'http://linux.duke.edu/metadata/filelists'
+OTHER_NS = 'http://linux.duke.edu/metadata/other'
+COMPRESSIONS = ('gz', 'zst')
+# rpm dependency flags, as in rpmds.h
+RPMSENSE_LESS = 2
+RPMSENSE_GREATER = 4
+RPMSENSE_EQUAL = 8
+RPMSENSE_PREREQ = 64
+RPMSENSE_SCRIPT_PRE = 512
+RPMSENSE_SCRIPT_POST = 1024
+RPMFILE_GHOST = 64
+DEP_FLAGS = {
+    RPMSENSE_EQUAL: 'EQ',
+    RPMSENSE_LESS: 'LT',
+    RPMSENSE_GREATER: 'GT',
+    RPMSENSE_LESS | RPMSENSE_EQUAL: 'LE',
+    RPMSENSE_GREATER | RPMSENSE_EQUAL: 'GE',
+}
+# Dependency types in primary, with their header tags
+DEP_TYPES = (
+    ('provides', 'PROVIDE'),
+    ('conflicts', 'CONFLICT'),
+    ('obsoletes', 'OBSOLETE'),
+    ('requires', 'REQUIRE'),
+    ('suggests', 'SUGGEST'),
+    ('enhances', 'ENHANCE'),
+    ('recommends', 'RECOMMEND'),
+    ('supplements', 'SUPPLEMENT'),
+)
+
+
+def to_text(value):
+    """
+    Returns the given header value as text, removing any characters not
+    allowed in xml
+    """
+    if value is None:
+        return u''
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    elif not isinstance(value, six.text_type):
+        value = six.text_type(value)
+    return INVALID_XML_CHARS_REG.sub(u'', value)
+
+
+def tag_values(hdr, tag_name):
+    """
+    Returns the list of values of the given header tag, or an empty list if
+    the tag is not supported by the installed rpm version
+    """
+    tag = getattr(rpm, 'RPMTAG_' + tag_name, None)
+    if tag is None:
+        return []
+    values = hdr[tag]
+    if values is None:
+        return []
+    if not isinstance(values, list):
+        return [values]
+    return values
+
+
+def tag_value(hdr, tag_name, default=None):
+    values = tag_values(hdr, tag_name)
+    return values[0] if values else default
+
+
+def parse_evr(evr):
+    """
+    Splits the given [epoch:]version[-release] string into it's parts
+    """
+    epoch = None
+    if ':' in evr:
+        epoch, evr = evr.split(':', 1)
+    release = None
+    if '-' in evr:
+        evr, release = evr.rsplit('-', 1)
+    return epoch or '0', evr, release
+
+
+def get_file_checksum(path, checksum_type=CHECKSUM_TYPE):
+    checksum = hashlib.new(checksum_type)
+    with open(path, 'rb') as rpm_fd:
+        for chunk in iter(lambda: rpm_fd.read(1024 * 1024), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class PackageInfo(object):
+    """
+    All the info of an rpm needed for the metadata, extracted from it's header
+    """
+    def __init__(self, path, repo_dir, checksum=None):
+        """
+        :param path: Path to the rpm
+        :param repo_dir: Path to the repository the rpm is in
+        :param checksum: Already known checksum of the rpm, as a (type, value)
+            pair, it will be calculated if not passed or not the right type
+        """
+        hdr, _ = read_header(path)
+        file_stat = os.stat(path)
+        if not checksum or checksum[0] != CHECKSUM_TYPE:
+            checksum = (CHECKSUM_TYPE, get_file_checksum(path))
+        self.checksum = list(checksum)
+        self.location = os.path.relpath(path, repo_dir)
+        self.name = to_text(hdr[rpm.RPMTAG_NAME])
+        if hdr[rpm.RPMTAG_SOURCEPACKAGE]:
+            self.arch = u'src'
+        else:
+            self.arch = to_text(hdr[rpm.RPMTAG_ARCH] or 'noarch')
+        self.epoch = to_text(hdr[rpm.RPMTAG_EPOCH] or 0)
+        self.version = to_text(hdr[rpm.RPMTAG_VERSION])
+        self.release = to_text(hdr[rpm.RPMTAG_RELEASE])
+        self.summary = to_text(hdr[rpm.RPMTAG_SUMMARY])
+        self.description = to_text(hdr[rpm.RPMTAG_DESCRIPTION])
+        self.packager = to_text(hdr[rpm.RPMTAG_PACKAGER])
+        self.url = to_text(hdr[rpm.RPMTAG_URL])
+        self.file_time = int(file_stat.st_mtime)
+        self.build_time = int(hdr[rpm.RPMTAG_BUILDTIME] or 0)
+        self.package_size = file_stat.st_size
+        self.installed_size = int(
+            tag_value(hdr, 'LONGSIZE') or tag_value(hdr, 'SIZE') or 0
+        )
+        self.archive_size = int(
+            tag_value(hdr, 'LONGARCHIVESIZE') or
+            tag_value(hdr, 'ARCHIVESIZE') or
+            0
+        )
+        self.license = to_text(hdr[rpm.RPMTAG_LICENSE])
+        self.vendor = to_text(hdr[rpm.RPMTAG_VENDOR])
+        self.group = to_text(hdr[rpm.RPMTAG_GROUP])
+        self.buildhost = to_text(hdr[rpm.RPMTAG_BUILDHOST])
+        self.sourcerpm = to_text(hdr[rpm.RPMTAG_SOURCERPM])
+        self.header_range = read_header_range(path)
+        self.files = self.get_files(hdr)
+        self.deps = dict(
+            (dep_type, self.get_deps(hdr, tag_prefix, dep_type))
+            for dep_type, tag_prefix in DEP_TYPES
+        )
+        # the requirements provided by the package itself are not listed
+        provided = set(
+            dep[:5] for dep in self.deps['provides']
+        ) | set(
+            (path, None, None, None, None) for path, _ in self.files
+        )
+        self.deps['requires'] = [
+            dep for dep in self.deps['requires']
+            if dep[:5] not in provided
+        ]
+        self.changelogs = self.get_changelogs(hdr)
+
+    def to_data(self):
+        """
+        Returns the info as a json serializable dict, to store it in an index
+        and rebuild it later with :func:`from_data` without reading the
+        header again
+        """
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_data(cls, data, path, repo_dir):
+        """
+        Rebuilds the info of the given rpm from the data returned by
+        :func:`to_data`, the rpm must not have changed since
+
+        :param data: Stored info of the rpm
+        :param path: Path to the rpm
+        :param repo_dir: Path to the repository the rpm is in
+        """
+        pkg = cls.__new__(cls)
+        pkg.__dict__.update(data)
+        pkg.location = os.path.relpath(path, repo_dir)
+        return pkg
+
+    @staticmethod
+    def get_deps(hdr, tag_prefix, dep_type):
+        """
+        Returns the list of dependencies of the given type, as
+        (name, flags, epoch, version, release, pre) tuples
+        """
+        names = tag_values(hdr, tag_prefix + 'NAME')
+        flags = tag_values(hdr, tag_prefix + 'FLAGS')
+        versions = tag_values(hdr, tag_prefix + 'VERSION')
+        deps = []
+        seen = set()
+        for name, dep_flags, evr in zip(names, flags, versions):
+            name = to_text(name)
+            evr = to_text(evr)
+            if dep_type == 'requires' and name.startswith(u'rpmlib('):
+                continue
+            pre = bool(
+                dep_type == 'requires' and
+                dep_flags & (
+                    RPMSENSE_PREREQ |
+                    RPMSENSE_SCRIPT_PRE |
+                    RPMSENSE_SCRIPT_POST
+                )
+            )
+            cmp_flags = DEP_FLAGS.get(
+                dep_flags & (RPMSENSE_LESS | RPMSENSE_GREATER | RPMSENSE_EQUAL)
+            )
+            if cmp_flags and evr:
+                epoch, version, release = parse_evr(evr)
+            else:
+                cmp_flags = epoch = version = release = None
+            dep = (name, cmp_flags, epoch, version, release, pre)
+            if dep in seen:
+                continue
+            seen.add(dep)
+            deps.append(dep)
+        return deps
+
+    @staticmethod
+    def get_files(hdr):
+        """
+        Returns the list of files of the package, as (path, type) tuples,
+        the type being None for regular files
+        """
+        paths = tag_values(hdr, 'FILENAMES')
+        modes = tag_values(hdr, 'FILEMODES')
+        flags = tag_values(hdr, 'FILEFLAGS')
+        files = []
+        for path, mode, file_flags in zip(paths, modes, flags):
+            if file_flags & RPMFILE_GHOST:
+                file_type = u'ghost'
+            elif stat.S_ISDIR(mode & 0xffff):
+                file_type = u'dir'
+            else:
+                file_type = None
+            files.append((to_text(path), file_type))
+        return files
+
+    @staticmethod
+    def get_changelogs(hdr):
+        """
+        Returns the latest changelog entries, as (author, date, text) tuples,
+        oldest first
+        """
+        changelogs = list(zip(
+            tag_values(hdr, 'CHANGELOGNAME'),
+            tag_values(hdr, 'CHANGELOGTIME'),
+            tag_values(hdr, 'CHANGELOGTEXT'),
+        ))[:CHANGELOG_LIMIT]
+        return [
+            (to_text(author), int(date), to_text(text))
+            for author, date, text in reversed(changelogs)
+        ]
+
+
+class MetadataFile(object):
+    """
+    Compressed metadata file being written, it's written to a temporary file
+    in the repodata dir and renamed when closed to it's final name, prefixed
+    with it's checksum
+    """
+    def __init__(self, repodata_dir, data_type, compression='gz'):
+        self.repodata_dir = repodata_dir
+        self.data_type = data_type
+        self.compression = compression
+        self.open_checksum = hashlib.new(CHECKSUM_TYPE)
+        self.open_size = 0
+        tmp_fd, self.tmp_path = tempfile.mkstemp(
+            dir=repodata_dir, prefix='.%s-' % data_type,
+        )
+        self.raw_fd = os.fdopen(tmp_fd, 'wb')
+        if compression == 'zst':
+            self.fd = zstandard.ZstdCompressor().stream_writer(self.raw_fd)
+        else:
+            self.fd = gzip.GzipFile(
+                filename='', mode='wb', fileobj=self.raw_fd, mtime=0,
+            )
+        self.path = None
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.open_checksum.update(data)
+        self.open_size += len(data)
+        self.fd.write(data)
+
+    def close(self):
+        if self.compression == 'zst':
+            self.fd.flush(zstandard.FLUSH_FRAME)
+        else:
+            self.fd.close()
+        self.raw_fd.close()
+        checksum = get_file_checksum(self.tmp_path)
+        self.path = os.path.join(
+            self.repodata_dir,
+            '%s-%s.xml.%s' % (checksum, self.data_type, self.compression),
+        )
+        os.rename(self.tmp_path, self.path)
+        os.chmod(self.path, 0o644)
+        self.checksum = checksum
+        self.size = os.stat(self.path).st_size
+
+    def abort(self):
+        try:
+            self.raw_fd.close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+    def to_repomd(self, timestamp):
+        """
+        Returns the xml entry for this file in repomd.xml
+        """
+        return (
+            u'<data type="%s">\n'
+            u'  <checksum type="%s">%s</checksum>\n'
+            u'  <open-checksum type="%s">%s</open-checksum>\n'
+            u'  <location href="repodata/%s"/>\n'
+            u'  <timestamp>%d</timestamp>\n'
+            u'  <size>%d</size>\n'
+            u'  <open-size>%d</open-size>\n'
+            u'</data>\n'
+        ) % (
+            self.data_type,
+            CHECKSUM_TYPE, self.checksum,
+            CHECKSUM_TYPE, self.open_checksum.hexdigest(),
+            os.path.basename(self.path),
+            timestamp,
+            self.size,
+            self.open_size,
+        )
+
+
+def attrs(**kwargs):
+    """
+    Returns the given xml attributes as a string, skipping the ones that are
+    None, sorted by name
+    """
+    return u''.join(
+        u' %s=%s' % (name, quoteattr(to_text(value)))
+        for name, value in sorted(kwargs.items())
+        if value is not None
+    )
+
+
+def version_xml(pkg):
+    return u'<version epoch=%s ver=%s rel=%s/>' % (
+        quoteattr(pkg.epoch), quoteattr(pkg.version), quoteattr(pkg.release),
+    )
+
+
+def files_xml(files, indent):
+    return u''.join(
+        u'%s<file%s>%s</file>\n'
+        % (indent, attrs(type=file_type), escape(path))
+        for path, file_type in files
+    )
+
+
+def primary_xml(pkg):
+    """
+    Returns the xml entry for the given package in the primary metadata
+    """
+    deps_xml = u''
+    for dep_type, _ in DEP_TYPES:
+        deps = pkg.deps[dep_type]
+        if not deps:
+            continue
+        deps_xml += u'    <rpm:%s>\n' % dep_type
+        for name, flags, epoch, version, release, pre in deps:
+            deps_xml += u'      <rpm:entry name=%s%s%s/>\n' % (
+                quoteattr(name),
+                attrs(flags=flags, epoch=epoch, ver=version, rel=release),
+                pre and u' pre="1"' or u'',
+            )
+        deps_xml += u'    </rpm:%s>\n' % dep_type
+    return (
+        u'<package type="rpm">\n'
+        u'  <name>%s</name>\n'
+        u'  <arch>%s</arch>\n'
+        u'  %s\n'
+        u'  <checksum type="%s" pkgid="YES">%s</checksum>\n'
+        u'  <summary>%s</summary>\n'
+        u'  <description>%s</description>\n'
+        u'  <packager>%s</packager>\n'
+        u'  <url>%s</url>\n'
+        u'  <time file="%d" build="%d"/>\n'
+        u'  <size package="%d" installed="%d" archive="%d"/>\n'
+        u'  <location href=%s/>\n'
+        u'  <format>\n'
+        u'    <rpm:license>%s</rpm:license>\n'
+        u'    <rpm:vendor>%s</rpm:vendor>\n'
+        u'    <rpm:group>%s</rpm:group>\n'
+        u'    <rpm:buildhost>%s</rpm:buildhost>\n'
+        u'    <rpm:sourcerpm>%s</rpm:sourcerpm>\n'
+        u'    <rpm:header-range start="%d" end="%d"/>\n'
+        u'%s%s'
+        u'  </format>\n'
+        u'</package>\n'
+    ) % (
+        escape(pkg.name),
+        escape(pkg.arch),
+        version_xml(pkg),
+        pkg.checksum[0], pkg.checksum[1],
+        escape(pkg.summary),
+        escape(pkg.description),
+        escape(pkg.packager),
+        escape(pkg.url),
+        pkg.file_time, pkg.build_time,
+        pkg.package_size, pkg.installed_size, pkg.archive_size,
+        quoteattr(pkg.location),
+        escape(pkg.license),
+        escape(pkg.vendor),
+        escape(pkg.group),
+        escape(pkg.buildhost),
+        escape(pkg.sourcerpm),
+        pkg.header_range[0], pkg.header_range[1],
+        deps_xml,
+        files_xml(
+            [
+                (path, file_type) for path, file_type in pkg.files
+                if PRIMARY_FILES_REG.match(path)
+            ],
+            indent=u'    ',
+        ),
+    )
+
+
+def package_tag(pkg):
+    return u'<package pkgid=%s name=%s arch=%s>\n  %s\n' % (
+        quoteattr(pkg.checksum[1]),
+        quoteattr(pkg.name),
+        quoteattr(pkg.arch),
+        version_xml(pkg),
+    )
+
+
+def filelists_xml(pkg):
+    """
+    Returns the xml entry for the given package in the filelists metadata
+    """
+    return u'%s%s</package>\n' % (
+        package_tag(pkg),
+        files_xml(pkg.files, indent=u'  '),
+    )
+
+
+def other_xml(pkg):
+    """
+    Returns the xml entry for the given package in the other metadata
+    """
+    return u'%s%s</package>\n' % (
+        package_tag(pkg),
+        u''.join(
+            u'  <changelog author=%s date="%d">%s</changelog>\n' % (
+                quoteattr(author), date, escape(text),
+            )
+            for author, date, text in pkg.changelogs
+        ),
+    )
+
+
+def get_package_info(pkg_path, repo_dir, checksums, pkg_index=None):
+    """
+    Returns the :class:`PackageInfo` of the given rpm, from the index if it
+    did not change since it was stored, reading it's header otherwise
+
+    :param pkg_path: Path to the rpm
+    :param repo_dir: Path to the repository the rpm is in
+    :param checksums: Dict with the already known checksums of the rpms
+    :param pkg_index: :class:`repoman.common.index.FileIndex` to get the info
+        from and store it into, if any
+    """
+    data = pkg_index.get(pkg_path) if pkg_index is not None else None
+    if data is not None:
+        return PackageInfo.from_data(data, pkg_path, repo_dir)
+    pkg = PackageInfo(pkg_path, repo_dir, checksum=checksums.get(pkg_path))
+    if pkg_index is not None:
+        pkg_index.set(pkg_path, pkg.to_data())
+    return pkg
+
+
+def write_repodata(repo_dir, pkg_paths, checksums=None, compression='gz',
+                   pkg_index=None):
+    """
+    Generates the metadata for the given repository, writing the new
+    metadata files first and replacing repomd.xml atomically at the end, so
+    the repository is always consistent for it's clients
+
+    :param repo_dir: Path to the repository
+    :param pkg_paths: Paths to the rpms in the repository
+    :param checksums: Dict with the already known checksums of the rpms, by
+        path, as (type, value) pairs. It will be updated with the ones
+        calculated.
+    :param compression: Compression to use for the metadata files, gz or zst
+    :param pkg_index: :class:`repoman.common.index.FileIndex` with the info
+        of the rpms from previous runs, by path, so only the headers of the
+        new or changed rpms are read. It will be updated with those.
+    """
+    if compression not in COMPRESSIONS:
+        raise Exception(
+            'Unsupported repodata compression %s, supported: %s'
+            % (compression, ', '.join(COMPRESSIONS))
+        )
+    if compression == 'zst' and zstandard is None:
+        raise Exception('The zstandard module is needed for zst repodata')
+    if checksums is None:
+        checksums = {}
+
+    start = time.time()
+    repodata_dir = os.path.join(repo_dir, 'repodata')
+    if not os.path.exists(repodata_dir):
+        os.makedirs(repodata_dir)
+    metadata_files = [
+        MetadataFile(repodata_dir, data_type, compression)
+        for data_type in ('primary', 'filelists', 'other')
+    ]
+    primary, filelists, other = metadata_files
+    num_pkgs = len(pkg_paths)
+    try:
+        primary.write(
+            u'<?xml version="1.0" encoding="UTF-8"?>\n'
+            u'<metadata xmlns="%s" xmlns:rpm="%s" packages="%d">\n'
+            % (COMMON_NS[1:-1], RPM_NS[1:-1], num_pkgs)
+        )
+        filelists.write(
+            u'<?xml version="1.0" encoding="UTF-8"?>\n'
+            u'<filelists xmlns="%s" packages="%d">\n'
+            % (FILELISTS_NS, num_pkgs)
+        )
+        other.write(
+            u'<?xml version="1.0" encoding="UTF-8"?>\n'
+            u'<otherdata xmlns="%s" packages="%d">\n'
+            % (OTHER_NS, num_pkgs)
+        )
+        for pkg_path in sorted(pkg_paths):
+            pkg = get_package_info(pkg_path, repo_dir, checksums, pkg_index)
+            checksums[pkg_path] = pkg.checksum
+            primary.write(primary_xml(pkg))
+            filelists.write(filelists_xml(pkg))
+            other.write(other_xml(pkg))
+        primary.write(u'</metadata>\n')
+        filelists.write(u'</filelists>\n')
+        other.write(u'</otherdata>\n')
+        for metadata_file in metadata_files:
+            metadata_file.close()
+    except BaseException:
+        for metadata_file in metadata_files:
+            metadata_file.abort()
+        raise
+
+    timestamp = int(time.time())
+    repomd = (
+        u'<?xml version="1.0" encoding="UTF-8"?>\n'
+        u'<repomd xmlns="%s" xmlns:rpm="%s">\n'
+        u'<revision>%d</revision>\n'
+        u'%s'
+        u'</repomd>\n'
+    ) % (
+        REPO_NS[1:-1],
+        RPM_NS[1:-1],
+        timestamp,
+        u''.join(
+            metadata_file.to_repomd(timestamp)
+            for metadata_file in metadata_files
+        ),
+    )
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=repodata_dir, prefix='.repomd-')
+    with os.fdopen(tmp_fd, 'wb') as repomd_fd:
+        repomd_fd.write(repomd.encode('utf-8'))
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, os.path.join(repodata_dir, 'repomd.xml'))
+
+    # remove the metadata files of the previous generation
+    keep_files = set(
+        os.path.basename(metadata_file.path)
+        for metadata_file in metadata_files
+    )
+    for fname in os.listdir(repodata_dir):
+        if fname not in keep_files and OLD_METADATA_REG.match(fname):
+            os.remove(os.path.join(repodata_dir, fname))
+    logger.info(
+        '  Wrote metadata for %d packages in %s in %.2fs',
+        num_pkgs, repo_dir, time.time() - start,
+    )
@@ -61,6 +61,16 @@ class ArtifactStore(object):
         """
         pass
 
+    def needs_download(self, artifact_str):
+        """
+        This method must return True if the store needs the given artifact
+        url to be downloaded before adding it, so it can be downloaded along
+        with the others, or False if it will handle the url itself
+
+        :param artifact_str: url to the artifact
+        """
+        return True
+
     @abstractmethod
     def add_artifact(self, artifact, **args):
         """
@@ -103,7 +113,7 @@ class ArtifactStore(object):
         :param num: number of newest versions to return
         :rtype: `repoman.common.artifact.Artifact`
         """
-        latest = self.get_latest(num=num)
+        latest = set(self.get_latest(num=num))
         logging.debug('Got latest: %s', latest)
         return [
             pkg
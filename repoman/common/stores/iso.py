@@ -8,10 +8,16 @@ This module holds the class and methods to manage an iso store::
         │   │   ├── $version
         │   │   |   ├── $iso1
         │   |   │   ├── $iso1.md5sum
-        │   │   |   └── $iso1.md5sum.sig
+        │   │   |   ├── $iso1.md5sum.sig
+        │   │   |   ├── $iso1.sha256sum
+        │   │   |   └── $iso1.sha256sum.sig
         │   │   └── ...
         │   └── ...
         └── ...
+
+The isos that were already signed are tracked in the
+.repoman/iso_signatures.json index, so only the new or changed ones are
+checksummed and signed again.
 """
 import os
 import re
@@ -19,10 +25,17 @@ import logging
 from six import iteritems
 from getpass import getpass
 from . import ArtifactStore
+from ..index import (
+    FileIndex,
+    get_index_path,
+)
 from ..utils import (
+    get_gpg_key,
+    has_valid_signature,
     save_file,
     list_files,
-    sign_detached,
+    log_copy_strategies,
+    sign_detached_files,
 )
 from ..artifact import (
     Artifact,
@@ -47,7 +60,18 @@ class WrongIsoError(Exception):
 
 
 class Iso(Artifact):
-    def __init__(self, path, temp_dir, verify_ssl=True):
+    def __init__(self, path, temp_dir, verify_ssl=True, digests_xattr=False):
+        """
+        :param path: Path or url to the iso
+        :param temp_dir: If url specified, will use that temporary dir to
+            store it
+        :param verify_ssl: If False, will not verify the ssl certificates
+            when downloading it
+        :param digests_xattr: If True, will cache the digests of the iso in
+            it's extended attributes, isos are big and this avoids reading
+            them again to get their checksums
+        """
+        self.digests_xattr = digests_xattr
         nv_match = re.match(ISO_REGEX, path)
         if not nv_match:
             raise WrongIsoError(
@@ -124,7 +148,43 @@ class Iso(Artifact):
     def sign(self, key, passwd):
         with open(self.path + '.md5sum', 'w') as md5_fd:
             md5_fd.write(self.md5)
-        sign_detached(self.path + '.md5sum', key=key, passphrase=passwd)
+        with open(self.path + '.sha256sum', 'w') as sha256_fd:
+            sha256_fd.write(
+                '%s  %s\n' % (self.sha256, os.path.basename(self.path))
+            )
+        # the checksum files were just rewritten, so they might have the
+        # same mtime as their old signatures
+        sign_detached_files(
+            [self.path + '.md5sum', self.path + '.sha256sum'],
+            key=key,
+            passphrase=passwd,
+            force=True,
+        )
+
+    def has_valid_signature(self, digests, gpg_key):
+        """
+        Checks if the checksum files of this iso have the given digests and a
+        valid signature made with the given key
+
+        :param digests: dict with the md5 and sha256 digests of the iso
+        :param gpg_key: :class:`GPGKey` the signatures should be made with
+        """
+        expected = (
+            ('.md5sum', digests.get('md5')),
+            ('.sha256sum', digests.get('sha256')),
+        )
+        for extension, digest in expected:
+            checksum_path = self.path + extension
+            try:
+                with open(checksum_path) as checksum_fd:
+                    content = checksum_fd.read().split()
+            except (IOError, OSError):
+                return False
+            if not digest or not content or content[0] != digest:
+                return False
+            if not has_valid_signature(checksum_path, gpg_key):
+                return False
+        return True
 
 
 class IsoStore(ArtifactStore):
@@ -149,6 +209,12 @@ class IsoStore(ArtifactStore):
 
     * signing_passphrase
         Passphrase for the above key
+
+    * digest_xattr_cache
+        If true, will cache the digests of the isos in their
+        user.repoman.digests extended attribute (if the filesystem supports
+        it), so the isos that did not change are not read again to get their
+        checksums
     """
 
     CONFIG_SECTION = 'IsoStore'
@@ -157,6 +223,7 @@ class IsoStore(ArtifactStore):
         'path_prefix': 'iso',
         'signing_key': '',
         'signing_passphrase': 'ask',
+        'digest_xattr_cache': 'false',
     }
 
     def __init__(self, config, repo_path=None):
@@ -175,6 +242,7 @@ class IsoStore(ArtifactStore):
         self.to_copy = []
         self.sign_key = config.get('signing_key')
         self.sign_passphrase = config.get('signing_passphrase')
+        self.digests_xattr = config.getboolean('digest_xattr_cache')
         if self.sign_key and self.sign_passphrase == 'ask':
             self.sign_passphrase = getpass('Key passphrase: ')
         if repo_path:
@@ -221,7 +289,8 @@ class IsoStore(ArtifactStore):
         iso = Iso(
             iso,
             temp_dir=self.config.get('temp_dir'),
-            verify_ssl=self.config.getboolean('verify_ssl')
+            verify_ssl=self.config.getboolean('verify_ssl'),
+            digests_xattr=self.digests_xattr,
         )
         if self.artifacts.add_pkg(iso, onlyifnewer):
             if to_copy:
@@ -243,6 +312,8 @@ class IsoStore(ArtifactStore):
         :param onlylatest: Only copy the latest version of the added isos.
         """
         logger.info('Saving new added isos into %s', self.path)
+        copy_strategies = self.config.getarray('copy_strategies')
+        used_strategies = []
         for iso in self.to_copy:
             if onlylatest and not self.is_latest_version(iso):
                 logger.info('Skipping %s a newer version is already '
@@ -251,8 +322,11 @@ class IsoStore(ArtifactStore):
             dst_path = os.path.join(self.path,
                                     self.path_prefix[0],
                                     iso.generate_path())
-            save_file(iso.path, dst_path)
+            used_strategies.append(save_file(
+                iso.path, dst_path, copy_strategies=copy_strategies,
+            ))
             iso.path = dst_path
+        log_copy_strategies(used_strategies)
         if self.sign_key:
             logger.info('')
             logger.info('Signing isos')
@@ -266,10 +340,8 @@ class IsoStore(ArtifactStore):
 
         :param iso: ISO instance of the package to compare
         """
-        verlist = self.artifacts.get(iso.full_name, {})
-        if not verlist or iso.version in verlist.get_latest():
-            return True
-        return False
+        verlist = self.artifacts.get(iso.name)
+        return not verlist or verlist.is_latest(iso.version)
 
     def delete_old(self, keep=1, noop=False):
         """
@@ -321,13 +393,38 @@ class IsoStore(ArtifactStore):
 
     def sign_isos(self):
         """
-        Sign all the isos in the repo.
+        Sign the isos in the repo that are new or changed since they were
+        signed the last time, keeping an index of the ones signed (by inode,
+        size and mtime) so the unchanged ones don't have to be read again
         """
         passphrase = self.sign_passphrase
-        for iso in self.get_artifacts():
+        gpg_key = get_gpg_key(self.sign_key)
+        index = FileIndex(get_index_path(self.path, 'iso_signatures'))
+        isos = self.get_artifacts()
+        signed = 0
+        for iso in isos:
+            entry = index.get(iso.path)
+            if (
+                entry is not None and
+                entry['key_id'] == gpg_key.keyid and
+                iso.has_valid_signature(entry, gpg_key)
+            ):
+                logger.debug('Skipping already signed %s', iso)
+                continue
             logger.info('Signing %s', iso)
             iso.sign(self.sign_key, passphrase)
-        logger.info("Done signing")
+            index.set(iso.path, {
+                'md5': iso.md5,
+                'sha256': iso.sha256,
+                'key_id': gpg_key.keyid,
+            })
+            signed += 1
+        index.prune(set(iso.path for iso in isos))
+        index.save()
+        logger.info(
+            "Done signing, signed %d isos, %d were already signed",
+            signed, len(isos) - signed,
+        )
 
     def change_path(self, new_path):
         """
@@ -1,11 +1,24 @@
+import base64
+import binascii
+import collections
+import errno
+import functools
 import glob
+import hashlib
+import json
 import logging
+import multiprocessing
+import multiprocessing.pool
 import os
 import pprint
+import re
 import shutil
 import string
+import struct
 import subprocess
 import sys
+import threading
+import time
 
 
 from functools import partial
@@ -14,7 +27,54 @@ import gnupg
 import requests
 import six
 
+from .index import INDEX_DIR
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows
+    fcntl = None
+
+try:
+    from functools import lru_cache
+except ImportError:
+    # python 2
+    lru_cache = None
+
 logger = logging.getLogger(__name__)
+# Maximum number of distinct version strings to keep the parsed sort keys for
+VERSION_KEY_CACHE_SIZE = 65536
+VERSION_SEGMENT_REG = re.compile(r'~|\^|[a-zA-Z]+|[0-9]+')
+# Version segments, with their sort rank first, tilde sorts before anything,
+# even the end of the version, and caret after the end but before anything
+# else, numeric segments are newer than alphabetic ones
+TILDE_SEGMENT = (0,)
+END_SEGMENT = (1,)
+CARET_SEGMENT = (2,)
+ALPHA_RANK = 3
+NUMERIC_RANK = 4
+# Maximum size of the arguments to pass to a single command when running it
+# over many files, well below the usual ARG_MAX
+MAX_ARGS_SIZE = 64 * 1024
+# Digests calculated for the artifacts, all in a single read of the file
+DIGEST_ALGORITHMS = ('md5', 'sha256', 'sha512')
+DIGEST_CHUNK_SIZE = 4 * 1024 * 1024
+# Extended attribute to cache the digests of the files in
+DIGESTS_XATTR = 'user.repoman.digests'
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# Seconds to wait before retrying a failed download, doubled on each try
+DOWNLOAD_BACKOFF = 2
+# ioctl to clone a file (reflink), from linux/fs.h
+FICLONE = 0x40049409
+# Errors that mean that a copy strategy is not supported for the given files,
+# so the next one should be tried
+COPY_FALLBACK_ERRNOS = set(
+    getattr(errno, name) for name in (
+        'EXDEV', 'EPERM', 'EMLINK', 'ENOTSUP', 'EOPNOTSUPP', 'EINVAL',
+        'ENOSYS', 'ENOTTY', 'EBADF', 'ETXTBSY',
+    )
+    if hasattr(errno, name)
+)
 
 
 class NotSamePackage(Exception):
@@ -49,8 +109,9 @@ def gpg_load_key(key_path, gpg=None):
 
 
 def gpg_get_keyuid(key_path, gpg=None):
+    if gpg is None:
+        return get_gpg_key(key_path).uid
     logger.debug('Looking the uid for %s', key_path)
-    gpg = gpg if gpg is not None else get_gpg()
     fprint = gpg_load_key(key_path=key_path, gpg=gpg)
     keyuid = None
     for key in gpg.list_keys(True):
@@ -67,8 +128,9 @@ def gpg_get_keyuid(key_path, gpg=None):
 
 
 def gpg_get_keyhex(key_path, gpg=None):
+    if gpg is None:
+        return get_gpg_key(key_path).keyid
     logger.debug('Looking the hex uid for %s', key_path)
-    gpg = gpg if gpg is not None else get_gpg()
     fprint = gpg_load_key(key_path=key_path, gpg=gpg)
     keyhex = None
     for key in gpg.list_keys(True):
@@ -87,6 +149,10 @@ def gpg_get_keyhex(key_path, gpg=None):
 
 
 def gpg_unlock(key_path, use_agent=True, passphrase=None, gpg=None):
+    if gpg is None and use_agent:
+        gpg_key = get_gpg_key(key_path, use_agent=True)
+        gpg_key.unlock(passphrase=passphrase)
+        return gpg_key.gpg
     logger.debug('Unlocking gpg key %s' % key_path)
     gpg = gpg if gpg is not None else get_gpg(
         homedir=None,
@@ -106,6 +172,221 @@ def gpg_unlock(key_path, use_agent=True, passphrase=None, gpg=None):
     return gpg
 
 
+class GPGKey(object):
+    """
+    A signing key loaded into gpg, with it's ids resolved, so the key file
+    does not have to be imported and looked up again each time something is
+    signed with it. Use :func:`get_gpg_key` to get the one shared by the
+    whole run.
+    """
+    def __init__(self, key_path, gpg=None, use_agent=False):
+        """
+        :param key_path: Path to the key file
+        :param gpg: gnupg handle to load the key into, a new one if not
+            passed
+        :param use_agent: If True, the new gnupg handle will use the gpg
+            agent and gpg's default homedir, as needed to unlock the key for
+            rpmsign (see :func:`gpg_unlock`), if False, it will use
+            ~/.gnupg without the agent, as :func:`get_gpg`
+        """
+        self.key_path = key_path
+        self.mtime = os.stat(key_path).st_mtime
+        if gpg is None:
+            if use_agent:
+                gpg = get_gpg(homedir=None, use_agent=True)
+            else:
+                gpg = get_gpg()
+        self.gpg = gpg
+        self.fingerprint = gpg_load_key(key_path=key_path, gpg=self.gpg)
+        self.keyid = None
+        self.uid = None
+        # look first into the secret keys
+        for secret in (True, False):
+            for key in self.gpg.list_keys(secret):
+                if key['fingerprint'] == self.fingerprint:
+                    self.keyid = key['keyid']
+                    self.uid = key['uids'][0]
+            if self.keyid:
+                break
+        if not self.keyid:
+            raise Exception('Failed to get the ids of key %s' % key_path)
+        self.unlocked = False
+        self.lock = threading.Lock()
+        logger.debug(
+            'Loaded key %s, id %s, uid %s', key_path, self.keyid, self.uid,
+        )
+
+    def unlock(self, passphrase=None):
+        """
+        Unlocks the key in the gpg agent, signing a dummy message, only the
+        first time it's called
+        """
+        with self.lock:
+            if self.unlocked:
+                return
+            logger.debug('Unlocking gpg key %s', self.key_path)
+            sign = partial(
+                self.gpg.sign,
+                message='Dummy_message',
+                keyid=self.uid,
+            )
+            if passphrase:
+                sign(passphrase=passphrase)
+            else:
+                sign()
+            self.unlocked = True
+            logger.debug('Unlocked gpg key %s', self.key_path)
+
+    def sign_file(self, fname, passphrase=None):
+        """
+        Creates the detached signature for the given file, as fname.sig
+        """
+        sign_file(
+            gpg=self.gpg,
+            fname=fname,
+            keyid=self.keyid,
+            passphrase=passphrase,
+        )
+
+    def verify_file(self, fname):
+        """
+        Checks with gpg that the detached signature of the given file,
+        fname.sig, is valid for its current content and was made with this
+        key
+        """
+        try:
+            with open(fname + '.sig', 'rb') as sig_fd:
+                verified = self.gpg.verify_file(sig_fd, data_filename=fname)
+        except (IOError, OSError):
+            return False
+        if not verified.valid:
+            logger.debug(
+                'Bad signature for %s: %s', fname, verified.status,
+            )
+            return False
+        return (
+            verified.key_id == self.keyid or
+            self.fingerprint in (
+                verified.fingerprint,
+                getattr(verified, 'pubkey_fingerprint', None),
+            )
+        )
+
+
+_GPG_KEYS = {}
+_GPG_KEYS_LOCK = threading.Lock()
+
+
+def get_gpg_key(key_path, use_agent=False):
+    """
+    Returns the :class:`GPGKey` for the given key file, loading it into gpg
+    only the first time it's requested in this process, or if the file
+    changed since
+
+    :param key_path: Path to the key file
+    :param use_agent: gpg settings to load it with, see :class:`GPGKey`,
+        there's a different instance for each
+    """
+    key_path = os.path.abspath(key_path)
+    mtime = os.stat(key_path).st_mtime
+    cache_key = (key_path, use_agent)
+    with _GPG_KEYS_LOCK:
+        gpg_key = _GPG_KEYS.get(cache_key)
+        if gpg_key is None or gpg_key.mtime != mtime:
+            gpg_key = GPGKey(key_path, use_agent=use_agent)
+            _GPG_KEYS[cache_key] = gpg_key
+    return gpg_key
+
+
+def _pgp_read_length(data, pos):
+    """
+    Reads a new format OpenPGP length field (packet or subpacket) at the given
+    position
+
+    Returns:
+        tuple(int, int): length read and position of the next byte
+    """
+    first = data[pos]
+    if first < 192:
+        return first, pos + 1
+    if first < 255:
+        return ((first - 192) << 8) + data[pos + 1] + 192, pos + 2
+    return struct.unpack('>I', bytes(data[pos + 1:pos + 5]))[0], pos + 5
+
+
+def _pgp_subpackets_key_id(data):
+    """
+    Looks for the issuer key id in the given OpenPGP signature subpackets
+    """
+    pos = 0
+    while pos < len(data):
+        length, pos = _pgp_read_length(data, pos)
+        subpacket_type = data[pos] & 0x7f
+        subpacket_data = data[pos + 1:pos + length]
+        pos += length
+        # issuer key id
+        if subpacket_type == 16 and len(subpacket_data) == 8:
+            return subpacket_data
+        # issuer fingerprint, the key id is the tail of it
+        if subpacket_type == 33 and len(subpacket_data) > 8:
+            return subpacket_data[-8:]
+    return None
+
+
+def pgp_signature_key_id(signature):
+    """
+    Extracts the id of the signing key from a binary OpenPGP signature packet,
+    like the ones stored in the rpm signature tags, without calling gpg.
+
+    Args:
+        signature (bytes): Raw signature packet
+
+    Returns:
+        str or None: The key id as an uppercase hex string, or None if it
+            could not be found
+    """
+    data = bytearray(signature)
+    if len(data) < 2 or not data[0] & 0x80:
+        return None
+
+    new_format = bool(data[0] & 0x40)
+    if new_format:
+        tag = data[0] & 0x3f
+        _, pos = _pgp_read_length(data, 1)
+    else:
+        tag = (data[0] >> 2) & 0x0f
+        pos = 1 + (1, 2, 4, 0)[data[0] & 0x03]
+    # not a signature packet
+    if tag != 2:
+        return None
+
+    key_id = None
+    try:
+        version = data[pos]
+        if version in (2, 3):
+            key_id = data[pos + 7:pos + 15]
+        elif version == 4:
+            hashed_len = (data[pos + 4] << 8) + data[pos + 5]
+            hashed_start = pos + 6
+            unhashed_start = hashed_start + hashed_len + 2
+            unhashed_len = (
+                (data[hashed_start + hashed_len] << 8)
+                + data[hashed_start + hashed_len + 1]
+            )
+            key_id = _pgp_subpackets_key_id(
+                data[unhashed_start:unhashed_start + unhashed_len]
+            ) or _pgp_subpackets_key_id(
+                data[hashed_start:hashed_start + hashed_len]
+            )
+    except (IndexError, struct.error):
+        logger.debug('Malformed signature packet')
+        return None
+
+    if not key_id or len(key_id) != 8:
+        return None
+    return binascii.hexlify(bytes(key_id)).decode('ascii').upper()
+
+
 def response2str(response):
     return (
         'URL: {url}\n'
@@ -151,7 +432,8 @@ def find_recursive(base_path, fmatch):
     """
     logger.debug('Recursively looking into %s', base_path)
     matched_files = []
-    for root, _, files in os.walk(base_path):
+    for root, dirs, files in os.walk(base_path):
+        dirs[:] = [dirname for dirname in dirs if dirname != INDEX_DIR]
         matched_files.extend([
             os.path.join(root, fname)
             for fname in files
@@ -171,6 +453,84 @@ def tryint(mayint):
         return mayint
 
 
+def memoize(maxsize):
+    """
+    Decorator to cache the results of a function with a single hashable
+    argument, keeping only the maxsize most recently used ones
+    """
+    if lru_cache is not None:
+        return lru_cache(maxsize=maxsize)
+
+    def decorator(func):
+        cache = collections.OrderedDict()
+
+        @functools.wraps(func)
+        def wrapper(arg):
+            try:
+                result = cache.pop(arg)
+            except KeyError:
+                result = func(arg)
+                if len(cache) >= maxsize:
+                    cache.popitem(last=False)
+            cache[arg] = result
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class VersionKey(tuple):
+    """
+    Sort key for a version (or release) string, that sorts them from older to
+    newer with the same ordering that rpm uses (rpmvercmp):
+
+    * The alphanumeric segments are compared one by one, the rest of the
+      characters are just separators
+    * Numeric segments are compared as numbers, and are newer than alphabetic
+      ones
+    * A version with extra segments is newer, unless the extra segment is a
+      tilde (~), that makes it older (1.0~rc1 < 1.0)
+    * A caret (^) makes it newer only than the version without it
+      (1.0 < 1.0^git1 < 1.0.1)
+    """
+    __slots__ = ()
+
+    def __new__(cls, version):
+        segments = []
+        for segment in VERSION_SEGMENT_REG.findall(version):
+            if segment == '~':
+                segments.append(TILDE_SEGMENT)
+            elif segment == '^':
+                segments.append(CARET_SEGMENT)
+            elif segment.isdigit():
+                segments.append((NUMERIC_RANK, int(segment)))
+            else:
+                segments.append((ALPHA_RANK, segment))
+        segments.append(END_SEGMENT)
+        return super(VersionKey, cls).__new__(cls, segments)
+
+
+@memoize(VERSION_KEY_CACHE_SIZE)
+def get_ver_key(ver):
+    """
+    Returns the sort key for the given version string, as a
+    :class:`VersionKey`, cached for the most used versions
+    """
+    return VersionKey(ver)
+
+
+@memoize(VERSION_KEY_CACHE_SIZE)
+def get_fullver_key(fullver):
+    """
+    Returns the sort key for the given version string, in the form
+    x.y.z-a.b.c, that sorts them from older to newer, the opposite of
+    :func:`cmpfullver`
+    """
+    ver, rel = split(fullver, '-', 1)
+    return (get_ver_key(ver), get_ver_key(rel))
+
+
 def cmpver(ver1, ver2):
     """
     Compares two version in a natural sort ordering fashion (what you usually
@@ -178,10 +538,8 @@ def cmpver(ver1, ver2):
     Thought for version strings in the form:
        x.y.z
     """
-    ver1 = '.' in ver1 and ver1.split('.') or (ver1,)
-    ver2 = '.' in ver2 and ver2.split('.') or (ver2,)
-    ver1 = [tryint(i) for i in ver1]
-    ver2 = [tryint(i) for i in ver2]
+    ver1 = get_ver_key(ver1)
+    ver2 = get_ver_key(ver2)
     if ver1 > ver2:
         return -1
     if ver1 == ver2:
@@ -195,12 +553,14 @@ def cmpfullver(fullver1, fullver2):
     Compares version strings in the form:
        x.y.z-a.b.c
     """
-    ver1, rel1 = split(fullver1, '-', 1)
-    ver2, rel2 = split(fullver2, '-', 1)
-    ver_res = cmpver(ver1, ver2)
-    if ver_res != 0:
-        return ver_res
-    return cmpver(rel1, rel2)
+    key1 = get_fullver_key(fullver1)
+    key2 = get_fullver_key(fullver2)
+    if key1 > key2:
+        return -1
+    if key1 == key2:
+        return 0
+    else:
+        return 1
 
 
 def print_busy(prev_pos=0):
@@ -236,73 +596,411 @@ def to_human_size(fsize):
     return '%dB' % fsize
 
 
-def download(path, dest_path, tries=3, verify=True):
+def from_human_size(size_str):
     """
-    Download a package from a url.
+    Parses a size in bytes, or with a K, M, G or T suffix (1024 multiples),
+    as returned by :func:`to_human_size`
+    """
+    size_str = size_str.strip().upper()
+    if size_str.endswith('B'):
+        size_str = size_str[:-1]
+    multiplier = 1
+    for exponent, suffix in enumerate('KMGT', 1):
+        if size_str.endswith(suffix):
+            multiplier = 1024 ** exponent
+            size_str = size_str[:-1]
+            break
+    return int(float(size_str) * multiplier)
+
+
+class DownloadError(Exception):
+    """
+    Failed download, if retriable it's worth trying again (for example, a
+    server error or a dropped connection)
+    """
+    def __init__(self, message, retriable=True):
+        super(DownloadError, self).__init__(message)
+        self.retriable = retriable
+
+
+class ProgressBar(object):
+    """
+    Shows the progress of a download in the terminal, as a bar if the total
+    size is known, or as a spinner if not
     """
-    headers = requests.head(path, verify=verify)
-    chunk_size = 4096
-    # length == 0 means that we don't know the size
-    length = int(headers.headers.get('content-length', 0)) or 0
-    logging.info('Downloading %s, length %s ...',
-                 path,
-                 length and to_human_size(length) or 'unknown')
     num_dots = 100
-    dot_frec = (length / num_dots) or 1
-    stream = requests.get(path, stream=True, verify=verify)
-    while not stream and tries:
-        stream = requests.get(path, stream=True, verify=verify)
-        tries -= 1
-    if not tries:
-        raise Exception(
-            'Failed to download %s\n\tcode: %d\n\treason: %s' %
-            (stream.url, stream.status_code, stream.reason)
-        )
-    prev_percent = 0
-    progress = 0
-    if length:
-        cur_percent = 0
-        sys.stdout.write(
-            '    %[' +
-            '-' * 23 + '25' + '-' * 24 +
-            '50' +
-            '-' * 23 + '75' + '-' * 24 +
-            ']\r' + '    %['
-        )
-    sys.stdout.flush()
-    with open(dest_path, 'wb') as rpm_fd:
-        for chunk in stream.iter_content(chunk_size=chunk_size):
-            if chunk:
-                rpm_fd.write(chunk)
-                progress += len(chunk)
-                cur_percent = int(progress / dot_frec)
-                if length and cur_percent > prev_percent:
-                    for _ in six.moves.xrange(cur_percent - prev_percent):
-                        sys.stdout.write('=')
-                    sys.stdout.flush()
-                    prev_percent = cur_percent
-                elif not length:
-                    prev_percent = print_busy(prev_percent)
-    if length:
-        if cur_percent < num_dots:
-            sys.stdout.write('=')
-        sys.stdout.write(']\n')
+
+    def __init__(self, length, done=0):
+        self.length = length
+        self.done = done
+        self.prev_pos = 0
+        self.dot_frec = (length / self.num_dots) or 1
+        if length:
+            sys.stdout.write(
+                '    %[' +
+                '-' * 23 + '25' + '-' * 24 +
+                '50' +
+                '-' * 23 + '75' + '-' * 24 +
+                ']\r' + '    %['
+            )
+            self.prev_pos = int(done / self.dot_frec)
+            sys.stdout.write('=' * self.prev_pos)
         sys.stdout.flush()
-    else:
+
+    def update(self, size):
+        self.done += size
+        if not self.length:
+            self.prev_pos = print_busy(self.prev_pos)
+            return
+        cur_pos = min(int(self.done / self.dot_frec), self.num_dots)
+        if cur_pos > self.prev_pos:
+            sys.stdout.write('=' * (cur_pos - self.prev_pos))
+            sys.stdout.flush()
+            self.prev_pos = cur_pos
+
+    def finish(self):
+        if self.length:
+            if self.prev_pos < self.num_dots:
+                sys.stdout.write('=')
+            sys.stdout.write(']\n')
         sys.stdout.flush()
-        logging.info('    Done')
 
 
-def copy(what, where):
-    """Try to link, try to copy if cross-device"""
+def load_part_meta(meta_path, url):
+    """
+    Loads the info about a partially downloaded file, needed to resume it,
+    if it was from the same url
+    """
+    try:
+        with open(meta_path) as meta_fd:
+            meta = json.load(meta_fd)
+    except (IOError, OSError, ValueError):
+        return {}
+    if meta.get('url') != url:
+        return {}
+    return meta
+
+
+def save_part_meta(meta_path, meta):
+    with open(meta_path, 'w') as meta_fd:
+        json.dump(meta, meta_fd)
+
+
+def download_part(session, url, part_path, meta_path, meta, verify=True,
+                  show_progress=True):
+    """
+    Downloads the given url into part_path, resuming it with a range
+    request if it's partially downloaded already and it did not change in
+    the server since (same ETag or Last-Modified).
+
+    :param meta: dict with the info of the partial download, it will be
+        updated with the info of the new one if it can't be resumed
+    :raises DownloadError: if the download failed or is incomplete
+    """
+    offset = 0
+    if meta and os.path.exists(part_path):
+        offset = os.path.getsize(part_path)
+    headers = {}
+    if offset:
+        headers['Range'] = 'bytes=%d-' % offset
+        validator = meta.get('etag') or meta.get('last_modified')
+        if validator:
+            headers['If-Range'] = validator
+
+    response = session.get(url, stream=True, verify=verify, headers=headers)
     try:
-        os.link(what, where)
-    except OSError as oerror:
-        if oerror.errno == 18:
-            shutil.copy2(what, where)
+        if response.status_code == 416:
+            if offset == meta.get('length'):
+                # already complete
+                return
+            meta.clear()
+            raise DownloadError('Failed to resume download of %s' % url)
+        if response.status_code not in (200, 206):
+            raise DownloadError(
+                'Failed to download %s\n\tcode: %d\n\treason: %s'
+                % (url, response.status_code, response.reason),
+                retriable=(
+                    response.status_code >= 500 or
+                    response.status_code in (408, 429)
+                ),
+            )
+        etag = response.headers.get('etag')
+        if response.status_code == 206 and offset:
+            if meta.get('etag') and etag and etag != meta['etag']:
+                meta.clear()
+                raise DownloadError('%s changed while downloading' % url)
+            mode = 'ab'
+            logging.info(
+                'Resuming download of %s from %s', url, to_human_size(offset),
+            )
         else:
-            logging.error('cannot copy %s on %s' % (what, where))
-            raise
+            offset = 0
+            mode = 'wb'
+            length = int(response.headers.get('content-length', 0)) or 0
+            meta.clear()
+            meta.update({
+                'url': url,
+                'etag': etag,
+                'last_modified': response.headers.get('last-modified'),
+                'length': length or None,
+            })
+            save_part_meta(meta_path, meta)
+            logging.info('Downloading %s, length %s ...',
+                         url,
+                         length and to_human_size(length) or 'unknown')
+
+        progress = None
+        if show_progress:
+            progress = ProgressBar(meta.get('length') or 0, done=offset)
+        with open(part_path, mode) as part_fd:
+            for chunk in response.iter_content(
+                chunk_size=DOWNLOAD_CHUNK_SIZE
+            ):
+                if chunk:
+                    part_fd.write(chunk)
+                    if progress:
+                        progress.update(len(chunk))
+        if progress:
+            progress.finish()
+    finally:
+        response.close()
+
+    size = os.path.getsize(part_path)
+    if meta.get('length') and size != meta['length']:
+        raise DownloadError(
+            'Incomplete download of %s, got %d of %d bytes'
+            % (url, size, meta['length'])
+        )
+
+
+def download(path, dest_path, tries=3, verify=True, session=None,
+             show_progress=True):
+    """
+    Download a package from a url.
+
+    It's downloaded first to dest_path.part, keeping the info needed to
+    resume it in dest_path.part.json, so if the transfer fails it's resumed
+    with range requests on the next tries (waiting more each time), or on
+    the next run if downloading it to the same path. It's moved to dest_path
+    only when complete, replacing it if it existed (the old file is not
+    modified, so any hardlinks to it keep the old content).
+
+    :param path: Url to download
+    :param dest_path: Path to save it to
+    :param tries: Number of times to retry the download if it fails
+    :param verify: If False, will not verify the ssl certificates
+    :param session: requests session to use, to reuse it's connections
+    :param show_progress: If False, will not show the progress bar (for
+        example, when downloading several files at the same time)
+    :returns: dict with the etag, last_modified and length the server
+        returned for the downloaded file
+    """
+    session = session if session is not None else requests
+    part_path = dest_path + '.part'
+    meta_path = part_path + '.json'
+    meta = load_part_meta(meta_path, path)
+    for attempt in range(tries + 1):
+        if attempt:
+            delay = DOWNLOAD_BACKOFF * 2 ** (attempt - 1)
+            logger.warn('Retrying the download of %s in %ds', path, delay)
+            time.sleep(delay)
+        try:
+            download_part(
+                session=session,
+                url=path,
+                part_path=part_path,
+                meta_path=meta_path,
+                meta=meta,
+                verify=verify,
+                show_progress=show_progress,
+            )
+            break
+        except DownloadError as exc:
+            if not exc.retriable:
+                raise
+            error = exc
+        except (requests.exceptions.RequestException, IOError) as exc:
+            error = exc
+        logger.warn('Download of %s failed: %s', path, error)
+    else:
+        raise Exception(
+            'Failed to download %s after %d tries: %s'
+            % (path, tries + 1, error)
+        )
+
+    # the part file is in the same dir, so this atomically replaces any
+    # existing file without touching it, as it might be hardlinked from
+    # somewhere else
+    os.rename(part_path, dest_path)
+    os.remove(meta_path)
+    logging.info('    Done %s', path)
+    return dict(
+        (key, meta.get(key)) for key in ('etag', 'last_modified', 'length')
+    )
+
+
+def download_range(path, start, end, verify=True):
+    """
+    Downloads the given byte range of an url, using an http Range request.
+
+    If the server does not support ranges, it will stream the whole content
+    but keep only the requested range, stopping as soon as it's read.
+
+    :param path: Url to download
+    :param start: First byte to get
+    :param end: Last byte to get (included)
+    :returns: the bytes downloaded, can be less than requested if the content
+        is shorter
+    """
+    response = requests.get(
+        path,
+        headers={'Range': 'bytes=%d-%d' % (start, end)},
+        stream=True,
+        verify=verify,
+    )
+    try:
+        if response.status_code == 206:
+            return response.content[:end - start + 1]
+        elif response.status_code != 200:
+            raise Exception(
+                'Failed to download range %d-%d of %s\n\tcode: %d\n\t'
+                'reason: %s'
+                % (start, end, path, response.status_code, response.reason)
+            )
+        logger.debug('No range support for %s, streaming it', path)
+        data = b''
+        for chunk in response.iter_content(chunk_size=65536):
+            data += chunk
+            if len(data) > end:
+                break
+        return data[start:end + 1]
+    finally:
+        response.close()
+
+
+def copy_link(what, where):
+    os.link(what, where)
+
+
+def copy_reflink(what, where):
+    """
+    Clones the file, sharing it's data blocks until any of the copies is
+    modified, only some filesystems (btrfs, xfs) support it
+    """
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, 'reflinks not supported')
+    with open(what, 'rb') as src_fd:
+        with open(where, 'wb') as dst_fd:
+            fcntl.ioctl(dst_fd.fileno(), FICLONE, src_fd.fileno())
+    shutil.copystat(what, where)
+
+
+def copy_range(what, where):
+    """
+    Copies the file inside the kernel, without passing the data through user
+    space buffers, the filesystem might even do a server side copy (nfs) or
+    clone the blocks
+    """
+    copy_func = getattr(os, 'copy_file_range', None)
+    if copy_func is None:
+        copy_func = getattr(os, 'sendfile', None)
+        if copy_func is None:
+            raise OSError(errno.ENOSYS, 'in-kernel copy not supported')
+        # sendfile takes the offset before the count
+        sendfile = copy_func
+
+        def copy_func(src, dst, count, offset_src, offset_dst):
+            return sendfile(dst, src, offset_src, count)
+
+    size = os.path.getsize(what)
+    with open(what, 'rb') as src_fd:
+        with open(where, 'wb') as dst_fd:
+            offset = 0
+            while offset < size:
+                copied = copy_func(
+                    src_fd.fileno(), dst_fd.fileno(), size - offset,
+                    offset, offset,
+                )
+                if not copied:
+                    break
+                offset += copied
+    if offset != size:
+        raise OSError(
+            errno.EIO, 'copied %d of %d bytes of %s' % (offset, size, what),
+        )
+    shutil.copystat(what, where)
+
+
+def copy_buffered(what, where):
+    shutil.copy2(what, where)
+
+
+COPY_STRATEGIES = collections.OrderedDict((
+    ('link', copy_link),
+    ('reflink', copy_reflink),
+    ('copy_range', copy_range),
+    ('copy', copy_buffered),
+))
+
+
+def copy(what, where, strategies=None):
+    """
+    Places a copy of a file in the given path, trying each of the given
+    strategies in order until one of them is supported for those paths. By
+    default, it hardlinks the file, or if that's not possible (for example,
+    if it's in another filesystem), clones it (reflink), or copies it inside
+    the kernel, or copies it through user space as the last resort
+
+    :param what: Path of the file to copy
+    :param where: Path to copy it to, should not exist
+    :param strategies: Names of the strategies to try, from
+        :data:`COPY_STRATEGIES`
+    :returns: the name of the strategy used
+    """
+    strategies = strategies or list(COPY_STRATEGIES)
+    for strategy in strategies:
+        if strategy not in COPY_STRATEGIES:
+            raise Exception(
+                'Unknown copy strategy %s, valid ones are %s'
+                % (strategy, ', '.join(COPY_STRATEGIES))
+            )
+
+    for idx, strategy in enumerate(strategies):
+        try:
+            COPY_STRATEGIES[strategy](what, where)
+            return strategy
+        except (IOError, OSError) as oerror:
+            is_last = idx == len(strategies) - 1
+            if is_last or oerror.errno not in COPY_FALLBACK_ERRNOS:
+                logging.error('cannot copy %s on %s' % (what, where))
+                raise
+            logger.debug(
+                'Could not %s %s to %s, trying next strategy: %s',
+                strategy, what, where, oerror,
+            )
+            if strategy != 'link' and os.path.exists(where):
+                os.remove(where)
+
+
+def get_existing_parent(path):
+    """
+    Returns the given path, or it's closest parent dir that exists
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def is_same_filesystem(path1, path2):
+    """
+    Checks if the given paths are (or would be, if they don't exist yet) in
+    the same filesystem, so files can be linked or renamed between them
+    """
+    return (
+        os.stat(get_existing_parent(path1)).st_dev ==
+        os.stat(get_existing_parent(path2)).st_dev
+    )
 
 
 def extract_sources(rpm_path, dst_dir, with_patches=False):
@@ -381,67 +1079,257 @@ def sign_file(gpg, fname, keyid, passphrase, detach=True):
         sfd.write(signature.data)
 
 
-def sign_detached(src_dir, key, passphrase=None):
+def dearmor(data):
+    """
+    Returns the binary data of the given ascii armored OpenPGP block, or the
+    data itself if it's not armored
+    """
+    if not data.startswith(b'-----BEGIN PGP'):
+        return data
+    body = []
+    in_body = False
+    for line in data.splitlines():
+        line = line.strip()
+        if not in_body:
+            # the armor headers end with an empty line
+            in_body = not line
+            continue
+        if line.startswith(b'=') or line.startswith(b'-----END'):
+            break
+        body.append(line)
+    return base64.b64decode(b''.join(body))
+
+
+def get_signature_key_id(sig_path):
+    """
+    Returns the id of the key the given detached signature file was made
+    with, or None if it can't be read
+    """
+    try:
+        with open(sig_path, 'rb') as sig_fd:
+            return pgp_signature_key_id(dearmor(sig_fd.read()))
+    except (IOError, OSError, ValueError, TypeError, binascii.Error):
+        return None
+
+
+def has_valid_signature(fname, gpg_key):
+    """
+    Checks if the given file already has a detached signature made with the
+    given key, that is newer than the file itself and that gpg verifies
+    against the current content of the file
+
+    :param fname: File to check the signature of, fname.sig
+    :param gpg_key: :class:`GPGKey` the signature should be made with
+    """
+    try:
+        sig_mtime = os.stat(fname + '.sig').st_mtime
+        file_mtime = os.stat(fname).st_mtime
+    except OSError:
+        return False
+    # cheap checks first, to not run gpg for the signatures that will be
+    # replaced anyhow
+    if sig_mtime < file_mtime:
+        return False
+    if get_signature_key_id(fname + '.sig') != gpg_key.keyid:
+        return False
+    return gpg_key.verify_file(fname)
+
+
+def list_files_to_sign(src_dir):
+    """
+    Returns the files to create detached signatures for, src_dir itself if
+    it's a file or the files under it (recursively) if it's a dir
+    """
+    if not os.path.isdir(src_dir):
+        return [src_dir]
+    return [
+        os.path.join(dname, fname)
+        for dname, _, files in os.walk(src_dir)
+        for fname in files
+        if not fname.endswith('.sig')
+    ]
+
+
+def sign_detached_files(fnames, key, passphrase=None, workers=1,
+                        force=False):
+    """
+    Create the detached signatures for the given files, running several gpg
+    processes at the same time, skipping the files that already have a valid
+    signature
+
+    :param fnames: Files to sign
+    :param key: Key to sign them with
+    :param passphrase: Passphrase for the given key
+    :param workers: Maximum number of files to sign at the same time
+    :param force: If True, sign also the files that have a valid signature
+    :returns: tuple with the number of files signed and skipped
+    """
+    gpg_key = get_gpg_key(key)
+    to_sign = [
+        fname for fname in fnames
+        if force or not has_valid_signature(fname, gpg_key)
+    ]
+
+    def sign_one(fname):
+        gpg_key.sign_file(fname=fname, passphrase=passphrase)
+
+    thread_map(sign_one, to_sign, workers=workers)
+    skipped = len(fnames) - len(to_sign)
+    logger.info(
+        'Signed %d files, skipped %d already signed', len(to_sign), skipped,
+    )
+    return len(to_sign), skipped
+
+
+def sign_detached(src_dir, key, passphrase=None, workers=1, force=False):
     """
     Create the detached signatures for the files in the specified dir.
 
     :param src_dir: File to sign or directory with files to sign (recursively)
     :param key: Key to sign the sources with
     :param passphrase: Passphrase for the given key
+    :param workers: Maximum number of files to sign at the same time
+    :param force: If True, sign also the files that have a valid signature
+    :returns: tuple with the number of files signed and skipped
     """
     oldpath = os.getcwd()
     if not src_dir.startswith('/'):
         src_dir = oldpath + '/' + src_dir
-    gpg = get_gpg()
-    with open(key) as key_fd:
-        skey = gpg.import_keys(key_fd.read())
-    fprint = skey.results[0]['fingerprint']
-    keyid = None
-    for user_key in gpg.list_keys(True):
-        if user_key['fingerprint'] == fprint:
-            keyid = user_key['keyid']
-    if os.path.isdir(src_dir):
-        for dname, _, files in os.walk(src_dir):
-            for fname in files:
-                if fname.endswith('.sig'):
-                    continue
-                sign_file(
-                    gpg=gpg,
-                    fname=os.path.join(dname, fname),
-                    keyid=keyid,
-                    passphrase=passphrase,
-                )
-    else:
-        fname = src_dir
-        sign_file(
-            gpg=gpg,
-            fname=fname,
-            keyid=keyid,
-            passphrase=passphrase,
+    return sign_detached_files(
+        list_files_to_sign(src_dir),
+        key=key,
+        passphrase=passphrase,
+        workers=workers,
+        force=force,
+    )
+
+
+def read_digests_xattr(path, stat, algorithms):
+    """
+    Returns the digests of the given file cached in it's extended attributes,
+    if they were calculated for the current size and mtime of the file and
+    include all the given algorithms, None otherwise
+    """
+    if not hasattr(os, 'getxattr'):
+        return None
+    try:
+        cached = json.loads(
+            os.getxattr(path, DIGESTS_XATTR).decode('utf-8')
         )
+    except (OSError, ValueError):
+        return None
+    if (
+        cached.get('size') != stat.st_size or
+        cached.get('mtime') != stat.st_mtime or
+        not all(algorithm in cached['digests'] for algorithm in algorithms)
+    ):
+        return None
+    return dict(
+        (algorithm, cached['digests'][algorithm]) for algorithm in algorithms
+    )
 
 
-def save_file(src_path, dst_path):
+def write_digests_xattr(path, stat, digests):
+    """
+    Caches the given digests of the file in it's extended attributes, if the
+    platform and the filesystem support them
+    """
+    if not hasattr(os, 'setxattr'):
+        return
+    cached = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'digests': digests,
+    }
+    try:
+        os.setxattr(
+            path, DIGESTS_XATTR, json.dumps(cached).encode('utf-8'),
+        )
+    except OSError as exc:
+        logger.debug('Unable to cache the digests of %s: %s', path, exc)
+
+
+def get_file_digests(path, algorithms=DIGEST_ALGORITHMS, use_xattr=False):
+    """
+    Calculates several digests of the given file reading it only once, in
+    chunks, so big files are never loaded whole in memory
+
+    :param path: Path to the file
+    :param algorithms: Names of the hashlib algorithms to calculate
+    :param use_xattr: If True, will reuse the digests cached in the file
+        extended attributes if it did not change, and cache them there
+    :returns: dict with the hex digest for each algorithm
+    """
+    stat = os.stat(path)
+    if use_xattr:
+        digests = read_digests_xattr(path, stat, algorithms)
+        if digests is not None:
+            logger.debug('Using the cached digests for %s', path)
+            return digests
+
+    hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+    with open(path, 'rb') as file_fd:
+        for chunk in iter(lambda: file_fd.read(DIGEST_CHUNK_SIZE), b''):
+            for digest in hashes:
+                digest.update(chunk)
+    digests = dict(
+        (algorithm, digest.hexdigest())
+        for algorithm, digest in zip(algorithms, hashes)
+    )
+
+    if use_xattr:
+        write_digests_xattr(path, stat, digests)
+    return digests
+
+
+def log_copy_strategies(used_strategies):
+    """
+    Logs how many files were saved with each copy strategy
+
+    :param used_strategies: list with the strategy used for each file, None
+        for the ones that were not saved
+    """
+    counts = collections.Counter(
+        strategy for strategy in used_strategies if strategy is not None
+    )
+    if counts:
+        logger.info('Saved %s', ', '.join(
+            '%d files with %s' % (counts[strategy], strategy)
+            for strategy in COPY_STRATEGIES if strategy in counts
+        ))
+
+
+def save_file(src_path, dst_path, copy_strategies=None):
     """
     Save a file to a specific new path if not there already. Will create the
     path tree if it does not exist already.
 
     :param src_path: Source path for the package
     :param dst_path: New path to save the package to
+    :param copy_strategies: Strategies to copy the file with, see
+        :func:`copy`
+    :returns: the name of the copy strategy used, or None if it was already
+        there
     """
     if os.path.exists(dst_path):
         logging.debug('Not saving %s, already exists', dst_path)
-        return
+        return None
     logging.info('Saving %s', dst_path)
     if not os.path.exists(dst_path.rsplit('/', 1)[0]):
         os.makedirs(dst_path.rsplit('/', 1)[0])
-    copy(src_path, dst_path)
+    strategy = copy(src_path, dst_path, strategies=copy_strategies)
+    logger.debug('Saved %s with %s', dst_path, strategy)
+    return strategy
 
 
 def list_files(path, extension, ignore_links=False):
-    '''Find all the files with the given extension under the given dir'''
+    '''
+    Find all the files with the given extension under the given dir, skipping
+    the repoman metadata dir (that might hold downloads in progress)
+    '''
     files_found = []
-    for root, _, files in os.walk(path):
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [dirname for dirname in dirs if dirname != INDEX_DIR]
         for fname in files:
             if fname.endswith(extension):
                 full_path = os.path.join(root, fname)
@@ -451,6 +1339,113 @@ def list_files(path, extension, ignore_links=False):
     return files_found
 
 
+def intern_str(value):
+    """
+    Interns the given string, so all the equal strings share the same object,
+    any other value is returned as is
+    """
+    if isinstance(value, str):
+        return six.moves.intern(value)
+    return value
+
+
+def get_workers(workers):
+    """
+    Returns the number of workers to use for the given configured value, 0 or
+    less meaning one per cpu
+    """
+    if workers > 0:
+        return workers
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def parallel_map(func, items, workers=1, chunksize=None):
+    """
+    Returns the list of results of calling func on each item, in the same
+    order, fanning out the calls to a pool of processes if more than one
+    worker is requested.
+
+    :param func: Function to call, must be picklable (module level)
+    :param items: List of items to pass to the function
+    :param workers: Maximum number of processes to use
+    :param chunksize: Number of items to send to a process each time, by
+        default it's calculated so each process gets a few chunks
+    """
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    logger.debug('Running %s on %d items with %d processes',
+                 func.__name__, len(items), workers)
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(
+            func,
+            items,
+            chunksize=chunksize or max(1, len(items) // (workers * 4)),
+        )
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+    return results
+
+
+def thread_map(func, items, workers=1):
+    """
+    Returns the list of results of calling func on each item, in the same
+    order, running the calls in a pool of threads if more than one worker is
+    requested. Useful when the work is done by external commands or is io
+    bound, and the items can't be pickled to send them to other processes.
+
+    :param func: Function to call
+    :param items: List of items to pass to the function
+    :param workers: Maximum number of threads to use
+    """
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    logger.debug('Running %s on %d items with %d threads',
+                 func.__name__, len(items), workers)
+    pool = multiprocessing.pool.ThreadPool(workers)
+    try:
+        return pool.map(func, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def chunk_args(args, max_size=MAX_ARGS_SIZE):
+    """
+    Splits the given command line arguments in chunks small enough to be
+    passed to a single command call
+
+    :param args: List of arguments (strings)
+    :param max_size: Maximum size of the arguments of each chunk, in bytes
+    :returns: iterator of lists of arguments
+    """
+    chunk = []
+    chunk_size = 0
+    for arg in args:
+        # the argument plus it's null terminator and pointer
+        arg_size = len(arg) + 9
+        if chunk and chunk_size + arg_size > max_size:
+            yield chunk
+            chunk = []
+            chunk_size = 0
+        chunk.append(arg)
+        chunk_size += arg_size
+    if chunk:
+        yield chunk
+
+
 def split(what, separator, num_results=None):
     if num_results is None:
         return what.split(separator)
@@ -0,0 +1,317 @@
+"""
+Small benchmarks for the hot paths of repoman, run them from the root of the
+source tree, for example::
+
+    python scripts/benchmark.py load --legacy path/to/some.rpm
+    python scripts/benchmark.py memory -n 100000
+    python scripts/benchmark.py versions -n 1000000
+    python scripts/benchmark.py copy path/to/some.iso /path/to/repo/fs
+"""
+import argparse
+import importlib
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from functools import cmp_to_key
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from repoman.common.config import Config  # noqa
+from repoman.common.stores.RPM import RPMStore  # noqa
+from repoman.common import utils  # noqa
+
+rpm_module = importlib.import_module('repoman.common.stores.RPM.RPM')
+
+
+def legacy_get_key_hex(path, hdr):
+    """
+    How the key id was extracted before, forking rpm -qip per package, the
+    regex is kept as it was, it never matched (it looks for a literal \\n),
+    so the key id was always None
+    """
+    with open(os.devnull, 'w') as devnull:
+        output = subprocess.Popen(
+            ["rpm", "-qip", path],
+            stdout=subprocess.PIPE,
+            stderr=devnull,
+        ).communicate()[0].decode('utf-8')
+    match = re.search(r"Key ID (?P<key_id>\w+)\\n", output)
+    if match:
+        return match.groupdict()['key_id'].upper()
+    return None
+
+
+def legacy_cmpver(ver1, ver2):
+    """How versions were compared before, parsing them on each comparison"""
+    ver1 = '.' in ver1 and ver1.split('.') or (ver1,)
+    ver2 = '.' in ver2 and ver2.split('.') or (ver2,)
+    ver1 = [utils.tryint(i) for i in ver1]
+    ver2 = [utils.tryint(i) for i in ver2]
+    if ver1 > ver2:
+        return -1
+    if ver1 == ver2:
+        return 0
+    else:
+        return 1
+
+
+def legacy_cmpfullver(fullver1, fullver2):
+    ver1, rel1 = utils.split(fullver1, '-', 1)
+    ver2, rel2 = utils.split(fullver2, '-', 1)
+    ver_res = legacy_cmpver(ver1, ver2)
+    if ver_res != 0:
+        return ver_res
+    return legacy_cmpver(rel1, rel2)
+
+
+def make_repo(rpm_path, num):
+    """
+    Creates a temporary repo with num copies (hardlinks) of the given rpm
+    """
+    repo_path = tempfile.mkdtemp(prefix='repoman-bench-')
+    pkgs_dir = os.path.join(repo_path, 'rpm', 'bench')
+    os.makedirs(pkgs_dir)
+    base_name = os.path.basename(rpm_path)
+    for idx in range(num):
+        os.link(rpm_path, os.path.join(pkgs_dir, '%d-%s' % (idx, base_name)))
+    return repo_path
+
+
+def timed(what, func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    print('%-45s %8.2fs' % (what, time.time() - start))
+    return result
+
+
+def load_store(config, repo_path, legacy=False):
+    orig_get_key_hex = rpm_module.get_key_hex
+    if legacy:
+        rpm_module.get_key_hex = legacy_get_key_hex
+    try:
+        return RPMStore(config=config, repo_path=repo_path)
+    finally:
+        rpm_module.get_key_hex = orig_get_key_hex
+
+
+def bench_load(args):
+    repo_path = make_repo(args.rpm, args.num)
+    try:
+        config = Config().get_section('store.RPMStore')
+        config.set('header_index', 'false')
+        if args.legacy:
+            timed(
+                'load %d rpms (rpm -qip key id)' % args.num,
+                load_store, config, repo_path, legacy=True,
+            )
+        timed('load %d rpms' % args.num, load_store, config, repo_path)
+    finally:
+        shutil.rmtree(repo_path)
+
+
+def get_peak_rss():
+    """Returns the peak resident memory of this process, in bytes"""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak_rss
+    return peak_rss * 1024
+
+
+def synthetic_metadata(num):
+    """
+    Generates the metadata for num rpms, as if they were loaded from the
+    header index, with ~20 versions for each name and a few distros and
+    arches, building new strings for each one as json would
+    """
+    for idx in range(num):
+        yield {
+            'name': 'package-%d' % (idx // 20),
+            'version': '%d.%d.%d' % (idx % 5, idx % 4, idx % 20),
+            'release': '1.%s' % ('fc28', 'el7', 'el8')[idx % 3],
+            'arch': '%s' % ('x86_64', 'noarch', 'ppc64le')[idx % 3],
+            'is_source': False,
+            'sourcerpm': 'package-%d-src.rpm' % (idx // 20),
+            'signed': True,
+            'key_hex': '%s' % 'BEDC9C4BE614E4BA',
+            'inode': idx,
+            'checksum': ['sha256', '%064x' % idx],
+        }
+
+
+def bench_memory(args):
+    if args.no_intern:
+        rpm_module.intern_str = lambda value: value
+    rpms = rpm_module.RPMList()
+    base_rss = get_peak_rss()
+    start = time.time()
+    for metadata in synthetic_metadata(args.num):
+        rpms.add_pkg(rpm_module.RPM(
+            '/repo/rpm/%d.rpm' % metadata['inode'],
+            metadata=metadata,
+        ))
+    peak_rss = get_peak_rss()
+    print('%-45s %8.2fs' % ('load %d rpms' % args.num, time.time() - start))
+    print('%-45s %8.2fMB' % ('peak rss', peak_rss / 1024.0 / 1024))
+    print('%-45s %8dB' % (
+        'per rpm', (peak_rss - base_rss) / max(args.num, 1),
+    ))
+
+
+def synthetic_versions(num, distinct):
+    """
+    Generates num version-release strings, picked randomly from distinct
+    different ones, all with the same structure so the legacy comparison
+    does not have to compare numbers with strings
+    """
+    rand = random.Random(42)
+    choices = [
+        '%d.%d.%d-%d.%s' % (
+            rand.randint(0, 9),
+            rand.randint(0, 30),
+            rand.randint(0, 300),
+            rand.randint(0, 20),
+            rand.choice(('el7', 'el8', 'fc28', 'fc29')),
+        )
+        for _ in range(distinct)
+    ]
+    return [rand.choice(choices) for _ in range(num)]
+
+
+def bench_versions(args):
+    versions = synthetic_versions(args.num, args.distinct)
+    what = 'sort %d versions' % args.num
+    if args.legacy:
+        timed(
+            what + ' (legacy cmpfullver)',
+            sorted, versions, key=cmp_to_key(legacy_cmpfullver),
+        )
+    timed(
+        what + ' (cmpfullver)',
+        sorted, versions, key=cmp_to_key(utils.cmpfullver),
+    )
+    timed(
+        what + ' (VersionKey, no cache)',
+        sorted, versions,
+        key=lambda fullver: tuple(
+            utils.VersionKey(part)
+            for part in utils.split(fullver, '-', 1)
+        ),
+    )
+    if hasattr(utils.get_fullver_key, 'cache_clear'):
+        utils.get_fullver_key.cache_clear()
+        utils.get_ver_key.cache_clear()
+    timed(
+        what + ' (cached keys, cold)',
+        sorted, versions, key=utils.get_fullver_key,
+    )
+    timed(
+        what + ' (cached keys, warm)',
+        sorted, versions, key=utils.get_fullver_key,
+    )
+
+
+def bench_copy(args):
+    """
+    Times placing the given file in the given dir with each copy strategy,
+    dropping the copy before the next one
+    """
+    size = os.path.getsize(args.file)
+    dst_path = os.path.join(
+        args.dst_dir, '.repoman-bench-' + os.path.basename(args.file),
+    )
+    for strategy in args.strategies.split(','):
+        for _ in range(args.repeat):
+            if os.path.exists(dst_path):
+                os.remove(dst_path)
+            start = time.time()
+            try:
+                utils.copy(args.file, dst_path, strategies=[strategy])
+            except (IOError, OSError) as exc:
+                print('%-45s %s' % (strategy, exc))
+                break
+            elapsed = time.time() - start
+            print('%-45s %8.2fs %10.2fMB/s' % (
+                strategy, elapsed, size / 1024.0 / 1024 / max(elapsed, 1e-6),
+            ))
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+
+    load_parser = subparsers.add_parser(
+        'load', help='Time loading an rpm store',
+    )
+    load_parser.add_argument('rpm', help='Rpm to fill the store with')
+    load_parser.add_argument(
+        '-n', '--num', type=int, default=10000,
+        help='Number of packages in the store',
+    )
+    load_parser.add_argument(
+        '--legacy', action='store_true',
+        help='Also time it extracting the key id with rpm -qip, as before',
+    )
+    load_parser.set_defaults(func=bench_load)
+
+    memory_parser = subparsers.add_parser(
+        'memory', help='Peak memory when loading a synthetic rpm repo',
+    )
+    memory_parser.add_argument(
+        '-n', '--num', type=int, default=100000,
+        help='Number of packages in the repo',
+    )
+    memory_parser.add_argument(
+        '--no-intern', action='store_true',
+        help='Do not intern the repeated strings, to compare',
+    )
+    memory_parser.set_defaults(func=bench_memory)
+
+    versions_parser = subparsers.add_parser(
+        'versions', help='Time sorting version strings',
+    )
+    versions_parser.add_argument(
+        '-n', '--num', type=int, default=1000000,
+        help='Number of versions to sort',
+    )
+    versions_parser.add_argument(
+        '-d', '--distinct', type=int, default=50000,
+        help='Number of distinct versions among them',
+    )
+    versions_parser.add_argument(
+        '--legacy', action='store_true',
+        help='Also time it with the previous comparison function',
+    )
+    versions_parser.set_defaults(func=bench_versions)
+
+    copy_parser = subparsers.add_parser(
+        'copy', help='Time placing a (big) file with each copy strategy',
+    )
+    copy_parser.add_argument('file', help='File to copy, like an iso')
+    copy_parser.add_argument(
+        'dst_dir', help='Dir to copy it to, in the filesystem of the repo',
+    )
+    copy_parser.add_argument(
+        '-s', '--strategies', default=','.join(utils.COPY_STRATEGIES),
+        help='Comma separated list of strategies to time',
+    )
+    copy_parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='Times to copy it with each strategy',
+    )
+    copy_parser.set_defaults(func=bench_copy)
+
+    args = parser.parse_args(args)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,102 @@
+from repoman.common.config import Config
+from repoman.common.sources import url
+
+
+class RPMStoreMock(object):
+    def handles_artifact(self, artifact):
+        return artifact.endswith('.rpm')
+
+
+class ResponseMock(object):
+    def __init__(self, data, status_code=None, headers=None):
+        self.ok = data is not None
+        self.status_code = status_code or (200 if self.ok else 404)
+        self.reason = 'OK' if self.ok else 'Not Found'
+        self.headers = headers or {}
+        self.encoding = 'utf-8'
+        self.data = (data or '').encode('utf-8')
+
+    def iter_content(self, chunk_size):
+        # small chunks, to split the tags
+        for idx in range(0, len(self.data), 7):
+            yield self.data[idx:idx + 7]
+
+    def close(self):
+        pass
+
+
+class SessionMock(object):
+    def __init__(self, pages, etag=None):
+        self.pages = pages
+        self.etag = etag
+        self.fetched = []
+        self.not_modified = []
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def get(self, page_url, stream, headers):
+        self.fetched.append(page_url)
+        if self.etag and headers.get('If-None-Match') == self.etag:
+            self.not_modified.append(page_url)
+            return ResponseMock('', status_code=304)
+        return ResponseMock(self.pages.get(page_url), headers={
+            'etag': self.etag,
+        })
+
+
+def make_page(*links):
+    return '<html><body>\n%s\n</body></html>' % '\n'.join(
+        '<a href="%s">%s</a>' % (link, link) for link in links
+    )
+
+
+def test_expand_recursive_fetches_each_page_once(monkeypatch):
+    base = 'http://mirror/repo/'
+    session = SessionMock({
+        base: make_page('../', 'el7/', 'el8/', 'http://other/x/', 'a.rpm'),
+        base + 'el7/': make_page(
+            '../', '/repo/', '/repo/el8/', 'x86_64/', 'b.rpm',
+        ),
+        base + 'el8/': make_page('../', base + 'el7/', 'c.rpm'),
+        base + 'el7/x86_64/': make_page('../', 'deep/', 'd.rpm'),
+    })
+    monkeypatch.setattr(url.requests, 'Session', lambda: session)
+    config = Config().get_section('source.URLSource')
+    config.set('max_depth', '2')
+    config.set('page_cache', '')
+    source = url.URLSource(config=config, stores=[RPMStoreMock()])
+
+    filters, pkgs = source.expand('rec:' + base)
+
+    assert sorted(pkgs) == [
+        base + 'a.rpm',
+        base + 'el7/b.rpm',
+        base + 'el7/x86_64/d.rpm',
+        base + 'el8/c.rpm',
+    ]
+    assert sorted(session.fetched) == sorted([
+        base, base + 'el7/', base + 'el8/', base + 'el7/x86_64/',
+    ])
+
+
+def test_page_cache_reuses_the_unchanged_pages(tmpdir, monkeypatch):
+    base = 'http://mirror/repo/'
+    session = SessionMock(
+        {base: make_page('el7/'), base + 'el7/': make_page('a.rpm')},
+        etag='"v1"',
+    )
+    monkeypatch.setattr(url.requests, 'Session', lambda: session)
+    config = Config().get_section('source.URLSource')
+    config.set('page_cache', str(tmpdir.join('pages.json')))
+    config.set('page_cache_ttl', '0')
+    source = url.URLSource(config=config, stores=[RPMStoreMock()])
+
+    _, first_pkgs = source.expand('rec:' + base)
+    source.get_page_cache().save()
+    session.pages = {}
+    _, second_pkgs = source.expand('rec:' + base)
+
+    assert sorted(first_pkgs) == sorted(second_pkgs) == [base + 'el7/a.rpm']
+    assert sorted(session.not_modified) == [base, base + 'el7/']
+    assert tmpdir.join('pages.json').check()
@@ -0,0 +1,188 @@
+import threading
+import time
+
+from repoman.common import download
+
+
+def test_keeps_the_file_names_of_the_urls():
+    assert download.Downloader.get_dest_paths(
+        [
+            'http://host1/pkg-1.0.rpm',
+            'http://host2/pkg-1.0.rpm',
+            'http://host1/other.iso',
+        ],
+        '/tmp/dest',
+    ) == [
+        ('http://host1/pkg-1.0.rpm', '/tmp/dest/pkg-1.0.rpm'),
+        ('http://host2/pkg-1.0.rpm', '/tmp/dest/1/pkg-1.0.rpm'),
+        ('http://host1/other.iso', '/tmp/dest/other.iso'),
+    ]
+
+
+def test_downloads_concurrently_with_a_host_limit(tmpdir, monkeypatch):
+    running = {}
+    max_running = {}
+    lock = threading.Lock()
+    downloaded = []
+
+    def fake_download(url, dest_path, verify, session, show_progress):
+        host = url.split('/')[2]
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            max_running[host] = max(max_running.get(host, 0), running[host])
+        time.sleep(0.02)
+        with lock:
+            running[host] -= 1
+            downloaded.append(url)
+        assert not show_progress
+
+    monkeypatch.setattr(download, 'download', fake_download)
+    urls = [
+        'http://host%d/pkg%d.rpm' % (idx % 2, idx) for idx in range(12)
+    ]
+    downloader = download.Downloader(workers=6, host_limit=2)
+
+    local_paths = downloader.download_all(urls + urls[:3], str(tmpdir))
+
+    assert sorted(downloaded) == sorted(urls)
+    assert local_paths[urls[0]] == str(tmpdir.join('pkg0.rpm'))
+    assert max(max_running.values()) <= 2
+
+
+class FakeConditionalResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+class FakeConditionalSession(object):
+    """Answers the conditional requests, the downloads are faked apart"""
+    def __init__(self, etags):
+        self.etags = etags
+        self.requests = []
+
+    def get(self, url, stream, verify, headers):
+        self.requests.append(url)
+        if headers.get('If-None-Match') == self.etags[url]:
+            return FakeConditionalResponse(304)
+        return FakeConditionalResponse(200)
+
+
+def make_fake_download(contents, downloaded, etags, delay=0):
+    def fake_download(url, dest_path, verify, session, show_progress):
+        downloaded.append(url)
+        # write it in pieces, so concurrent downloads would interleave
+        with open(dest_path, 'w') as dest_fd:
+            for char in contents[url]:
+                dest_fd.write(char)
+                dest_fd.flush()
+                time.sleep(delay)
+        return {'etag': etags[url], 'last_modified': None, 'length': None}
+    return fake_download
+
+
+def test_cache_reuses_unchanged_downloads(tmpdir, monkeypatch):
+    contents = {'http://host/a.rpm': 'a' * 10, 'http://host/b.rpm': 'a' * 10}
+    etags = dict((url, '"v1"') for url in contents)
+    session = FakeConditionalSession(etags)
+    downloaded = []
+    monkeypatch.setattr(
+        download, 'download', make_fake_download(contents, downloaded, etags),
+    )
+    cache = download.DownloadCache(str(tmpdir.join('cache')), max_size=100)
+
+    for url in contents:
+        cache.fetch(url, str(tmpdir.join(url[-5:])), session=session)
+    cache.close()
+    # the first downloads are not checked, they were not in the cache
+    assert session.requests == []
+    reloaded = download.DownloadCache(str(tmpdir.join('cache')), 100)
+    reloaded.fetch(
+        'http://host/a.rpm', str(tmpdir.join('again.rpm')), session=session,
+    )
+    etags['http://host/a.rpm'] = '"v2"'
+    reloaded.fetch(
+        'http://host/a.rpm', str(tmpdir.join('new.rpm')), session=session,
+    )
+
+    assert downloaded == [
+        'http://host/a.rpm', 'http://host/b.rpm', 'http://host/a.rpm',
+    ]
+    assert tmpdir.join('again.rpm').read() == 'a' * 10
+    # modifying the fetched files must not change the cached ones
+    tmpdir.join('again.rpm').write('signed', mode='a')
+    assert reloaded.lookup('http://host/b.rpm') is not None
+    assert tmpdir.join('a.rpm').stat().nlink == 1
+    assert tmpdir.join('again.rpm').stat().nlink == 1
+    assert len(tmpdir.join('cache', 'objects').listdir()) == 1
+    assert tmpdir.join('cache', 'partial').listdir() == []
+
+
+def test_cache_evicts_the_least_recently_used(tmpdir, monkeypatch):
+    contents = dict(
+        ('http://host/%d.rpm' % idx, str(idx) * 10) for idx in range(3)
+    )
+    etags = dict((url, '"v1"') for url in contents)
+    session = FakeConditionalSession(etags)
+    monkeypatch.setattr(
+        download, 'download', make_fake_download(contents, [], etags),
+    )
+    cache = download.DownloadCache(str(tmpdir.join('cache')), max_size=20)
+
+    for url in sorted(contents):
+        cache.fetch(url, str(tmpdir.join(url[-5:])), session=session)
+    cache.close()
+
+    assert sorted(cache.entries) == ['http://host/1.rpm', 'http://host/2.rpm']
+    objects = [
+        path for path in tmpdir.join('cache', 'objects').visit()
+        if path.check(file=True)
+    ]
+    assert len(objects) == 2
+
+
+def test_cache_shared_by_concurrent_fetchers(tmpdir, monkeypatch):
+    url = 'http://host/a.rpm'
+    contents = {url: 'abcdefghij' * 3}
+    etags = {url: '"v1"'}
+    downloaded = []
+    monkeypatch.setattr(
+        download,
+        'download',
+        make_fake_download(contents, downloaded, etags, delay=0.005),
+    )
+    # separate instances, as separate processes would have
+    caches = [
+        download.DownloadCache(str(tmpdir.join('cache')), max_size=100)
+        for _ in range(2)
+    ]
+    other_url = 'http://host/other.rpm'
+    contents[other_url] = 'other'
+    etags[other_url] = '"v1"'
+    caches[1].fetch(
+        other_url, str(tmpdir.join('other.rpm')),
+        session=FakeConditionalSession(etags),
+    )
+
+    def fetch(idx):
+        caches[idx].fetch(
+            url, str(tmpdir.join('%d.rpm' % idx)),
+            session=FakeConditionalSession(etags),
+        )
+        caches[idx].close()
+
+    threads = [
+        threading.Thread(target=fetch, args=(idx,)) for idx in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert downloaded == [other_url, url]
+    assert tmpdir.join('0.rpm').read() == contents[url]
+    assert tmpdir.join('1.rpm').read() == contents[url]
+    reloaded = download.DownloadCache(str(tmpdir.join('cache')), 100)
+    assert sorted(reloaded.entries) == [url, other_url]
@@ -0,0 +1,57 @@
+import os
+
+from repoman.common import index
+
+
+def test_reuses_data_for_unchanged_files(tmpdir):
+    art = tmpdir.join('art1.rpm')
+    art.write('content')
+    index_path = index.get_index_path(str(tmpdir), 'test')
+
+    file_index = index.FileIndex(index_path)
+    file_index.set(str(art), {'name': 'art1'})
+    file_index.save()
+
+    assert index.FileIndex(index_path).get(str(art)) == {'name': 'art1'}
+
+
+def test_ignores_data_for_changed_files(tmpdir):
+    art = tmpdir.join('art1.rpm')
+    art.write('content')
+    index_path = index.get_index_path(str(tmpdir), 'test')
+
+    file_index = index.FileIndex(index_path)
+    file_index.set(str(art), {'name': 'art1'})
+    file_index.save()
+    art.write('other content')
+
+    assert index.FileIndex(index_path).get(str(art)) is None
+
+
+def test_prunes_only_missing_files(tmpdir):
+    art1 = tmpdir.join('art1.rpm')
+    art1.write('content')
+    art2 = tmpdir.join('art2.rpm')
+    art2.write('content')
+    index_path = index.get_index_path(str(tmpdir), 'test')
+
+    file_index = index.FileIndex(index_path)
+    file_index.set(str(art1), {'name': 'art1'})
+    file_index.set(str(art2), {'name': 'art2'})
+    file_index.save()
+    art2.remove()
+
+    file_index = index.FileIndex(index_path)
+    file_index.prune(keep_paths=set())
+    file_index.save()
+
+    assert list(index.FileIndex(index_path).entries) == [str(art1)]
+
+
+def test_ignores_corrupted_index(tmpdir):
+    index_path = index.get_index_path(str(tmpdir), 'test')
+    os.makedirs(os.path.dirname(index_path))
+    with open(index_path, 'w') as index_fd:
+        index_fd.write('{not json')
+
+    assert index.FileIndex(index_path).entries == {}
@@ -0,0 +1,145 @@
+import pytest
+
+from repoman.common import artifact as artifact_module
+from repoman.common.config import Config
+from repoman.common.stores import iso as iso_module
+
+
+class FakeGPGKey(object):
+    def __init__(self, keyid):
+        self.keyid = keyid
+
+
+@pytest.fixture
+def signing(monkeypatch):
+    """
+    Fakes the signing, the signature of a file being the id of the key it
+    was signed with
+    """
+    state = {'key': FakeGPGKey('KEY'), 'signed': []}
+
+    def sign_detached_files(fnames, key, passphrase=None, workers=1,
+                            force=False):
+        for fname in fnames:
+            state['signed'].append(fname)
+            with open(fname + '.sig', 'w') as sig_fd:
+                sig_fd.write(state['key'].keyid)
+        return len(fnames), 0
+
+    def has_valid_signature(fname, gpg_key):
+        try:
+            with open(fname + '.sig') as sig_fd:
+                return sig_fd.read() == gpg_key.keyid
+        except IOError:
+            return False
+
+    monkeypatch.setattr(iso_module, 'get_gpg_key', lambda key: state['key'])
+    monkeypatch.setattr(
+        iso_module, 'sign_detached_files', sign_detached_files,
+    )
+    monkeypatch.setattr(
+        iso_module, 'has_valid_signature', has_valid_signature,
+    )
+    return state
+
+
+def make_store(repo_path):
+    config = Config().get_section('store.IsoStore')
+    config.set('signing_key', '/path/to/key.asc')
+    config.set('signing_passphrase', 'pass')
+    return iso_module.IsoStore(config=config, repo_path=repo_path)
+
+
+def make_isos(repo_path):
+    isos = []
+    for name in ('first-1.0.iso', 'second-2.0.iso'):
+        iso_path = repo_path.join('iso', name.split('-')[0], name)
+        iso_path.write(name, ensure=True)
+        isos.append(str(iso_path))
+    return isos
+
+
+def test_signs_only_the_new_isos(tmpdir, signing):
+    first, second = make_isos(tmpdir)
+
+    make_store(str(tmpdir)).sign_isos()
+
+    assert sorted(signing['signed']) == sorted([
+        first + '.md5sum', first + '.sha256sum',
+        second + '.md5sum', second + '.sha256sum',
+    ])
+    assert tmpdir.join('.repoman', 'iso_signatures.json').check()
+
+    # a new store loads the index from disk
+    signing['signed'] = []
+    make_store(str(tmpdir)).sign_isos()
+
+    assert signing['signed'] == []
+
+
+def test_signs_again_the_changed_isos(tmpdir, signing):
+    first, second = make_isos(tmpdir)
+    make_store(str(tmpdir)).sign_isos()
+    signing['signed'] = []
+    tmpdir.join('iso', 'second', 'second-2.0.iso').write('rebuilt iso')
+
+    make_store(str(tmpdir)).sign_isos()
+
+    assert sorted(signing['signed']) == [
+        second + '.md5sum', second + '.sha256sum',
+    ]
+    assert tmpdir.join('iso', 'second', 'second-2.0.iso.sha256sum').read(
+    ).split()[0] == iso_module.Iso(second, temp_dir=str(tmpdir)).sha256
+
+
+def test_signs_again_with_a_new_key(tmpdir, signing):
+    make_isos(tmpdir)
+    make_store(str(tmpdir)).sign_isos()
+    signing['signed'] = []
+    signing['key'] = FakeGPGKey('NEWKEY')
+
+    make_store(str(tmpdir)).sign_isos()
+
+    assert len(signing['signed']) == 4
+
+
+def test_is_latest_version_compares_the_isos_with_the_same_name(tmpdir):
+    for name in ('first-1.0.iso', 'first-2.0.iso', 'second-3.0.iso'):
+        tmpdir.join('iso', 'first', name).write(name, ensure=True)
+    store = make_store(str(tmpdir))
+
+    def make_iso(name):
+        return iso_module.Iso(
+            str(tmpdir.join('iso', 'first', name)), temp_dir=str(tmpdir),
+        )
+
+    assert store.is_latest_version(make_iso('first-2.0.iso'))
+    assert not store.is_latest_version(make_iso('first-1.0.iso'))
+    # no other versions of it in the repo
+    tmpdir.join('iso', 'first', 'third-1.0.iso').write('third')
+    assert store.is_latest_version(make_iso('third-1.0.iso'))
+
+
+@pytest.mark.parametrize('option,expected', [
+    (None, False),
+    ('true', True),
+])
+def test_digests_xattr_cache_is_optional(tmpdir, monkeypatch, option,
+                                         expected):
+    xattr_uses = []
+
+    def get_file_digests(path, use_xattr=False):
+        xattr_uses.append(use_xattr)
+        return {'md5': 'md5', 'sha256': 'sha256', 'sha512': 'sha512'}
+
+    monkeypatch.setattr(artifact_module, 'get_file_digests', get_file_digests)
+    make_isos(tmpdir)
+    config = Config().get_section('store.IsoStore')
+    if option is not None:
+        config.set('digest_xattr_cache', option)
+    store = iso_module.IsoStore(config=config, repo_path=str(tmpdir))
+
+    for iso in store.get_artifacts():
+        assert iso.sha256 == 'sha256'
+
+    assert xattr_uses == [expected, expected]
@@ -0,0 +1,105 @@
+import gzip
+import os
+
+from repoman.common.stores.RPM import repodata
+
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo"
+        xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+  <revision>1</revision>
+  <data type="primary">
+    <location href="repodata/abcd-primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+PRIMARY_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common"
+          xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">
+"""
+PRIMARY_PACKAGE = """
+<package type="rpm">
+  <name>{name}</name>
+  <arch>{arch}</arch>
+  <version epoch="0" ver="1.0" rel="1.fc21"/>
+  <checksum type="sha256" pkgid="YES">1234</checksum>
+  <time file="{mtime}" build="1"/>
+  <size package="{size}" installed="1" archive="1"/>
+  <location href="{href}"/>
+  <format>
+    <rpm:sourcerpm>{name}-1.0-1.fc21.src.rpm</rpm:sourcerpm>
+  </format>
+</package>
+"""
+
+
+def make_repo(repo_dir, packages):
+    os.makedirs(os.path.join(repo_dir, 'repodata'))
+    with open(os.path.join(repo_dir, 'repodata', 'repomd.xml'), 'w') as fd:
+        fd.write(REPOMD)
+    primary = PRIMARY_HEADER % len(packages)
+    for href, name, arch in packages:
+        pkg_path = os.path.join(repo_dir, href)
+        if not os.path.exists(os.path.dirname(pkg_path)):
+            os.makedirs(os.path.dirname(pkg_path))
+        with open(pkg_path, 'w') as fd:
+            fd.write('dummy rpm')
+        stat = os.stat(pkg_path)
+        primary += PRIMARY_PACKAGE.format(
+            name=name,
+            arch=arch,
+            href=href,
+            mtime=int(stat.st_mtime),
+            size=stat.st_size,
+        )
+    primary += '</metadata>\n'
+    primary_path = os.path.join(repo_dir, 'repodata', 'abcd-primary.xml.gz')
+    with gzip.open(primary_path, 'wb') as fd:
+        fd.write(primary.encode('utf-8'))
+
+
+def test_loads_binary_rpms_from_repodata(tmpdir):
+    repo_dir = str(tmpdir.join('rpm', 'fc21'))
+    make_repo(repo_dir, [
+        ('x86_64/pkg1-1.0-1.fc21.x86_64.rpm', 'pkg1', 'x86_64'),
+    ])
+
+    loader = repodata.RepodataLoader(str(tmpdir))
+    metadata = loader.get(
+        os.path.join(repo_dir, 'x86_64/pkg1-1.0-1.fc21.x86_64.rpm')
+    )
+
+    assert metadata['name'] == 'pkg1'
+    assert metadata['version'] == '1.0'
+    assert metadata['release'] == '1.fc21'
+    assert metadata['arch'] == 'x86_64'
+    assert metadata['checksum'] == ['sha256', '1234']
+    assert not metadata['is_source']
+    assert 'key_hex' not in metadata
+
+
+def test_ignores_changed_and_source_rpms(tmpdir):
+    repo_dir = str(tmpdir.join('rpm', 'fc21'))
+    make_repo(repo_dir, [
+        ('x86_64/pkg1-1.0-1.fc21.x86_64.rpm', 'pkg1', 'x86_64'),
+        ('SRPMS/pkg1-1.0-1.fc21.src.rpm', 'pkg1', 'src'),
+    ])
+    with open(os.path.join(repo_dir, 'x86_64/pkg1-1.0-1.fc21.x86_64.rpm'),
+              'w') as fd:
+        fd.write('changed rpm')
+
+    loader = repodata.RepodataLoader(str(tmpdir))
+
+    assert loader.get(
+        os.path.join(repo_dir, 'x86_64/pkg1-1.0-1.fc21.x86_64.rpm')
+    ) is None
+    assert loader.get(
+        os.path.join(repo_dir, 'SRPMS/pkg1-1.0-1.fc21.src.rpm')
+    ) is None
+
+
+def test_ignores_rpms_without_repodata(tmpdir):
+    pkg_path = tmpdir.join('rpm', 'fc21', 'x86_64', 'pkg1.rpm')
+    pkg_path.ensure()
+
+    assert repodata.RepodataLoader(str(tmpdir)).get(str(pkg_path)) is None
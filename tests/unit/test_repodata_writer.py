@@ -0,0 +1,137 @@
+import os
+import shutil
+import subprocess
+import xml.etree.ElementTree as ET
+
+import pytest
+
+pytest.importorskip('rpm')
+repodata_writer = pytest.importorskip(
+    'repoman.common.stores.RPM.repodata_writer'
+)
+
+from repoman.common.index import FileIndex  # noqa
+from repoman.common.stores.RPM import repodata  # noqa
+
+FIXTURES_DIR = os.path.join(
+    os.path.dirname(__file__), '..', 'functional', 'fixtures',
+)
+FIXTURE_RPMS = (
+    'signed_rpm-1.0-1.fc21.x86_64.rpm',
+    'unsigned_rpm-1.1-1.fc21.x86_64.rpm',
+    'signed_rpm-1.0-1.fc21.src.rpm',
+)
+
+
+def has_createrepo_c():
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.call(
+            ['which', 'createrepo_c'], stdout=devnull, stderr=devnull,
+        ) == 0
+
+
+def make_repo(repo_dir):
+    os.makedirs(repo_dir)
+    for rpm_name in FIXTURE_RPMS:
+        shutil.copy2(
+            os.path.join(FIXTURES_DIR, rpm_name),
+            os.path.join(repo_dir, rpm_name),
+        )
+    return [os.path.join(repo_dir, rpm_name) for rpm_name in FIXTURE_RPMS]
+
+
+def get_primary_format(repo_dir):
+    """
+    Returns the provides and files of each package in the primary metadata
+    of the given repo, by package location
+    """
+    packages = {}
+    primary_fd = repodata.open_compressed(repodata.get_primary_path(repo_dir))
+    with primary_fd:
+        for _, elem in ET.iterparse(primary_fd):
+            if elem.tag != repodata.COMMON_NS + 'package':
+                continue
+            fmt = elem.find(repodata.COMMON_NS + 'format')
+            location = elem.find(repodata.COMMON_NS + 'location').get('href')
+            packages[location] = {
+                'provides': sorted(
+                    entry.get('name')
+                    for entry in fmt.iter(repodata.RPM_NS + 'entry')
+                    if entry.get('name')
+                ),
+                'files': sorted(
+                    file_elem.text
+                    for file_elem in fmt.iter(repodata.COMMON_NS + 'file')
+                ),
+            }
+    return packages
+
+
+@pytest.mark.skipif(not has_createrepo_c(), reason='needs createrepo_c')
+def test_primary_matches_createrepo_c(tmpdir):
+    native_dir = str(tmpdir.join('native'))
+    createrepo_dir = str(tmpdir.join('createrepo'))
+    pkg_paths = make_repo(native_dir)
+    make_repo(createrepo_dir)
+
+    repodata_writer.write_repodata(native_dir, pkg_paths)
+    subprocess.check_call(['createrepo_c', '-q', createrepo_dir])
+
+    def relative(repo_dir):
+        return dict(
+            (os.path.relpath(path, repo_dir), info)
+            for path, info in repodata.iter_primary(repo_dir)
+        )
+
+    native = relative(native_dir)
+    expected = relative(createrepo_dir)
+    assert sorted(native) == sorted(expected)
+    for location, info in expected.items():
+        for field in (
+            'name', 'arch', 'epoch', 'version', 'release', 'checksum',
+            'sourcerpm', 'size',
+        ):
+            assert native[location][field] == info[field], field
+    assert get_primary_format(native_dir) == get_primary_format(
+        createrepo_dir
+    )
+
+
+def test_reuses_known_checksums(tmpdir):
+    repo_dir = str(tmpdir.join('repo'))
+    pkg_paths = make_repo(repo_dir)
+    checksums = {pkg_paths[0]: ['sha256', 'known']}
+
+    repodata_writer.write_repodata(repo_dir, pkg_paths, checksums=checksums)
+
+    loaded = dict(repodata.iter_primary(repo_dir))
+    assert loaded[pkg_paths[0]]['checksum'] == ['sha256', 'known']
+    assert set(checksums) == set(pkg_paths)
+    assert checksums[pkg_paths[1]][1] == loaded[pkg_paths[1]]['checksum'][1]
+
+
+def test_reuses_the_info_of_the_unchanged_rpms(tmpdir, monkeypatch):
+    repo_dir = str(tmpdir.join('repo'))
+    pkg_paths = make_repo(repo_dir)
+    pkg_index = FileIndex(str(tmpdir.join('repodata_pkgs.json')))
+    repodata_writer.write_repodata(repo_dir, pkg_paths, pkg_index=pkg_index)
+    pkg_index.save()
+    expected = get_primary_format(repo_dir)
+    read_headers = []
+    read_header = repodata_writer.read_header
+
+    def counting_read_header(path):
+        read_headers.append(path)
+        return read_header(path)
+
+    monkeypatch.setattr(repodata_writer, 'read_header', counting_read_header)
+    os.utime(pkg_paths[1], None)
+
+    repodata_writer.write_repodata(
+        repo_dir,
+        pkg_paths,
+        pkg_index=FileIndex(str(tmpdir.join('repodata_pkgs.json'))),
+    )
+
+    assert read_headers == [pkg_paths[1]]
+    assert get_primary_format(repo_dir) == expected
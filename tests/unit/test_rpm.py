@@ -0,0 +1,213 @@
+import importlib
+import os
+
+from repoman.common.stores.RPM.RPM import get_filename_metadata
+
+
+FIXTURES_DIR = os.path.join(
+    os.path.dirname(__file__), '..', 'functional', 'fixtures'
+)
+# the RPM package exports the RPM class with the same name as the module
+rpm_module = importlib.import_module('repoman.common.stores.RPM.RPM')
+SIGNED_RPM = os.path.join(FIXTURES_DIR, 'signed_rpm-1.0-1.fc21.x86_64.rpm')
+
+
+def test_guesses_metadata_from_filename():
+    metadata = get_filename_metadata(
+        'http://example.com/rpms/kexec-tools-2.0.4-32.1.el7.x86_64.rpm'
+    )
+
+    assert metadata == {
+        'name': 'kexec-tools',
+        'version': '2.0.4',
+        'release': '32.1.el7',
+        'arch': 'x86_64',
+        'is_source': False,
+    }
+
+
+def test_does_not_guess_source_or_malformed_filenames():
+    assert get_filename_metadata('pkg1-1.0-1.fc21.src.rpm') is None
+    assert get_filename_metadata('pkg1-1.0.x86_64.rpm') is None
+    assert get_filename_metadata('pkg1.rpm') is None
+
+
+def test_downloads_only_the_headers(tmpdir, monkeypatch):
+    with open(SIGNED_RPM, 'rb') as rpm_fd:
+        rpm_data = rpm_fd.read()
+    requests = []
+
+    def download_range(url, start, end, verify=True):
+        requests.append((start, end))
+        return rpm_data[start:end + 1]
+
+    monkeypatch.setattr(rpm_module, 'download_range', download_range)
+    monkeypatch.setattr(rpm_module, 'HEADERS_FETCH_SIZE', 64)
+    dest_path = str(tmpdir.join('signed_rpm.rpm'))
+
+    rpm_module.download_headers('http://example.com/rpm', dest_path)
+
+    with open(dest_path, 'rb') as rpm_fd:
+        headers_data = rpm_fd.read()
+    assert len(requests) > 1
+    assert len(headers_data) < len(rpm_data)
+    assert rpm_data.startswith(headers_data)
+    assert rpm_module.get_headers_size(headers_data) == len(headers_data)
+
+
+def make_rpm(version, inode, is_source=False):
+    ver, rel = version.split('-')
+    return rpm_module.RPM(
+        '/repo/%d.rpm' % inode,
+        metadata={
+            'name': 'pkg1',
+            'version': ver,
+            'release': rel,
+            'arch': 'x86_64',
+            'is_source': is_source,
+            'inode': inode,
+        },
+    )
+
+
+def test_gets_latest_versions_with_binaries():
+    rpms = rpm_module.RPMList()
+    rpms.add_pkg(make_rpm('1.0-1.fc21', 1))
+    rpms.add_pkg(make_rpm('1.10-1.fc21', 2, is_source=True))
+    rpms.add_pkg(make_rpm('1.2-1.fc21', 3))
+    rpms.add_pkg(make_rpm('1.2-2.fc21', 4))
+    versions = rpms['pkg1.fc21.x86_64']
+
+    assert list(versions.iter_newest()) == [
+        '1.10-1', '1.2-2', '1.2-1', '1.0-1',
+    ]
+    assert sorted(versions.get_latest(num=2)) == ['1.2-1', '1.2-2']
+    assert versions.is_latest('1.2-2')
+
+    versions.pop('1.2-2')
+
+    assert list(versions.get_latest()) == ['1.2-1']
+
+
+def test_adds_only_newer_versions():
+    rpms = rpm_module.RPMList()
+    rpms.add_pkg(make_rpm('1.2-1.fc21', 1))
+
+    assert not rpms.add_pkg(make_rpm('1.2-1.fc21', 2), onlyifnewer=True)
+    assert not rpms.add_pkg(make_rpm('1.0-1.fc21', 3), onlyifnewer=True)
+    assert rpms.add_pkg(make_rpm('1.10-1.fc21', 4), onlyifnewer=True)
+
+
+def test_sign_pkgs_reports_the_failed_packages(monkeypatch):
+    pkgs = [make_rpm('1.%d-1.fc21' % idx, idx) for idx in range(4)]
+    signed_with = {
+        pkgs[0].path: 'KEY',
+        pkgs[2].path: 'OTHERKEY',
+    }
+    rpmsign_calls = []
+
+    def reload_signature(pkg):
+        pkg._key_hex = signed_with.get(pkg.path)
+
+    def run_rpmsign(paths, keyuid, passwd):
+        rpmsign_calls.append(paths)
+        return 1
+
+    monkeypatch.setattr(
+        rpm_module, 'delete_signatures', lambda paths: [pkgs[3].path],
+    )
+    monkeypatch.setattr(rpm_module, 'run_rpmsign', run_rpmsign)
+    monkeypatch.setattr(rpm_module.RPM, 'reload_signature', reload_signature)
+    monkeypatch.setattr(os.path, 'getsize', lambda path: 1)
+
+    failed = rpm_module.sign_pkgs(pkgs, key_hex='KEY', passwd='pass')
+
+    assert sorted(rpmsign_calls[0]) == sorted(
+        pkg.path for pkg in pkgs[:3]
+    )
+    assert len(rpmsign_calls) == 1
+    assert sorted(pkg.path for pkg in failed) == sorted(
+        pkg.path for pkg in pkgs[1:]
+    )
+
+
+def test_splits_the_packages_to_sign_between_workers(tmpdir):
+    paths = []
+    for idx, size in enumerate((10, 50, 20, 40, 30)):
+        pkg_path = tmpdir.join('pkg%d.rpm' % idx)
+        pkg_path.write('x' * size)
+        paths.append(str(pkg_path))
+
+    chunks = rpm_module.get_sign_chunks(paths, workers=2)
+
+    assert [
+        [os.path.getsize(path) for path in chunk] for chunk in chunks
+    ] == [[50, 30, 10], [40, 20]]
+
+
+def test_formats_paths_with_the_rpm_properties(monkeypatch):
+    pkg = make_rpm('1.2-1.fc21', 1)
+    loaded = []
+
+    def load_header_fields(pkg):
+        loaded.append(pkg.path)
+        pkg._sourcerpm = 'pkg1-1.2-1.fc21.src.rpm'
+        pkg._signature = None
+        pkg._key_hex = None
+
+    monkeypatch.setattr(
+        rpm_module.RPM, 'load_header_fields', load_header_fields,
+    )
+
+    assert pkg.format_path('/repo/{_name}/{version}') == '/repo/pkg1/1.2-1'
+    assert not loaded
+    assert pkg.format_path('{name}/{version}/{sourcerpm}') == (
+        'pkg1.fc21.x86_64/1.2-1/pkg1-1.2-1.fc21.src.rpm'
+    )
+    assert loaded == [pkg.path]
+
+
+def test_signed_from_any_signature_tag(monkeypatch):
+    for tag_num, tag_name in enumerate(rpm_module.SIGNATURE_TAGS):
+        monkeypatch.setattr(
+            rpm_module.rpm, tag_name, tag_num + 1, raising=False,
+        )
+    with open(SIGNED_RPM, 'rb') as rpm_fd:
+        rpm_data = rpm_fd.read()
+    # the rsa header signature of the fixture, a v4 pgp signature packet
+    signature_start = rpm_data.index(b'\x89\x01\x1c\x04\x00\x01\x02')
+    signature = rpm_data[signature_start:signature_start + 287]
+    hdr = dict((tag_num + 1, None) for tag_num in range(4))
+
+    assert rpm_module.get_signature_metadata(SIGNED_RPM, hdr) == {
+        'signed': False,
+        'key_hex': None,
+    }
+
+    # only a header signature, no RPMTAG_SIGPGP
+    hdr[rpm_module.rpm.RPMTAG_RSAHEADER] = signature
+    assert rpm_module.get_signature_metadata(SIGNED_RPM, hdr) == {
+        'signed': True,
+        'key_hex': 'BEDC9C4BE614E4BA',
+    }
+
+
+def test_str_loads_the_signature_on_demand(monkeypatch):
+    pkg = make_rpm('1.2-1.fc21', 1)
+    loaded = []
+
+    def load_header_fields(pkg):
+        loaded.append(pkg.path)
+        pkg._sourcerpm = 'pkg1-1.2-1.fc21.src.rpm'
+        pkg._signature = True
+        pkg._key_hex = 'KEY'
+
+    monkeypatch.setattr(
+        rpm_module.RPM, 'load_header_fields', load_header_fields,
+    )
+
+    assert str(pkg) == 'rpm(pkg1.fc21.x86_64 1.2 1.fc21 x86_64 bin signed)'
+    assert loaded == [pkg.path]
+    # already loaded, the header is not read again
+    assert str(pkg) == 'rpm(pkg1.fc21.x86_64 1.2 1.fc21 x86_64 bin signed)'
+    assert loaded == [pkg.path]
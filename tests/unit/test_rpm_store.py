@@ -0,0 +1,289 @@
+import importlib
+import logging
+import os
+
+import pytest
+
+from repoman.common.config import Config
+from repoman.common.filters.latest import LatestFilter
+from repoman.common.filters.only_missing import OnlyMissingFilter
+from repoman.common.stores.RPM import RPMStore
+
+
+# the RPM package exports the RPMStore class, get the module to patch it
+store_module = importlib.import_module('repoman.common.stores.RPM')
+rpm_module = importlib.import_module('repoman.common.stores.RPM.RPM')
+
+
+def make_store(repo_path, **options):
+    config = Config().get_section('store.RPMStore')
+    config.set('createrepo_workers', '1')
+    for name, value in options.items():
+        config.set(name, value)
+    return RPMStore(config=config, repo_path=repo_path)
+
+
+def add_pkg(store, name, version, inode):
+    ver, rel = version.split('-')
+    pkg_path = os.path.join(
+        store.path, 'rpm', '%s-%s.x86_64.rpm' % (name, version),
+    )
+    store.add_artifact(
+        pkg_path,
+        to_copy=False,
+        hidelog=True,
+        metadata={
+            'name': name,
+            'version': ver,
+            'release': rel,
+            'arch': 'x86_64',
+            'is_source': False,
+            'inode': inode,
+        },
+    )
+    return store.get_rpms(fmatch=lambda pkg: pkg.path == pkg_path)[0]
+
+
+def make_distro(repo_path, distro, size=1, with_metadata=True,
+                with_srpms=False):
+    dst_dir = repo_path.join('rpm', distro)
+    dst_dir.join('pkg.rpm').write('x' * size, ensure=True)
+    if with_metadata:
+        dst_dir.join('repodata', 'repomd.xml').write('', ensure=True)
+    if with_srpms:
+        dst_dir.join('SRPMS', 'pkg.src.rpm').write('x', ensure=True)
+        if with_metadata:
+            dst_dir.join('SRPMS', 'repodata', 'repomd.xml').write(
+                '', ensure=True,
+            )
+    return str(dst_dir)
+
+
+@pytest.fixture
+def createrepo_calls(monkeypatch):
+    calls = []
+
+    def run_createrepo(job):
+        calls.append(job)
+        return job[0], 0, 0.1
+
+    monkeypatch.setattr(store_module, 'run_createrepo', run_createrepo)
+    monkeypatch.setattr(
+        store_module, 'get_createrepo_cmd', lambda: 'createrepo_c',
+    )
+    return calls
+
+
+def test_createrepos_skips_unchanged_distros(tmpdir, createrepo_calls):
+    store = make_store(str(tmpdir))
+    make_distro(tmpdir, 'fc21')
+    el7_dir = make_distro(tmpdir, 'el7')
+    el8_dir = make_distro(tmpdir, 'el8', with_metadata=False)
+    store.distros.update(('fc21', 'el7', 'el8'))
+    store.realized_paths.add(str(tmpdir))
+    store.dirty_repos.add((str(tmpdir), 'el7'))
+
+    store.createrepos()
+
+    cache_dir = str(tmpdir.join('.repoman', 'createrepo_cache'))
+    assert sorted(createrepo_calls) == sorted([
+        (el7_dir, [
+            'createrepo_c', '--excludes=*.src.rpm',
+            '--update', '--cachedir', os.path.join(cache_dir, 'el7', 'rpms'),
+            el7_dir,
+        ]),
+        # no metadata yet
+        (el8_dir, [
+            'createrepo_c', '--excludes=*.src.rpm',
+            '--update', '--cachedir', os.path.join(cache_dir, 'el8', 'rpms'),
+            el8_dir,
+        ]),
+    ])
+    assert store.dirty_repos == set()
+
+
+def test_adding_or_removing_marks_only_its_distro(tmpdir, monkeypatch):
+    store = make_store(str(tmpdir))
+    el7_pkg = add_pkg(store, 'pkg1', '1.0-1.el7', inode=1)
+    add_pkg(store, 'pkg2', '1.0-1.fc21', inode=2)
+    monkeypatch.setattr(os.path, 'exists', lambda path: False)
+
+    assert store.dirty_repos == set()
+
+    store.mark_dirty(el7_pkg)
+    assert store.dirty_repos == set([(str(tmpdir), 'el7')])
+
+    store.delete_version('pkg2.fc21.x86_64', '1.0-1')
+    assert store.dirty_repos == set([
+        (str(tmpdir), 'el7'),
+        (str(tmpdir), 'fc21'),
+    ])
+
+
+def test_createrepos_not_incremental_runs_all(tmpdir, createrepo_calls):
+    store = make_store(str(tmpdir), incremental_createrepo='false')
+    fc21_dir = make_distro(tmpdir, 'fc21', with_srpms=True)
+    el7_dir = make_distro(tmpdir, 'el7')
+    store.distros.update(('fc21', 'el7'))
+    store.realized_paths.add(str(tmpdir))
+
+    store.createrepos()
+
+    assert sorted(createrepo_calls) == sorted([
+        (el7_dir, ['createrepo_c', '--excludes=*.src.rpm', el7_dir]),
+        (fc21_dir, ['createrepo_c', '--excludes=*.src.rpm', fc21_dir]),
+        (
+            os.path.join(fc21_dir, 'SRPMS'),
+            ['createrepo_c', os.path.join(fc21_dir, 'SRPMS')],
+        ),
+    ])
+
+
+def test_createrepos_runs_the_biggest_repos_first(tmpdir, monkeypatch, caplog,
+                                                  createrepo_calls):
+    store = make_store(str(tmpdir), createrepo_workers='4')
+    small_dir = make_distro(tmpdir, 'el7', size=10, with_metadata=False)
+    big_dir = make_distro(
+        tmpdir, 'el8', size=1000, with_metadata=False, with_srpms=True,
+    )
+    medium_dir = make_distro(tmpdir, 'fc21', size=100, with_metadata=False)
+    store.distros.update(('el7', 'el8', 'fc21'))
+    store.realized_paths.add(str(tmpdir))
+    map_calls = []
+
+    def parallel_map(func, items, workers, chunksize):
+        map_calls.append((items, workers, chunksize))
+        return [func(item) for item in items]
+
+    monkeypatch.setattr(store_module, 'parallel_map', parallel_map)
+    caplog.set_level(logging.INFO)
+
+    store.createrepos()
+
+    assert [repo_dir for repo_dir, _ in map_calls[0][0]] == [
+        big_dir, medium_dir, small_dir, os.path.join(big_dir, 'SRPMS'),
+    ]
+    assert map_calls[0][1:] == (4, 1)
+    assert 'Created metadata for %s in 0.10s' % big_dir in caplog.text
+
+
+def test_createrepos_reports_the_failed_jobs(tmpdir, monkeypatch):
+    store = make_store(str(tmpdir))
+    el7_dir = make_distro(tmpdir, 'el7', with_metadata=False)
+    make_distro(tmpdir, 'el8', with_metadata=False)
+    store.distros.update(('el7', 'el8'))
+    store.realized_paths.add(str(tmpdir))
+
+    def run_createrepo(job):
+        return job[0], 1 if job[0] == el7_dir else 0, 0.1
+
+    monkeypatch.setattr(store_module, 'run_createrepo', run_createrepo)
+    monkeypatch.setattr(
+        store_module, 'get_createrepo_cmd', lambda: 'createrepo_c',
+    )
+
+    with pytest.raises(store_module.CreatereposError) as error:
+        store.createrepos()
+
+    assert el7_dir in str(error.value)
+    assert 'el8' not in str(error.value)
+
+
+def fail_on_negative(number):
+    if number < 0:
+        raise ValueError('negative number %d' % number)
+    return number
+
+
+def test_parallel_map_raises_the_errors_of_the_pool():
+    assert store_module.parallel_map(
+        fail_on_negative, [1, 2, 3], workers=2, chunksize=1,
+    ) == [1, 2, 3]
+    with pytest.raises(ValueError):
+        store_module.parallel_map(
+            fail_on_negative, [1, -2, 3], workers=2, chunksize=1,
+        )
+
+
+@pytest.fixture
+def remote_rpms(monkeypatch):
+    """
+    Fakes the downloads of the rpms, the headers being the start of the
+    payload, and the headers reading, guessing them from the file names
+    """
+    downloads = []
+
+    def download_headers(url, dest_path, verify=True):
+        with open(dest_path, 'w') as dest_fd:
+            dest_fd.write('headers of %s' % url)
+
+    def download(url, dest_path, verify=True):
+        downloads.append(url)
+        with open(dest_path + '.part', 'w') as dest_fd:
+            dest_fd.write('headers of %s and payload' % url)
+        os.rename(dest_path + '.part', dest_path)
+
+    def read_metadata(path):
+        metadata = rpm_module.get_filename_metadata(path)
+        metadata.update({'sourcerpm': None, 'signed': False, 'key_hex': None})
+        return metadata
+
+    monkeypatch.setattr(rpm_module, 'download_headers', download_headers)
+    monkeypatch.setattr(rpm_module, 'download', download)
+    monkeypatch.setattr(rpm_module, 'read_metadata', read_metadata)
+    monkeypatch.setattr(RPMStore, 'createrepos', lambda self: None)
+    return downloads
+
+
+@pytest.mark.parametrize('filter_class,filter_str', [
+    (LatestFilter, 'latest'),
+    (OnlyMissingFilter, 'only-missing'),
+])
+def test_filters_keep_the_urls_of_the_headers_only_rpms(
+    tmpdir, remote_rpms, filter_class, filter_str,
+):
+    tmpdir.mkdir('tmp')
+    store = make_store(
+        str(tmpdir.join('repo')),
+        remote_headers_only='true',
+        temp_dir=str(tmpdir.join('tmp')),
+    )
+    urls = [
+        'http://example.com/pkg1-1.0-1.el7.x86_64.rpm',
+        'http://example.com/pkg1-1.1-1.el7.x86_64.rpm',
+    ]
+
+    _, filtered = filter_class(
+        config=store.config, stores=[store],
+    ).filter(filter_str, urls)
+
+    assert sorted(filtered) == [urls[1]]
+
+    for artifact in filtered:
+        store.add_artifact(artifact)
+    store.save()
+
+    assert remote_rpms == [urls[1]]
+    assert tmpdir.join(
+        'repo', 'rpm', 'el7', 'x86_64', 'pkg1-1.1-1.el7.x86_64.rpm',
+    ).read() == 'headers of %s and payload' % urls[1]
+
+
+def test_save_updates_the_inodes_of_the_downloaded_payloads(
+    tmpdir, remote_rpms,
+):
+    tmpdir.mkdir('tmp')
+    store = make_store(
+        str(tmpdir.join('repo')),
+        remote_headers_only='true',
+        temp_dir=str(tmpdir.join('tmp')),
+    )
+    store.add_artifact('http://example.com/pkg1-1.0-1.el7.x86_64.rpm')
+    pkg = store.get_artifacts()[0]
+    headers_inode = pkg.inode
+
+    store.save()
+
+    assert pkg.inode == os.stat(pkg.path).st_ino
+    assert pkg.inode != headers_inode
+    assert list(store.artifacts[pkg.name][pkg.version].keys()) == [pkg.inode]
@@ -0,0 +1,442 @@
+import base64
+import errno
+import hashlib
+import os
+import struct
+
+import pytest
+import requests
+
+from repoman.common import utils
+
+
+FIXTURES_DIR = os.path.join(
+    os.path.dirname(__file__), '..', 'functional', 'fixtures'
+)
+FIXTURES_KEY_ID = 'BEDC9C4BE614E4BA'
+RAW_KEY_ID = b'\xbe\xdc\x9c\x4b\xe6\x14\xe4\xba'
+
+
+def get_signature_tag(rpm_path, tag):
+    """Extracts the given tag from the signature header of an rpm"""
+    with open(rpm_path, 'rb') as rpm_fd:
+        data = rpm_fd.read()
+    # skip the lead and the header magic
+    nindex, _ = struct.unpack('>II', data[104:112])
+    store_start = 112 + nindex * 16
+    for pos in range(112, store_start, 16):
+        entry_tag, _, offset, count = struct.unpack(
+            '>IIII', data[pos:pos + 16]
+        )
+        if entry_tag == tag:
+            return data[store_start + offset:store_start + offset + count]
+    return None
+
+
+def v4_signature(hashed=b'', unhashed=b''):
+    body = (
+        b'\x04\x00\x01\x08'
+        + struct.pack('>H', len(hashed)) + hashed
+        + struct.pack('>H', len(unhashed)) + unhashed
+        + b'\x00\x00'
+    )
+    return b'\xc2' + struct.pack('B', len(body)) + body
+
+
+@pytest.mark.parametrize('tag', [268, 1002])
+def test_pgp_signature_key_id_from_rpm(tag):
+    signature = get_signature_tag(
+        os.path.join(FIXTURES_DIR, 'signed_rpm-1.0-1.fc21.x86_64.rpm'),
+        tag,
+    )
+    assert utils.pgp_signature_key_id(signature) == FIXTURES_KEY_ID
+
+
+@pytest.mark.parametrize('signature', [
+    # v4 with issuer in the hashed subpackets
+    v4_signature(hashed=b'\x09\x10' + RAW_KEY_ID),
+    # v4 with only the issuer fingerprint
+    v4_signature(hashed=b'\x16\x21\x04' + b'\x00' * 12 + RAW_KEY_ID),
+    # v3, old format packet
+    b'\x88\x0c\x03\x05\x00\x00\x00\x00\x00' + RAW_KEY_ID,
+])
+def test_pgp_signature_key_id(signature):
+    assert utils.pgp_signature_key_id(signature) == FIXTURES_KEY_ID
+
+
+@pytest.mark.parametrize('signature', [
+    b'',
+    v4_signature(),
+    # not a signature packet
+    b'\x99\x01\x0d',
+])
+def test_pgp_signature_key_id_without_key(signature):
+    assert utils.pgp_signature_key_id(signature) is None
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_parallel_map_keeps_order(workers):
+    items = list(range(-50, 50))
+    assert utils.parallel_map(abs, items, workers=workers) == [
+        abs(item) for item in items
+    ]
+
+
+def test_chunk_args_respects_max_size():
+    args = ['/repo/rpm/pkg%d.rpm' % idx for idx in range(100)]
+    chunks = list(utils.chunk_args(args, max_size=200))
+
+    assert len(chunks) > 1
+    assert [arg for chunk in chunks for arg in chunk] == args
+    assert all(
+        sum(len(arg) + 9 for arg in chunk) <= 200 for chunk in chunks
+    )
+
+
+@pytest.mark.parametrize('older, newer', [
+    ('1.0', '1.0.1'),
+    ('1.2', '1.10'),
+    ('1.0a', '1.0.1'),
+    ('1.0', '1.0a'),
+    ('1.a', '1.1'),
+    ('1.0~rc1', '1.0'),
+    ('1.0~~', '1.0~'),
+    ('1.0', '1.0^git1'),
+    ('1.0^git1', '1.0.1'),
+    ('1.0^git1', '1.0a'),
+])
+def test_version_key_ordering(older, newer):
+    assert utils.VersionKey(older) < utils.VersionKey(newer)
+    assert utils.cmpver(older, newer) == 1
+    assert utils.cmpver(newer, older) == -1
+
+
+@pytest.mark.parametrize('ver1, ver2', [
+    ('1.0', '1.0'),
+    ('1.0', '1_0'),
+    ('1.01', '1.1'),
+    ('1.0', '1.0.'),
+])
+def test_version_key_equal(ver1, ver2):
+    assert utils.VersionKey(ver1) == utils.VersionKey(ver2)
+    assert utils.cmpver(ver1, ver2) == 0
+
+
+def test_fullver_key_sorts_by_version_then_release():
+    versions = ['1.0-2.el7', '1.0-10.el7', '0.9-20.el7', '1.0-2.fc28']
+
+    assert sorted(versions, key=utils.get_fullver_key) == [
+        '0.9-20.el7', '1.0-2.el7', '1.0-2.fc28', '1.0-10.el7',
+    ]
+
+
+def test_gpg_key_is_loaded_once_per_key_file(tmpdir, monkeypatch):
+    loaded = []
+
+    class FakeGPGKey(object):
+        def __init__(self, key_path, use_agent=False):
+            loaded.append((key_path, use_agent))
+            self.mtime = os.stat(key_path).st_mtime
+
+    monkeypatch.setattr(utils, 'GPGKey', FakeGPGKey)
+    monkeypatch.setattr(utils, '_GPG_KEYS', {})
+    key_path = tmpdir.join('key.asc')
+    key_path.write('key')
+
+    gpg_key = utils.get_gpg_key(str(key_path))
+
+    assert utils.get_gpg_key(str(key_path)) is gpg_key
+    assert len(loaded) == 1
+
+    key_path.setmtime(gpg_key.mtime - 10)
+
+    assert utils.get_gpg_key(str(key_path)) is not gpg_key
+    assert len(loaded) == 2
+
+    agent_key = utils.get_gpg_key(str(key_path), use_agent=True)
+
+    assert agent_key is not utils.get_gpg_key(str(key_path))
+    assert loaded[-1] == (str(key_path), True)
+
+
+def test_gpg_key_keeps_the_gpg_settings(monkeypatch):
+    gpg_settings = []
+
+    def get_gpg(**kwargs):
+        gpg_settings.append(kwargs)
+        raise RuntimeError('stop before loading the key')
+
+    monkeypatch.setattr(utils, 'get_gpg', get_gpg)
+    key_path = os.path.join(FIXTURES_DIR, 'my_key.asc')
+    for use_agent in (False, True):
+        with pytest.raises(RuntimeError):
+            utils.GPGKey(key_path, use_agent=use_agent)
+
+    # ~/.gnupg without agent as get_gpg defaults, and as gpg_unlock with it
+    assert gpg_settings == [{}, {'homedir': None, 'use_agent': True}]
+
+
+def armor(signature):
+    body = base64.b64encode(signature)
+    return (
+        b'-----BEGIN PGP SIGNATURE-----\nVersion: GnuPG v1\n\n'
+        + b'\n'.join(body[idx:idx + 64] for idx in range(0, len(body), 64))
+        + b'\n=abcd\n-----END PGP SIGNATURE-----\n'
+    )
+
+
+@pytest.fixture
+def gpg_key(tmpdir):
+    gnupg = pytest.importorskip('gnupg')
+    homedir = tmpdir.mkdir('gnupg')
+    homedir.chmod(0o700)
+    try:
+        gpg = gnupg.GPG(gnupghome=str(homedir))
+    except (OSError, ValueError):
+        pytest.skip('gpg is not available')
+    return utils.GPGKey(os.path.join(FIXTURES_DIR, 'my_key.asc'), gpg=gpg)
+
+
+def test_has_valid_signature(tmpdir, gpg_key):
+    fname = tmpdir.join('source.tar.gz')
+    fname.write('source')
+    sig_path = tmpdir.join('source.tar.gz.sig')
+    gpg_key.sign_file(str(fname), passphrase='123456')
+
+    assert gpg_key.keyid == FIXTURES_KEY_ID
+    assert utils.has_valid_signature(str(fname), gpg_key)
+
+    sig_path.setmtime(fname.mtime() - 10)
+
+    assert not utils.has_valid_signature(str(fname), gpg_key)
+    assert not utils.has_valid_signature(str(sig_path), gpg_key)
+
+
+def test_has_valid_signature_checks_the_content(tmpdir, gpg_key):
+    fname = tmpdir.join('source.tar.gz')
+    fname.write('source')
+    gpg_key.sign_file(str(fname), passphrase='123456')
+    sig_path = tmpdir.join('source.tar.gz.sig')
+    signature = sig_path.read_binary()
+
+    # same size and mtime, different content
+    fname.write('sourcf')
+    sig_path.setmtime(fname.mtime() + 10)
+    assert not utils.has_valid_signature(str(fname), gpg_key)
+
+    # the issuer can be read but it's not a valid signature
+    sig_path.write_binary(armor(v4_signature(hashed=b'\x09\x10' + RAW_KEY_ID)))
+    assert not utils.has_valid_signature(str(fname), gpg_key)
+
+    fname.write('source')
+    sig_path.write_binary(signature)
+    sig_path.setmtime(fname.mtime() + 10)
+    assert utils.has_valid_signature(str(fname), gpg_key)
+
+
+def test_has_valid_signature_checks_the_key(tmpdir):
+    fname = tmpdir.join('source.tar.gz')
+    fname.write('source')
+    tmpdir.join('source.tar.gz.sig').write_binary(
+        armor(v4_signature(hashed=b'\x09\x10' + RAW_KEY_ID))
+    )
+
+    class OtherGPGKey(object):
+        keyid = 'OTHERKEYID'
+
+        def verify_file(self, fname):
+            raise AssertionError('should not run gpg for another key')
+
+    assert not utils.has_valid_signature(str(fname), OtherGPGKey())
+
+
+def test_sign_detached_skips_signed_files(tmpdir, monkeypatch):
+    signed = []
+    verified = []
+
+    class FakeGPGKey(object):
+        keyid = FIXTURES_KEY_ID
+
+        def sign_file(self, fname, passphrase=None):
+            signed.append(fname)
+
+        def verify_file(self, fname):
+            verified.append(fname)
+            return True
+
+    monkeypatch.setattr(utils, 'get_gpg_key', lambda key: FakeGPGKey())
+    tmpdir.join('src', 'new.patch').write('patch', ensure=True)
+    tmpdir.join('src', 'old.tar.gz').write('source')
+    tmpdir.join('src', 'old.tar.gz.sig').write_binary(
+        armor(v4_signature(hashed=b'\x09\x10' + RAW_KEY_ID))
+    )
+
+    assert utils.sign_detached(str(tmpdir.join('src')), 'key', workers=2) == (
+        1, 1,
+    )
+    assert signed == [str(tmpdir.join('src', 'new.patch'))]
+    assert verified == [str(tmpdir.join('src', 'old.tar.gz'))]
+
+
+def test_get_file_digests(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, 'DIGEST_CHUNK_SIZE', 7)
+    fname = tmpdir.join('file.iso')
+    fname.write_binary(b'some iso content' * 10)
+
+    digests = utils.get_file_digests(str(fname))
+
+    assert sorted(digests) == ['md5', 'sha256', 'sha512']
+    for algorithm, digest in digests.items():
+        assert digest == hashlib.new(
+            algorithm, b'some iso content' * 10,
+        ).hexdigest()
+
+
+@pytest.mark.skipif(not hasattr(os, 'setxattr'), reason='needs xattrs')
+def test_get_file_digests_caches_in_xattr(tmpdir):
+    fname = tmpdir.join('file.iso')
+    fname.write('content')
+    try:
+        os.setxattr(str(fname), 'user.test', b'1')
+    except OSError:
+        pytest.skip('filesystem without user xattrs')
+
+    digests = utils.get_file_digests(str(fname), use_xattr=True)
+    stat = os.stat(str(fname))
+    assert utils.read_digests_xattr(
+        str(fname), stat, utils.DIGEST_ALGORITHMS,
+    ) == digests
+
+    fname.write('changed')
+    assert utils.read_digests_xattr(
+        str(fname), os.stat(str(fname)), utils.DIGEST_ALGORITHMS,
+    ) is None
+    assert utils.get_file_digests(str(fname), use_xattr=True) != digests
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, data, headers=None, fail_after=None):
+        self.status_code = status_code
+        self.reason = 'reason'
+        self.data = data
+        self.headers = headers or {}
+        self.fail_after = fail_after
+
+    def iter_content(self, chunk_size):
+        for pos in range(0, len(self.data), 4):
+            if self.fail_after is not None and pos >= self.fail_after:
+                raise requests.exceptions.ConnectionError('dropped')
+            yield self.data[pos:pos + 4]
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def get(self, url, stream, verify, headers):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+def test_download_resumes_after_errors(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, 'DOWNLOAD_BACKOFF', 0)
+    data = b'0123456789abcdefghij'
+    headers = {'etag': '"v1"', 'content-length': str(len(data))}
+    session = FakeSession([
+        FakeResponse(200, data, headers, fail_after=8),
+        FakeResponse(503, b''),
+        FakeResponse(206, data[8:], {'etag': '"v1"'}),
+    ])
+    dest_path = tmpdir.join('file.iso')
+    dest_path.write('old content')
+    link_path = tmpdir.join('link.iso')
+    os.link(str(dest_path), str(link_path))
+
+    utils.download(
+        'http://host/file.iso', str(dest_path), session=session,
+        show_progress=False,
+    )
+
+    assert dest_path.read_binary() == data
+    assert link_path.read() == 'old content'
+    assert session.requests[2] == {'Range': 'bytes=8-', 'If-Range': '"v1"'}
+    assert not tmpdir.join('file.iso.part').exists()
+    assert not tmpdir.join('file.iso.part.json').exists()
+
+
+def test_download_restarts_if_the_file_changed(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, 'DOWNLOAD_BACKOFF', 0)
+    old_data = b'0123456789'
+    new_data = b'abcdefghijkl'
+    session = FakeSession([
+        FakeResponse(200, old_data, {'etag': '"v1"'}, fail_after=4),
+        FakeResponse(200, new_data, {'etag': '"v2"'}),
+    ])
+    dest_path = str(tmpdir.join('file.iso'))
+
+    utils.download(
+        'http://host/file.iso', dest_path, session=session,
+        show_progress=False,
+    )
+
+    with open(dest_path, 'rb') as dest_fd:
+        assert dest_fd.read() == new_data
+
+
+def test_download_does_not_retry_missing_files(tmpdir):
+    session = FakeSession([FakeResponse(404, b'')])
+
+    with pytest.raises(utils.DownloadError):
+        utils.download(
+            'http://host/file.iso', str(tmpdir.join('file.iso')),
+            session=session, show_progress=False,
+        )
+    assert len(session.requests) == 1
+
+
+def test_from_human_size():
+    assert utils.from_human_size('512') == 512
+    assert utils.from_human_size('10K') == 10 * 1024
+    assert utils.from_human_size('1.5gb') == int(1.5 * 1024 ** 3)
+
+
+def test_list_files_skips_the_staging_dir(tmpdir):
+    tmpdir.join('el7', 'pkg.rpm').write('', ensure=True)
+    tmpdir.join('.repoman', 'staging', 'tmp1', 'new.rpm').write(
+        '', ensure=True,
+    )
+
+    assert utils.list_files(str(tmpdir), '.rpm') == [
+        str(tmpdir.join('el7', 'pkg.rpm')),
+    ]
+    assert utils.is_same_filesystem(
+        str(tmpdir.join('el7')), str(tmpdir.join('not', 'there', 'yet')),
+    )
+
+
+def test_copy_falls_back_to_the_next_strategy(tmpdir, monkeypatch):
+    src_path = tmpdir.join('src.iso')
+    src_path.write('x' * 1000)
+
+    def fail_link(what, where):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    monkeypatch.setitem(utils.COPY_STRATEGIES, 'link', fail_link)
+
+    strategy = utils.copy(
+        str(src_path), str(tmpdir.join('dst.iso')),
+        strategies=['link', 'copy_range', 'copy'],
+    )
+
+    assert strategy == 'copy_range'
+    assert tmpdir.join('dst.iso').read() == 'x' * 1000
+    with pytest.raises(OSError):
+        utils.copy(
+            str(src_path), str(tmpdir.join('other.iso')), strategies=['link'],
+        )
+    with pytest.raises(Exception):
+        utils.copy(str(src_path), str(tmpdir.join('x')), strategies=['bad'])